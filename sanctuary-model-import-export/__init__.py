@@ -13,16 +13,44 @@ bl_info = {
 }
 
 from . import (
+    sanmodel_format,
+    mesh_ops,
+    atlas,
+    sanmodel_diff,
+    bounds,
+    manifest,
+    archive,
+    registry,
+    estimate,
+    library,
     sanmodel,
+    textures,
     sanmodel_importer,
     sanmodel_exporter,
+    async_ops,
+    library_ops,
+    watch_ops,
     panels,
     utils,
 )
 import importlib
+importlib.reload(sanmodel_format)
+importlib.reload(mesh_ops)
+importlib.reload(atlas)
+importlib.reload(sanmodel_diff)
+importlib.reload(bounds)
+importlib.reload(manifest)
+importlib.reload(archive)
+importlib.reload(registry)
+importlib.reload(estimate)
+importlib.reload(library)
 importlib.reload(sanmodel)
+importlib.reload(textures)
 importlib.reload(sanmodel_importer)
 importlib.reload(sanmodel_exporter)
+importlib.reload(async_ops)
+importlib.reload(library_ops)
+importlib.reload(watch_ops)
 importlib.reload(panels)
 importlib.reload(utils)
 
@@ -30,6 +58,9 @@ modules = [
     sanmodel,
     sanmodel_importer,
     sanmodel_exporter,
+    async_ops,
+    library_ops,
+    watch_ops,
     panels,
 ]
 
@@ -56,14 +87,15 @@ if __name__ == "__main__":
     # [✅] tangents: actually ignored, they are computed from the normals and uv1, it seams they can't be manually set
     #       4th value is the bitangent_sign: #https://answers.unity.com/questions/7789/calculating-tangents-vector4.html
     # [✅] uv1
-    #       todo?: create the shading nodes, set the transparency "clip", change base color input as texture data, link everything (cf shader-nodes-2.png)
+    #       if "Load textures" is toggled: <name>.dds, <name>_normal.dds and <name>_mask.dds are linked to a shared material (cf textures.py)
     # [✅] uv2
     #   Sanctuary team:
     #    "we removed BoneWeights array and instead bone weights (if exist) are stored in UV2.x where X is int of bone ID. There is limit to only 1 bone per vertex."
     #    "some things like props can have additional UV data used for shaders. Only skinned meshes use uv2.x as skinning data"
+    #       without bindposes: imported in the "UV2Map" layer, exported from it by default when there is no armature
     # [✅] uv3
     # [✅] colors
-    #       imported in a vertex_colors array
+    #       imported in a point domain color attribute (1 color per vertex, no face corner data)
     #       if "Generate shading nodes" is toggled: create a "Vertex Color" node linked to a "Principled BSDF" node
     # [✅] indices
     # [❌] boneWeights
@@ -76,7 +108,7 @@ if __name__ == "__main__":
     #       todo: updates when selecting object: need to store original model name and link it with the object
     # [✅] vertices
     # [✅] normals
-    # [✅] tangents: swapping YZ axis or mirroring UV can invert bitangent_sign, this should be handled. cf MESH_OT_sanmodel_export.extract_tangents()
+    # [✅] tangents: computed from the exported vertices, normals and uv1 (MikkTSpace conventions), cf mesh_ops.compute_tangents
     # [✅] uv1: export the uv_layer named "UV1Map"
     # [✅] uv2: export the uv_layer named "UV2Map"
     # [✅] uv3: export the uv_layer named "UV3Map"
@@ -103,11 +135,13 @@ if __name__ == "__main__":
     #         checked the indices manually, everything seams OK. 
     # [✅] export a fbx based model, reimport the new sanmodel (fbx -> blender -> sanmodel -> blender) (rotations are not ok with the fbx importer, not our business)
     # [✅] export a sanmodel based model, reimport the new sanmodel (sanmodel -> blender -> sanmodel -> blender)
+    #       automated for the Models folder: scripts/roundtrip.py
     #
-    # [❌] Per object data on blender:
+    # [✅] Per object data on blender (custom properties "sanmodel_*", cf S.store_metadata):
     #       - original import file path
     #       - original object name
     #       - original import settings (swapYZ and mirrorUV)
+    #       - geometry hash: an unmodified object is exported from its original segments, cf MESH_OT_sanmodel_export.original_segments
     #
 
 
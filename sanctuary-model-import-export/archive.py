@@ -0,0 +1,191 @@
+import os
+import mmap
+import shutil
+import struct
+from .utils import (
+    console_notice,
+    console_debug,
+)
+from .sanmodel_format import (
+    parse_sanmodel,
+    load_sanmodel,
+    compress_sanmodel,
+    decompress_sanmodel,
+    is_compressed,
+)
+
+# Archive of sanmodel files (no bpy): one file instead of hundreds of small ones, with random access to each model.
+# file structure:
+# [magic "SANPACK\0"][version: uint32][entries amount: uint32][toc size: uint32][reserved: uint32]
+# toc, for each entry: [offset: uint64][length: uint64][name length: uint16][name: utf-8]
+# payloads: the sanmodel files unchanged (or compressed, cf sanmodel_format), each one starting at a multiple of ARCHIVE_ALIGN
+# Names are the paths relative to the packed folder, with "/" separators.
+
+ARCHIVE_EXT = ".sanpack"
+ARCHIVE_MAGIC = b"SANPACK\0"
+ARCHIVE_VERSION = 1
+ARCHIVE_ALIGN = 16
+HEADER_FORMAT = "<8sIIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TOC_ENTRY_FORMAT = "<QQH"
+TOC_ENTRY_SIZE = struct.calcsize(TOC_ENTRY_FORMAT)
+
+def align(offset):
+    return (offset + ARCHIVE_ALIGN - 1) // ARCHIVE_ALIGN * ARCHIVE_ALIGN
+
+def is_archive(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+def folder_files(folder):
+    # (name, path) of the sanmodel files of folder and its sub folders, names relative to folder
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith(".sanmodel"):
+                path = os.path.join(root, name)
+                files.append((os.path.relpath(path, folder).replace(os.sep, "/"), path))
+    return files
+
+def write_archive(path, files, codec=None, level=None):
+    """
+    Pack files, a list of (name, path of a sanmodel file), in the archive path.
+    The files are copied as they are, or compressed with codec (the compressed files are copied as they are).
+    The toc is written last, when the length of every entry is known.
+    Returns the toc: {name: (offset, length)}
+    """
+    names = [name.encode() for name, _ in files]
+    if len(set(names)) != len(names):
+        raise ValueError("the archive names must be unique")
+    toc_size = sum(TOC_ENTRY_SIZE + len(name) for name in names)
+    toc = {}
+    with open(path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, ARCHIVE_MAGIC, ARCHIVE_VERSION, len(files), toc_size, 0))
+        f.write(b"\0" * (align(HEADER_SIZE + toc_size) - HEADER_SIZE))
+        for name, source in files:
+            offset = f.tell()
+            with open(source, "rb") as s:
+                if codec and not is_compressed(s):
+                    model = load_sanmodel(source)
+                    if model is None or not compress_sanmodel(f, *model, codec, level):
+                        raise ValueError(f"invalid sanmodel file {source}")
+                else:
+                    shutil.copyfileobj(s, f)
+            toc[name] = (offset, f.tell() - offset)
+            f.write(b"\0" * (align(f.tell()) - f.tell()))
+        size = f.tell()
+        f.seek(HEADER_SIZE)
+        for (name, source), encoded in zip(files, names):
+            f.write(struct.pack(TOC_ENTRY_FORMAT, *toc[name], len(encoded)) + encoded)
+    console_debug(f"archive {path}: {len(files)} files, {size} bytes")
+    return toc
+
+def pack_folder(folder, path, codec=None, level=None):
+    return write_archive(path, folder_files(folder), codec, level)
+
+def read_toc(path):
+    """
+    The table of contents of an archive, only the header and the toc are read.
+    Returns {name: (offset, length)} in the archive order, or None if the file isn't a valid archive.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+        if len(raw) < HEADER_SIZE:
+            console_notice(f"Error with the archive {path}: invalid header")
+            return None
+        magic, version, amount, toc_size, _ = struct.unpack(HEADER_FORMAT, raw)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            console_notice(f"Error with the archive {path}: not a sanpack file, or version {version} (expected {ARCHIVE_VERSION})")
+            return None
+        raw = f.read(toc_size)
+    if len(raw) < toc_size:
+        console_notice(f"Error with the archive {path}: truncated table of contents")
+        return None
+
+    toc = {}
+    position = 0
+    for _ in range(amount):
+        if position + TOC_ENTRY_SIZE > toc_size:
+            console_notice(f"Error with the archive {path}: truncated table of contents")
+            return None
+        offset, length, name_length = struct.unpack_from(TOC_ENTRY_FORMAT, raw, position)
+        position += TOC_ENTRY_SIZE
+        name = raw[position:position + name_length].decode()
+        position += name_length
+        if offset % ARCHIVE_ALIGN or offset < HEADER_SIZE + toc_size or offset + length > file_size:
+            console_notice(f"Error with the archive {path}: invalid entry {name}")
+            return None
+        toc[name] = (offset, length)
+    return toc
+
+class SanmodelArchive:
+    """
+    Random access to the entries of an archive, the file is memory mapped and only the accessed pages are read.
+    The arrays returned by load() share the mapped memory: while they are alive, close() leaves the mapping
+    to them, it's unmapped when the last one is released.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.toc = read_toc(path)
+        if self.toc is None:
+            raise ValueError(f"invalid archive {path}")
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            pass # exported to arrays of load(), the garbage collector unmaps it
+        self.map = None
+        self.file.close()
+
+    def names(self):
+        return list(self.toc)
+
+    def view(self, name):
+        offset, length = self.toc[name]
+        return memoryview(self.map)[offset:offset + length]
+
+    def compressed(self, name):
+        self.map.seek(self.toc[name][0])
+        return is_compressed(self.map)
+
+    def read(self, name):
+        # content of the sanmodel file, decompressed if the entry is compressed (None if its data is invalid)
+        if self.compressed(name):
+            offset, length = self.toc[name]
+            self.map.seek(offset)
+            return decompress_sanmodel(self.map, length)
+        return bytes(self.view(name))
+
+    def load(self, name):
+        # (name, segments) like parse_sanmodel, without copy for the uncompressed entries
+        content = self.read(name) if self.compressed(name) else self.view(name)
+        return parse_sanmodel(content) if content is not None else None
+
+    def extract(self, folder, names=None):
+        # writes the entries (all by default) as individual files in folder, returns their paths
+        # the compressed entries stay compressed
+        paths = []
+        for name in names if names is not None else self.toc:
+            parts = name.split("/")
+            if ".." in parts or os.path.isabs(name):
+                raise ValueError(f"invalid entry name {name}")
+            path = os.path.join(folder, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(self.view(name))
+            paths.append(path)
+        return paths
@@ -0,0 +1,348 @@
+import os
+import time
+import queue
+import pathlib
+import threading
+import bpy
+from bpy.types import (
+    Operator,
+)
+from .utils import (
+    console_notice,
+    console_debug,
+)
+from . import sanmodel as S
+from .sanmodel_importer import MESH_OT_sanmodel_import
+from . import sanmodel_exporter
+from .sanmodel_exporter import MESH_OT_sanmodel_export
+
+# Non-blocking versions of the import and export operators.
+# File reading, parsing, merging and writing run in a worker thread (no bpy call there),
+# the bpy steps run in the modal operator, in slices of TIME_SLICE seconds so the UI is redrawn between them.
+
+TIME_SLICE = 0.05
+TIMER_STEP = 0.01
+STATUS_DISPLAYED = 20
+
+# current (or last) task, displayed in the Tasks panel
+task = {
+    "name": "",
+    "running": False,
+    "done": 0,
+    "total": 0,
+}
+status = [] # [name, state] for each object or step of the task
+
+def set_status(name, state):
+    for entry in status:
+        if entry[0] == name:
+            entry[1] = state
+            return
+    status.append([name, state])
+
+def redraw(context):
+    for area in context.screen.areas if context.screen else []:
+        if area.type == "VIEW_3D":
+            area.tag_redraw()
+
+class Worker:
+    """runs the submitted functions one after the other in a thread, they must not use bpy"""
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.cancel = threading.Event()
+        self.pending = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.tasks.get()
+            if item is None:
+                return
+            name, key, function = item
+            if self.cancel.is_set():
+                self.results.put((key, "cancelled", None))
+                continue
+            try:
+                self.results.put((key, "done", function()))
+            except Exception as e:
+                console_notice(f"{name}: {e}")
+                self.results.put((key, "error", None))
+
+    def submit(self, name, function, key=None):
+        # key: returned with the result instead of the name (e.g. an index, names can repeat)
+        self.pending += 1
+        self.tasks.put((name, name if key is None else key, function))
+
+    def done(self):
+        # results received since the last call
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(results)
+        return results
+
+    def stop(self):
+        self.tasks.put(None)
+
+class SanmodelAsyncOperator:
+    """modal operator base: tick() is called on timer events until it returns FINISHED or CANCELLED"""
+    _timer = None
+    cancelled = False
+
+    @classmethod
+    def poll(cls, context):
+        return not task["running"]
+
+    def start(self, context, name, total):
+        task.update(name=name, running=True, done=0, total=total)
+        status.clear()
+        self.cancelled = False
+        self.worker = Worker()
+        wm = context.window_manager
+        wm.progress_begin(0, max(total, 1))
+        self._timer = wm.event_timer_add(TIMER_STEP, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def advance(self, context, amount=1):
+        task["done"] += amount
+        context.window_manager.progress_update(task["done"])
+
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        self.worker.stop()
+        task["running"] = False
+        redraw(context)
+
+    def discard(self, context):
+        # called when the task stops before its end, undoes what is incomplete
+        pass
+
+    def modal(self, context, event):
+        if event.type == "ESC" and not self.cancelled:
+            console_notice(f"{task['name']}: cancelling...")
+            self.cancelled = True
+            self.worker.cancel.set()
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+        try:
+            result = self.tick(context, time.perf_counter() + TIME_SLICE)
+        except Exception as e:
+            # the timer and the worker must be stopped, or the task would never end
+            console_notice(f"{task['name']}: {e}")
+            self.discard(context)
+            self.finish(context)
+            self.report({"ERROR"}, f"{task['name']}: {e} (see System Console for more detail)")
+            return {"CANCELLED"}
+        if result != {"RUNNING_MODAL"}:
+            self.finish(context)
+        else:
+            redraw(context)
+        return result
+
+class SANMODEL_OT_async_create(SanmodelAsyncOperator, Operator):
+    """decode the sanmodel file of the import panel in a thread, then create its object step by step without blocking the UI"""
+    bl_idname = "sanmodel.async_create"
+    bl_label = "Create sanmodel object"
+
+    def invoke(self, context, event):
+        settings = context.scene.san_settings
+        if not (settings.valid_file and S.header):
+            console_notice("Error: No data available to create the object")
+            return {"CANCELLED"}
+        self.steps = None
+        self.created = []
+        self.proxy = S.proxy_resolution(context, S.header)
+        self.start(context, f"creating {settings.name}", 1)
+        smd = S.current_model(context)
+        if smd:
+            self.advance(context) # already decoded
+            S.set_current_model(context, smd)
+            self.plan_steps(context, smd)
+        else:
+            # the import panel only probed the file
+            path, entry = settings.path, settings.archive_entry
+            self.name = entry or os.path.basename(path)
+            set_status(self.name, "reading")
+            self.worker.submit(self.name, lambda: self.read_model(path, entry, self.proxy))
+        return {"RUNNING_MODAL"}
+
+    @staticmethod
+    def read_model(path, entry, proxy):
+        # the proxy is simplified in the thread too, its step only creates the mesh
+        data = S.load_model(path, entry)
+        if data and proxy:
+            data.simplify(proxy)
+        return data
+
+    def plan_steps(self, context, smd):
+        self.steps = MESH_OT_sanmodel_import.import_steps(context, smd, self.proxy, self.created)
+        task["total"] += len(self.steps)
+        context.window_manager.progress_begin(0, task["total"])
+        for name, step in self.steps:
+            set_status(name, "waiting")
+
+    def tick(self, context, deadline):
+        if self.steps is None:
+            for name, state, data in self.worker.done():
+                self.advance(context)
+                if self.cancelled:
+                    set_status(name, "cancelled")
+                    return {"CANCELLED"}
+                if not data:
+                    set_status(name, "error")
+                    self.report({'ERROR'}, f"Error with the specified file (see System Console for more detail)")
+                    return {"CANCELLED"}
+                set_status(name, "read")
+                S.set_current_model(context, data)
+                self.plan_steps(context, data)
+            if self.steps is None:
+                return {"CANCELLED"} if self.cancelled else {"RUNNING_MODAL"}
+        while self.steps and time.perf_counter() < deadline:
+            if self.cancelled:
+                for name, step in self.steps:
+                    set_status(name, "cancelled")
+                self.discard(context)
+                self.report({"WARNING"}, "Cancelled, the incomplete object is removed")
+                return {"CANCELLED"}
+            name, step = self.steps.pop(0)
+            start = time.perf_counter()
+            step()
+            set_status(name, f"done ({(time.perf_counter() - start)*1000:.0f} ms)")
+            self.advance(context)
+        if self.steps:
+            return {"RUNNING_MODAL"}
+        console_notice("Object created")
+        return {"FINISHED"}
+
+    def discard(self, context):
+        # the half-built object, its mesh and its armature (parent or child, cf apply_bindposes)
+        if not self.created:
+            return
+        obj = self.created.pop()
+        armatures = [o for o in (obj.parent, *obj.children) if o and o.type == "ARMATURE"]
+        for o in (obj, *armatures):
+            data = o.data
+            bpy.data.objects.remove(o)
+            if data.users == 0:
+                if isinstance(data, bpy.types.Mesh):
+                    bpy.data.meshes.remove(data)
+                else:
+                    bpy.data.armatures.remove(data)
+
+class SANMODEL_OT_async_export(SanmodelAsyncOperator, Operator):
+    """export the selection without blocking the UI, files are merged and written in a thread"""
+    bl_idname = "sanmodel.async_export"
+    bl_label = "Export as sanmodel file"
+
+    @classmethod
+    def poll(cls, context):
+        return super().poll(context) and (len(context.selected_objects) > 0)
+
+    def invoke(self, context, event):
+        export_folder = pathlib.Path("./_sanmodel_exports")
+        console_notice("=================== EXPORT ===================")
+        console_notice(f"export folder: {export_folder.absolute()}")
+        self.export_folder = export_folder
+        self.skipped = []
+        self.jobs = MESH_OT_sanmodel_export.plan_export(context, export_folder, skipped=self.skipped)
+        self.job = 0
+        self.parts = []
+        self.matrices = []
+        self.extract_ms = 0.0
+        self.entries = [] # manifest of the run, filled by the worker
+        self.exported = 0
+        total = sum(len(job["objects"]) for job in self.jobs)
+        self.start(context, f"exporting {total} objects", total)
+        for job in self.jobs:
+            for obj in job["objects"]:
+                set_status(obj.name, "waiting")
+        return {"RUNNING_MODAL"}
+
+    def extract_next(self, context):
+        # bpy part of the export, for the next object of the current job
+        settings = context.scene.san_settings
+        job = self.jobs[self.job]
+        obj = job["objects"][len(self.parts)]
+        set_status(obj.name, "extracting")
+        start = time.perf_counter()
+        if job["merge"]:
+            segments, matrix = MESH_OT_sanmodel_export.extract_part(context, job["root"], obj)
+            self.parts.append(segments)
+            self.matrices.append(matrix)
+            set_status(obj.name, "extracted")
+        else:
+            self.parts.append(MESH_OT_sanmodel_export.extract_segments(context, obj))
+        report = sanmodel_exporter.cleaning_reports.get(obj.name)
+        if report:
+            set_status(f"{obj.name} cleaning", f"-{report['removed_triangles']} triangles, -{report['unused_vertices']} vertices" + (", NaN/Inf" if report["non_finite"] else ""))
+        self.extract_ms += (time.perf_counter() - start) * 1000
+        if len(self.parts) < len(job["objects"]):
+            return
+
+        # every object of the job is extracted, the file is written by the worker
+        path, parts, matrices = job["path"], self.parts, self.matrices
+        options = MESH_OT_sanmodel_export.export_options(settings)
+        options.update(manifest=self.entries, extract_ms=self.extract_ms, original=not job["merge"] and obj.name in sanmodel_exporter.original_exports)
+        if job["merge"]:
+            if settings.use_atlas:
+                MESH_OT_sanmodel_export.bake_atlas(job["objects"], parts, path, settings.mirror_uv_vertically)
+            self.worker.submit(job["root"].name, lambda: MESH_OT_sanmodel_export.write_merged(path, parts, matrices, options), self.job)
+        else:
+            self.worker.submit(obj.name, lambda: MESH_OT_sanmodel_export.write_segments(path, parts[0], options), self.job)
+        set_status(job["root"].name, "writing")
+        self.parts = []
+        self.matrices = []
+        self.extract_ms = 0.0
+        self.job += 1
+
+    def tick(self, context, deadline):
+        while self.job < len(self.jobs) and not self.cancelled and time.perf_counter() < deadline:
+            self.extract_next(context)
+
+        for index, state, result in self.worker.done():
+            job = self.jobs[index]
+            name = job["root"].name
+            if state == "done" and result == {"FINISHED"}:
+                state = "written"
+                self.exported += len(job["objects"])
+            set_status(name, state)
+            for obj in job["objects"]:
+                set_status(obj.name, state)
+            self.advance(context, len(job["objects"]))
+
+        if (self.job < len(self.jobs) and not self.cancelled) or self.worker.pending:
+            return {"RUNNING_MODAL"}
+        end_report = f"exported {self.exported} objects" + (" (cancelled)" if self.cancelled else "")
+        end_report += MESH_OT_sanmodel_export.finish_manifest(context, self.export_folder, self.entries)
+        end_report += MESH_OT_sanmodel_export.pack_exports(context, self.export_folder, self.entries)
+        end_report += MESH_OT_sanmodel_export.skipped_report(self.skipped)
+        self.report({"WARNING"} if self.skipped else {"INFO"}, end_report)
+        console_notice(end_report)
+        console_notice("================= EXPORT END =================")
+        return {"CANCELLED"} if self.cancelled else {"FINISHED"}
+
+blender_classes = [
+    SANMODEL_OT_async_create,
+    SANMODEL_OT_async_export,
+]
+
+def register():
+    for bl_class in blender_classes:
+        bpy.utils.register_class(bl_class)
+    console_notice("async_ops.py registered")
+
+def unregister():
+    for bl_class in blender_classes:
+        bpy.utils.unregister_class(bl_class)
+    console_notice("async_ops.py unregistered")
+
+if __name__ == "__main__":
+    register()
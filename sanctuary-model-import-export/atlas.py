@@ -0,0 +1,93 @@
+import json
+import numpy as np
+
+# Texture atlas packing (no bpy).
+# Coordinates follow Blender images: pixels and UV have their origin at the bottom left.
+
+ATLAS_PADDING = 4 # pixels around each region, avoids bleeding between textures with mipmaps
+
+def next_pow2(n):
+    return 1 << max(0, int(n - 1).bit_length())
+
+def pack_shelves(sizes, padding=ATLAS_PADDING):
+    """
+    Shelf packer: the rects are sorted by height and placed left to right on rows (shelves).
+    sizes: list of (width, height)
+    Returns the (x, y) position of each rect and the (width, height) of the atlas, both power of 2.
+    """
+    if not len(sizes):
+        return [], (0, 0)
+    padded = [(w + 2*padding, h + 2*padding) for w, h in sizes]
+    area = sum(w * h for w, h in padded)
+    width = next_pow2(max(max(w for w, h in padded), int(np.ceil(np.sqrt(area)))))
+
+    order = sorted(range(len(sizes)), key=lambda i: (padded[i][1], padded[i][0]), reverse=True)
+    positions = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in order:
+        w, h = padded[i]
+        if x + w > width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x + padding, y + padding)
+        x += w
+        shelf_height = max(shelf_height, h)
+    height = next_pow2(y + shelf_height)
+    return positions, (width, height)
+
+def tiled_uv(uv, tolerance=1e-4):
+    # uv outside [0,1] repeat the texture (wrap), they can't be moved into an atlas region
+    uv = np.asarray(uv, dtype=np.float64).reshape(-1, 2)
+    return bool(len(uv)) and bool(np.any((uv < -tolerance) | (uv > 1 + tolerance)))
+
+def remap_uv(uv, rect, atlas_size, flip_v=False):
+    """
+    Move uv (n,2) into rect (x, y, width, height) of the atlas.
+    flip_v: the uv are vertically mirrored (cf mirror_uv_vertically)
+    """
+    x, y, w, h = rect
+    atlas_w, atlas_h = atlas_size
+    uv = np.array(uv, dtype=np.float64).reshape(-1, 2)
+    out = np.empty_like(uv)
+    out[:, 0] = (x + uv[:, 0] * w) / atlas_w
+    if flip_v:
+        out[:, 1] = 1.0 - (y + (1.0 - uv[:, 1]) * h) / atlas_h
+    else:
+        out[:, 1] = (y + uv[:, 1] * h) / atlas_h
+    return out
+
+def compose_atlas(images, positions, atlas_size, padding=ATLAS_PADDING):
+    """
+    images: list of float arrays (height, width, 4)
+    The border pixels are repeated in the padding area.
+    """
+    atlas_w, atlas_h = atlas_size
+    atlas = np.zeros((atlas_h, atlas_w, 4), dtype=np.float32)
+    for pixels, (x, y) in zip(images, positions):
+        padded = np.pad(pixels, ((padding, padding), (padding, padding), (0, 0)), mode="edge")
+        h, w = padded.shape[:2]
+        atlas[y-padding:y-padding+h, x-padding:x-padding+w] = padded
+    return atlas
+
+def atlas_mapping(atlas_name, names, sizes, positions, atlas_size, objects):
+    # objects: {object name: texture name}
+    atlas_w, atlas_h = atlas_size
+    regions = {}
+    for name, (w, h), (x, y) in zip(names, sizes, positions):
+        regions[name] = {
+            "x": x, "y": y, "width": w, "height": h,
+            "uv": [x / atlas_w, y / atlas_h, (x + w) / atlas_w, (y + h) / atlas_h],
+        }
+    return {
+        "atlas": atlas_name,
+        "width": atlas_w,
+        "height": atlas_h,
+        "padding": ATLAS_PADDING,
+        "origin": "bottom-left",
+        "regions": regions,
+        "objects": objects,
+    }
+
+def write_mapping(path, mapping):
+    with open(path, "w") as f:
+        json.dump(mapping, f, indent=4)
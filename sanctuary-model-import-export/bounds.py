@@ -0,0 +1,127 @@
+import os
+import json
+import numpy as np
+from .sanmodel_format import (
+    seg_vars,
+    SAN_VERTICES,
+    SAN_UV2,
+    SAN_BINDPOSES,
+)
+
+# Bounding volumes of a model (no bpy), written next to the exported file in <name>_bounds.json,
+# so the game and the import panel don't have to read the vertices to get them.
+# Everything is in sanmodel coordinates.
+
+SPHERE_ITERATIONS = 64 # Ritter growing steps, the radius is then set to the farthest point anyway
+
+def aabb(points):
+    return points.min(axis=0), points.max(axis=0)
+
+def ritter_sphere(points):
+    """
+    Ritter's bounding sphere: start from the 2 points farthest apart (approximately),
+    then grow the sphere toward the farthest point outside of it until all the points are inside.
+    About 5% larger than the minimal sphere, each step is vectorized over the points.
+    Returns the center (3,) and the radius.
+    """
+    x = points[0]
+    y = points[np.argmax(np.einsum("ij,ij->i", points - x, points - x))]
+    z = points[np.argmax(np.einsum("ij,ij->i", points - y, points - y))]
+    center = (y + z) / 2
+    radius = np.linalg.norm(z - y) / 2
+    for i in range(SPHERE_ITERATIONS):
+        offsets = points - center
+        distances = np.einsum("ij,ij->i", offsets, offsets)
+        farthest = np.argmax(distances)
+        distance = np.sqrt(distances[farthest])
+        if distance <= radius:
+            break
+        # new sphere: contains the old one and the farthest point
+        grow = (distance - radius) / 2
+        center = center + offsets[farthest] * (grow / distance)
+        radius += grow
+    offsets = points - center
+    return center, float(np.sqrt(np.einsum("ij,ij->i", offsets, offsets).max()))
+
+def bindpose_matrices(bindposes, exported=False):
+    """
+    bindposes: (n, 16) as stored in the file
+    exported: written by the exporter, bone.matrix_local row major with the bone length in [3][3] (cf inject_additional_bone_data),
+    instead of the game files layout (translation in the last row, w=1). The values can't tell which one it is.
+    Returns (n, 4, 4) matrices from the model space to the bone space, applied to row vectors (column major storage).
+    """
+    matrices = bindposes.reshape(-1, 4, 4)
+    if not exported:
+        return matrices
+    # bone to model space: the bindpose is its inverse, transposed for the row vectors
+    matrices = matrices.copy()
+    matrices[:, 3, 3] = 1.0
+    return np.linalg.inv(matrices).transpose(0, 2, 1)
+
+def bone_bounds(vertices, bone_ids, bindposes, exported=False):
+    """
+    AABB of the vertices of each bone (1 bone per vertex, id in uv2.x), in the bone space (bindpose applied).
+    bindposes: (n, 16) as stored in the file, exported: their layout (cf bindpose_matrices)
+    Returns a list of dict (bone, vertices, min, max), only for the bones with vertices.
+    """
+    matrices = bindpose_matrices(bindposes, exported)
+    ids = bone_ids.astype(np.int64)
+    valid = (ids >= 0) & (ids < len(matrices))
+    ids, points = ids[valid], vertices[valid]
+    if not len(ids):
+        return []
+    # row vector times the matrix: column major storage is the transposed matrix
+    local = np.einsum("ni,nij->nj", np.hstack((points, np.ones((len(points), 1)))), matrices[ids])[:, :3]
+    order = np.argsort(ids, kind="stable")
+    ids, local = ids[order], local[order]
+    bones, starts, counts = np.unique(ids, return_index=True, return_counts=True)
+    low = np.minimum.reduceat(local, starts)
+    high = np.maximum.reduceat(local, starts)
+    return [
+        {"bone": int(b), "vertices": int(n), "min": lo.tolist(), "max": hi.tolist()}
+        for b, n, lo, hi in zip(bones, counts, low, high)
+    ]
+
+def model_bounds(segments, exported_bindposes=False):
+    """
+    segments: flat arrays or arrays of rows (same layout as a sanmodel file)
+    exported_bindposes: the bindposes were extracted from the armature (cf bindpose_matrices)
+    Returns a dict (aabb, sphere, bones), None if there are no vertices.
+    Per bone bounds are only computed when there are bindposes and a bone id (uv2) per vertex.
+    """
+    all_vertices = np.asarray(segments[SAN_VERTICES], dtype=np.float64).reshape(-1, 3)
+    vertices = all_vertices[np.all(np.isfinite(all_vertices), axis=1)]
+    if not len(vertices):
+        return None
+    low, high = aabb(vertices)
+    center, radius = ritter_sphere(vertices)
+    result = {
+        "aabb": {"min": low.tolist(), "max": high.tolist()},
+        "sphere": {"center": center.tolist(), "radius": radius},
+        "bones": [],
+    }
+    bindposes = np.asarray(segments[SAN_BINDPOSES], dtype=np.float64).reshape(-1, seg_vars[SAN_BINDPOSES])
+    uv2 = np.asarray(segments[SAN_UV2], dtype=np.float64).reshape(-1, seg_vars[SAN_UV2])
+    if len(bindposes) and len(uv2) == len(all_vertices):
+        result["bones"] = bone_bounds(all_vertices, uv2[:, 0], bindposes, exported_bindposes)
+    return result
+
+def bounds_path(path):
+    # <name>.sanmodel -> <name>_bounds.json
+    root, ext = os.path.splitext(path)
+    return root + "_bounds.json"
+
+def write_bounds(path, bounds):
+    with open(bounds_path(path), "w") as f:
+        json.dump(dict(model=os.path.basename(path), **bounds), f, indent=4)
+
+def read_bounds(path):
+    # bounds of a sanmodel file from its sidecar, None if there is none or if it's older than the file
+    sidecar = bounds_path(path)
+    try:
+        if os.path.getmtime(sidecar) < os.path.getmtime(path):
+            return None
+        with open(sidecar) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
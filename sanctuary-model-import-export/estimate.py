@@ -0,0 +1,130 @@
+import io
+import os
+import time
+import tempfile
+import numpy as np
+from .sanmodel_format import (
+    seg_vars,
+    SAN_ENDIAN,
+    SAN_VERTICES,
+    SAN_NORMALS,
+    SAN_TANGENTS,
+    SAN_UV1,
+    SAN_COLORS,
+    SAN_INDICES,
+    SAN_BINDPOSES,
+    pack_sanmodel,
+    compress_sanmodel,
+)
+from .manifest import over_budget
+from . import mesh_ops
+from . import bounds
+from . import archive
+
+# Cost of an export before running it (no bpy): amounts and file size from the mesh statistics,
+# duration from costs per vertex. The write cost is measured on a synthetic mesh with the export options,
+# the extraction cost (Blender side) comes from the durations of the last export manifest.
+# The objects unmodified since their import have no extraction (cf MESH_OT_sanmodel_export.original_segments),
+# the archive of Pack on export costs a copy of every file.
+
+COMPRESSION_RATIOS = {"zlib": 0.38, "lzma": 0.31} # on the Models folder, cf scripts/compression_benchmark.py
+EXTRACT_US_PER_VERTEX = 5.0 # until an export manifest gives the cost on this machine
+BENCHMARK_SIDE = 64 # the synthetic mesh is a grid of BENCHMARK_SIDE^2 quads, split like an export
+
+write_costs = {} # us per vertex, per export options
+pack_costs = [] # us per byte of the archive copy, once measured
+
+def segment_amounts(vertices, triangles, bones=0, channels=()):
+    # amount of each segment (values / seg_vars, like the manifest), channels: the UV1, UV2, UV3, colors segments written
+    amounts = [0] * len(seg_vars)
+    for i in (SAN_VERTICES, SAN_NORMALS, SAN_TANGENTS, *channels):
+        amounts[i] = vertices
+    amounts[SAN_INDICES] = triangles * 3
+    amounts[SAN_BINDPOSES] = bones
+    return amounts
+
+def file_size(name, amounts, compression=None):
+    size = len(name.encode()) + 1 + sum(4 + n * seg_vars[i] * 4 for i, n in enumerate(amounts))
+    return int(size * COMPRESSION_RATIOS.get(compression, 1.0))
+
+def synthetic_segments(side=BENCHMARK_SIDE):
+    # a noisy grid, each triangle with its own 3 vertices like the split meshes of the export
+    rng = np.random.default_rng(0)
+    grid = np.stack(np.meshgrid(np.arange(side + 1), np.arange(side + 1)), -1).reshape(-1, 2) / side
+    points = np.column_stack((grid, rng.random(len(grid)) * 0.1))
+    quads = np.arange((side + 1) ** 2).reshape(side + 1, side + 1)[:-1, :-1].ravel()
+    triangles = np.column_stack((quads, quads + 1, quads + side + 1, quads + 1, quads + side + 2, quads + side + 1)).reshape(-1, 3)
+    corners = triangles.ravel()
+    amount = len(corners)
+    segments = [np.zeros(0, dtype=SAN_ENDIAN+"f") for _ in seg_vars]
+    segments[SAN_VERTICES] = points[corners].astype(SAN_ENDIAN+"f").ravel()
+    segments[SAN_NORMALS] = np.tile(np.float32([0, 0, 1]), amount).astype(SAN_ENDIAN+"f")
+    segments[SAN_TANGENTS] = np.tile(np.float32([1, 0, 0, 1]), amount).astype(SAN_ENDIAN+"f")
+    segments[SAN_UV1] = grid[corners].astype(SAN_ENDIAN+"f").ravel()
+    segments[SAN_COLORS] = rng.random(amount * 4).astype(SAN_ENDIAN+"f")
+    segments[SAN_INDICES] = np.arange(amount, dtype=SAN_ENDIAN+"i")
+    return segments
+
+def write_cost(options):
+    """
+    us per vertex of write_segments with options (cf MESH_OT_sanmodel_export.export_options): spatial sort, bounds, packing or compression.
+    Measured once per options, in memory (a few ms).
+    """
+    key = (options.get("spatial_sort"), options.get("chunk_triangles"), options.get("bounds"), options.get("compression"))
+    if key not in write_costs:
+        segments = synthetic_segments()
+        start = time.perf_counter()
+        if options.get("spatial_sort"):
+            segments, _ = mesh_ops.spatial_sort(segments, options["chunk_triangles"])
+        if options.get("bounds"):
+            bounds.model_bounds(segments)
+        if options.get("compression"):
+            compress_sanmodel(io.BytesIO(), "benchmark", segments, options["compression"])
+        else:
+            pack_sanmodel("benchmark", segments)
+        write_costs[key] = (time.perf_counter() - start) * 1e6 / (len(segments[SAN_VERTICES]) // 3)
+    return write_costs[key]
+
+def pack_cost():
+    # us per byte of write_archive, measured once on the synthetic mesh file (the files are copied as they are)
+    if not pack_costs:
+        content = pack_sanmodel("benchmark", synthetic_segments())
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, "benchmark.sanmodel")
+            with open(source, "wb") as f:
+                f.write(content)
+            start = time.perf_counter()
+            archive.write_archive(os.path.join(folder, "benchmark" + archive.ARCHIVE_EXT), [("benchmark", source)])
+            pack_costs.append((time.perf_counter() - start) * 1e6 / len(content))
+    return pack_costs[0]
+
+def extract_cost(entries):
+    # us per vertex of the extraction, from the entries of an export manifest (EXTRACT_US_PER_VERTEX without entries)
+    # the files written from their original segments are left out, nothing was extracted
+    entries = [entry for entry in entries if not entry.get("original")]
+    vertices = sum(entry["vertices"] for entry in entries)
+    if not vertices:
+        return EXTRACT_US_PER_VERTEX
+    return sum(entry["extract_ms"] for entry in entries) * 1000 / vertices
+
+def estimate_file(name, amounts, options, extract_us, original=False):
+    """
+    Estimate of an exported file: {"name", "vertices", "triangles", "size", "ms", "over_budget", "original"}, like a manifest entry
+    amounts: cf segment_amounts, options: cf MESH_OT_sanmodel_export.export_options
+    original: written from the segments of its imported file, without extraction
+    """
+    vertices = amounts[SAN_VERTICES]
+    triangles = amounts[SAN_INDICES] // 3
+    size = file_size(name, amounts, options.get("compression"))
+    ms = vertices * ((0.0 if original else extract_us) + write_cost(options)) / 1000
+    if options.get("pack"):
+        ms += size * pack_cost() / 1000
+    return {
+        "name": name,
+        "vertices": vertices,
+        "triangles": triangles,
+        "size": size,
+        "ms": ms,
+        "over_budget": over_budget(vertices, triangles, options.get("vertex_budget", 0), options.get("triangle_budget", 0)),
+        "original": original,
+    }
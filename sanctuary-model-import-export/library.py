@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+from .sanmodel_format import (
+    probe_sanmodel,
+    read_segment,
+    load_sanmodel,
+    SAN_VERTICES,
+    SAN_INDICES,
+    SAN_BINDPOSES,
+)
+from .utils import (
+    console_notice,
+)
+
+# Index of a folder of sanmodel files (no bpy), stored in a SQLite file in that folder.
+# Only the header, the vertices and the indices of each file are read (cf probe_sanmodel),
+# a file is indexed again only when its mtime or size changed.
+
+LIBRARY_INDEX = "sanmodel_library.db"
+THUMBNAIL_SIZE = 64
+THUMBNAIL_MARGIN = 3 # pixels
+THUMBNAIL_COLOR = np.array([200, 200, 205], dtype=np.float64)
+RASTER_CHUNK = 1 << 22 # (triangle, pixel) pairs tested at once
+
+# 3/4 front view: 30° around y (up in sanmodel space), then 20° around x
+_y, _x = np.radians(30.0), np.radians(20.0)
+VIEW = np.array([
+    [1.0, 0.0, 0.0],
+    [0.0, np.cos(_x), -np.sin(_x)],
+    [0.0, np.sin(_x), np.cos(_x)],
+]) @ np.array([
+    [np.cos(_y), 0.0, np.sin(_y)],
+    [0.0, 1.0, 0.0],
+    [-np.sin(_y), 0.0, np.cos(_y)],
+])
+LIGHT = np.array([0.3, 0.5, 0.8]) / np.linalg.norm([0.3, 0.5, 0.8])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    mtime REAL,
+    file_size INTEGER,
+    valid INTEGER,
+    vertices INTEGER,
+    triangles INTEGER,
+    bones INTEGER,
+    amounts TEXT,
+    bounds TEXT,
+    thumbnail BLOB
+);
+CREATE INDEX IF NOT EXISTS models_name ON models (name);
+"""
+
+def index_path(folder):
+    return os.path.join(folder, LIBRARY_INDEX)
+
+def open_index(folder):
+    db = sqlite3.connect(index_path(folder))
+    db.executescript(SCHEMA)
+    return db
+
+def render_thumbnail(vertices, triangles, size=THUMBNAIL_SIZE):
+    """
+    Flat shaded orthographic render of a model (3/4 front view), software rasterized with a depth buffer.
+    vertices: (n, 3) in sanmodel space, triangles: (m, 3)
+    Returns an uint8 array (size, size, 4) RGBA, first row at the bottom like Blender images, the background is transparent.
+    """
+    image = np.zeros((size, size, 4), dtype=np.uint8)
+    triangles = triangles[np.all((triangles >= 0) & (triangles < len(vertices)), axis=1)]
+    if not len(triangles):
+        return image
+    view = vertices.astype(np.float64) @ VIEW.T
+    low, high = view[:, :2].min(axis=0), view[:, :2].max(axis=0)
+    scale = (size - 2 * THUMBNAIL_MARGIN) / max((high - low).max(), 1e-9)
+    xy = (view[:, :2] - (low + high) / 2) * scale + size / 2
+    depth = view[:, 2] # the camera looks toward -z, the closest point has the highest z
+
+    p0, p1, p2 = xy[triangles[:, 0]], xy[triangles[:, 1]], xy[triangles[:, 2]]
+    area = (p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p1[:, 1] - p0[:, 1]) * (p2[:, 0] - p0[:, 0])
+    # pixel i is covered if its center (i + 0.5) is in the triangle
+    corners = np.stack((p0, p1, p2), axis=1)
+    start = np.clip(np.ceil(corners.min(axis=1) - 0.5), 0, size).astype(np.int64)
+    end = np.clip(np.floor(corners.max(axis=1) - 0.5), -1, size - 1).astype(np.int64)
+    extent = end - start + 1
+    keep = np.flatnonzero((np.abs(area) > 1e-12) & np.all(extent > 0, axis=1))
+
+    # two sided lambert, one value per triangle
+    v0, v1, v2 = view[triangles[:, 0]], view[triangles[:, 1]], view[triangles[:, 2]]
+    normals = np.cross(v1 - v0, v2 - v0)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    shade = 0.25 + 0.75 * np.abs(normals @ LIGHT)
+
+    zbuffer = np.full(size * size, -np.inf)
+    owner = np.full(size * size, -1, dtype=np.int64)
+    counts = extent[keep, 0] * extent[keep, 1]
+    bounds = np.searchsorted(np.cumsum(counts), np.arange(RASTER_CHUNK, counts.sum() + RASTER_CHUNK, RASTER_CHUNK), side="right")
+    first = 0
+    for last in np.unique(np.append(bounds, len(keep))):
+        if last <= first:
+            continue
+        chunk, chunk_counts = keep[first:last], counts[first:last]
+        first = last
+        # every (triangle, pixel) pair of the triangles bounding boxes
+        tri = np.repeat(chunk, chunk_counts)
+        local = np.arange(len(tri)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        px = start[tri, 0] + local % extent[tri, 0]
+        py = start[tri, 1] + local // extent[tri, 0]
+        cx, cy = px + 0.5, py + 0.5
+        a, b, c = p0[tri], p1[tri], p2[tri]
+        w0 = ((b[:, 0] - cx) * (c[:, 1] - cy) - (b[:, 1] - cy) * (c[:, 0] - cx)) / area[tri]
+        w1 = ((c[:, 0] - cx) * (a[:, 1] - cy) - (c[:, 1] - cy) * (a[:, 0] - cx)) / area[tri]
+        w2 = 1.0 - w0 - w1
+        inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+        tri, w0, w1, w2 = tri[inside], w0[inside], w1[inside], w2[inside]
+        pixel = (py * size + px)[inside]
+        z = w0 * depth[triangles[tri, 0]] + w1 * depth[triangles[tri, 1]] + w2 * depth[triangles[tri, 2]]
+        # closest fragment of each pixel in the chunk, then against the depth buffer
+        order = np.lexsort((-z, pixel))
+        pixel, z, tri = pixel[order], z[order], tri[order]
+        front = np.ones(len(pixel), dtype=bool)
+        front[1:] = pixel[1:] != pixel[:-1]
+        pixel, z, tri = pixel[front], z[front], tri[front]
+        closer = z > zbuffer[pixel]
+        zbuffer[pixel[closer]] = z[closer]
+        owner[pixel[closer]] = tri[closer]
+
+    covered = owner >= 0
+    flat = image.reshape(-1, 4)
+    flat[covered, :3] = np.clip(THUMBNAIL_COLOR * shade[owner[covered], None], 0, 255).astype(np.uint8)
+    flat[covered, 3] = 255
+    return image
+
+def index_file(path):
+    # row values of a file, None if it isn't a valid sanmodel
+    header = probe_sanmodel(path)
+    if not header:
+        return None
+    amounts = header["amounts"]
+    if header["compression"]:
+        # the segments are in one compressed stream, it's decoded once
+        model = load_sanmodel(path)
+        if model is None:
+            return None
+        vertices, triangles = model[1][SAN_VERTICES], model[1][SAN_INDICES].reshape(-1, 3)
+    else:
+        vertices = read_segment(path, header, SAN_VERTICES)
+        triangles = read_segment(path, header, SAN_INDICES).reshape(-1, 3)
+    return {
+        "name": header["name"],
+        "vertices": amounts[SAN_VERTICES],
+        "triangles": amounts[SAN_INDICES] // 3,
+        "bones": amounts[SAN_BINDPOSES],
+        "amounts": json.dumps(amounts),
+        "bounds": json.dumps(header["bounds"]),
+        "thumbnail": render_thumbnail(vertices, triangles).tobytes(),
+    }
+
+def scan_library(folder):
+    """
+    Index the sanmodel files of folder (and its sub folders), only the new and modified files are read.
+    Returns the amount of indexed, removed and unchanged files.
+    """
+    start = time.perf_counter()
+    files = {}
+    for root, dirs, names in os.walk(folder):
+        for name in names:
+            if name.lower().endswith(".sanmodel"):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, folder).replace(os.sep, "/")] = os.stat(path)
+
+    db = open_index(folder)
+    known = {path: (mtime, file_size) for path, mtime, file_size in db.execute("SELECT path, mtime, file_size FROM models")}
+    removed = [path for path in known if path not in files]
+    db.executemany("DELETE FROM models WHERE path = ?", [(path,) for path in removed])
+    indexed = 0
+    for path, stat in files.items():
+        if known.get(path) == (stat.st_mtime, stat.st_size):
+            continue
+        try:
+            row = index_file(os.path.join(folder, path))
+        except (OSError, ValueError) as e:
+            console_notice(f"{path}: {e}")
+            row = None
+        if row is None:
+            console_notice(f"{path}: invalid sanmodel, not listed")
+            row = {"name": os.path.splitext(os.path.basename(path))[0], "vertices": 0, "triangles": 0, "bones": 0, "amounts": None, "bounds": None, "thumbnail": None}
+        row.update(path=path, mtime=stat.st_mtime, file_size=stat.st_size, valid=row["amounts"] is not None)
+        db.execute(f"INSERT OR REPLACE INTO models ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+        indexed += 1
+    db.commit()
+    db.close()
+    unchanged = len(files) - indexed
+    console_notice(f"library {folder}: {indexed} indexed, {len(removed)} removed, {unchanged} unchanged ({(time.perf_counter() - start)*1000:.0f} ms)")
+    return indexed, len(removed), unchanged
+
+def search_library(folder, text="", max_triangles=0, limit=100):
+    """
+    Valid files of the index whose name contains text (case insensitive), with at most max_triangles triangles (0: no limit).
+    Returns a list of dict (path is absolute), sorted by name.
+    """
+    if not os.path.isfile(index_path(folder)):
+        return []
+    db = open_index(folder)
+    db.row_factory = sqlite3.Row
+    rows = db.execute(
+        "SELECT path, name, mtime, file_size, vertices, triangles, bones, bounds FROM models"
+        " WHERE valid AND instr(lower(name), lower(?)) > 0 AND (? = 0 OR triangles <= ?)"
+        " ORDER BY name LIMIT ?",
+        (text, max_triangles, max_triangles, limit)).fetchall()
+    db.close()
+    results = []
+    for row in rows:
+        entry = dict(row)
+        entry["path"] = os.path.join(folder, *row["path"].split("/"))
+        entry["bounds"] = json.loads(row["bounds"]) if row["bounds"] else None
+        results.append(entry)
+    return results
+
+def load_thumbnail(folder, path):
+    # RGBA uint8 (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 4) of an indexed file, or None
+    db = open_index(folder)
+    row = db.execute("SELECT thumbnail FROM models WHERE path = ?", (os.path.relpath(path, folder).replace(os.sep, "/"),)).fetchone()
+    db.close()
+    if not row or not row[0]:
+        return None
+    return np.frombuffer(row[0], dtype=np.uint8).reshape(THUMBNAIL_SIZE, THUMBNAIL_SIZE, 4)
@@ -0,0 +1,119 @@
+import os
+import bpy
+import bpy.utils.previews
+import numpy as np
+from bpy.types import (
+    Operator,
+)
+from bpy.props import (
+    StringProperty,
+)
+from .utils import (
+    console_notice,
+)
+from . import sanmodel as S
+from . import library
+from . import async_ops
+
+# Library panel: the index of a folder of sanmodel files (cf library.py), with thumbnails.
+
+LIBRARY_DISPLAYED = 30
+
+previews = None # thumbnails icons, by path and mtime
+search = {"key": None, "results": []} # last search, the index is queried again only when the search changes
+generation = 0 # incremented by each scan, invalidates the last search
+
+def library_folder(settings):
+    return bpy.path.abspath(settings.library_folder)
+
+def search_results(settings):
+    folder = library_folder(settings)
+    key = (folder, settings.library_search, settings.library_max_triangles, generation)
+    if search["key"] != key:
+        search["key"] = key
+        search["results"] = library.search_library(folder, settings.library_search, settings.library_max_triangles, LIBRARY_DISPLAYED + 1) if folder else []
+    return search["results"]
+
+def thumbnail_icon(folder, entry):
+    # icon id of the thumbnail of an indexed file, 0 if it has none
+    if previews is None:
+        return 0
+    key = f"{entry['path']}|{entry['mtime']}"
+    if key not in previews:
+        pixels = library.load_thumbnail(folder, entry["path"])
+        preview = previews.new(key)
+        if pixels is not None:
+            preview.image_size = pixels.shape[1], pixels.shape[0]
+            preview.image_pixels_float[:] = (pixels.astype(np.float32) / 255).ravel()
+    return previews[key].icon_id
+
+class SANMODEL_OT_library_scan(Operator):
+    """index the new and modified sanmodel files of the library folder"""
+    bl_idname = "sanmodel.library_scan"
+    bl_label = "Scan library"
+
+    @classmethod
+    def poll(cls, context):
+        return bool(context.scene.san_settings.library_folder)
+
+    def execute(self, context):
+        global generation
+        folder = library_folder(context.scene.san_settings)
+        if not os.path.isdir(folder):
+            self.report({'ERROR'}, f"'{folder}' is not a folder")
+            return {"CANCELLED"}
+        indexed, removed, unchanged = library.scan_library(folder)
+        generation += 1
+        self.report({"INFO"}, f"library: {indexed} indexed, {removed} removed, {unchanged} unchanged")
+        return {"FINISHED"}
+
+class SANMODEL_OT_library_import(Operator):
+    """create the object of this library file"""
+    bl_idname = "sanmodel.library_import"
+    bl_label = "Import from library"
+
+    path: StringProperty(
+        description="Full path of the sanmodel file",
+        default="",
+        )
+
+    @classmethod
+    def poll(cls, context):
+        return not async_ops.task["running"]
+
+    def execute(self, context):
+        settings = context.scene.san_settings
+        header = S.read_header(self.path) if os.path.isfile(self.path) else None
+        if not header:
+            self.report({'ERROR'}, f"Error with the specified file, scan the library again (see System Console for more detail)")
+            return {"CANCELLED"}
+        settings.path = self.path
+        console_notice(f"opening '{settings.path}' from the library ...")
+        S.show_header(context, header)
+        if context.window:
+            return bpy.ops.sanmodel.async_create('INVOKE_DEFAULT')
+        return bpy.ops.mesh.sanmodel_import()
+
+blender_classes = [
+    SANMODEL_OT_library_scan,
+    SANMODEL_OT_library_import,
+]
+
+def register():
+    global previews
+    previews = bpy.utils.previews.new()
+    for bl_class in blender_classes:
+        bpy.utils.register_class(bl_class)
+    console_notice("library_ops.py registered")
+
+def unregister():
+    global previews
+    for bl_class in blender_classes:
+        bpy.utils.unregister_class(bl_class)
+    bpy.utils.previews.remove(previews)
+    previews = None
+    search["key"] = None
+    console_notice("library_ops.py unregistered")
+
+if __name__ == "__main__":
+    register()
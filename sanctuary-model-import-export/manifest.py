@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import hashlib
+from .sanmodel_format import (
+    seg_names,
+    seg_vars,
+    SAN_VERTICES,
+    SAN_INDICES,
+)
+
+# Manifest of an export run (no bpy): one entry per written file, with its segments sizes, a hash and the durations,
+# written in export_manifest.json of the export folder. Files over the vertex or triangle budget are flagged.
+
+MANIFEST_NAME = "export_manifest.json"
+HASH_CHUNK = 1 << 20
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def over_budget(vertices, triangles, vertex_budget=0, triangle_budget=0):
+    # names of the exceeded budgets, a budget of 0 is no limit
+    flags = []
+    if vertex_budget and vertices > vertex_budget:
+        flags.append("vertices")
+    if triangle_budget and triangles > triangle_budget:
+        flags.append("triangles")
+    return flags
+
+def manifest_entry(path, segments, extract_ms=0.0, write_ms=0.0, vertex_budget=0, triangle_budget=0):
+    """
+    Entry of a written file. segments: the flat arrays written (same layout as a sanmodel file)
+    """
+    amounts = [len(s) // seg_vars[i] for i, s in enumerate(segments)]
+    vertices = amounts[SAN_VERTICES]
+    triangles = amounts[SAN_INDICES] // 3
+    return {
+        "path": str(path),
+        "size": os.path.getsize(path),
+        "segments": {seg_names[i]: {"amount": n, "bytes": 4 + n * seg_vars[i] * 4} for i, n in enumerate(amounts)},
+        "vertices": vertices,
+        "triangles": triangles,
+        "blake2b": file_hash(path),
+        "extract_ms": round(extract_ms, 3),
+        "write_ms": round(write_ms, 3),
+        "duration_ms": round(extract_ms + write_ms, 3),
+        "over_budget": over_budget(vertices, triangles, vertex_budget, triangle_budget),
+    }
+
+def write_manifest(folder, entries, vertex_budget=0, triangle_budget=0):
+    """
+    Write the manifest of an export run in folder, the paths are made relative to it.
+    Returns the path of the manifest.
+    """
+    folder = os.path.abspath(folder)
+    files = []
+    for entry in sorted(entries, key=lambda e: e["path"]):
+        entry = dict(entry)
+        entry["path"] = os.path.relpath(os.path.abspath(entry["path"]), folder).replace(os.sep, "/")
+        files.append(entry)
+    content = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "budgets": {"vertices": vertex_budget, "triangles": triangle_budget},
+        "files": files,
+        "total": {
+            "files": len(files),
+            "size": sum(e["size"] for e in files),
+            "vertices": sum(e["vertices"] for e in files),
+            "triangles": sum(e["triangles"] for e in files),
+            "duration_ms": round(sum(e["duration_ms"] for e in files), 3),
+            "over_budget": [e["path"] for e in files if e["over_budget"]],
+        },
+    }
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path, "w") as f:
+        json.dump(content, f, indent=4)
+    return path
+
+def read_manifest(folder):
+    # entries of the last export run in folder, [] if there is none
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return []
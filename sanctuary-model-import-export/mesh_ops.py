@@ -0,0 +1,550 @@
+import numpy as np
+from .sanmodel_format import (
+    seg_names,
+    seg_vars,
+    seg_dtype,
+    SAN_VERTICES,
+    SAN_NORMALS,
+    SAN_TANGENTS,
+    SAN_UV1,
+    SAN_UV2,
+    SAN_UV3,
+    SAN_COLORS,
+    SAN_INDICES,
+    SAN_BINDPOSES,
+)
+
+# Geometry operations on sanmodel segments with numpy only (no bpy), so they
+# can run on exported data as well as on parsed files.
+
+# value used when a merged part does not have an optional segment
+seg_defaults = {
+    SAN_NORMALS: (0.0, 1.0, 0.0),
+    SAN_TANGENTS: (1.0, 0.0, 0.0, 1.0),
+    SAN_UV1: (0.0, 0.0),
+    SAN_UV2: (0.0, 0.0),
+    SAN_UV3: (0.0, 0.0),
+    SAN_COLORS: (1.0, 1.0, 1.0, 1.0),
+}
+
+def normalize(vectors):
+    length = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))[:, None]
+    return np.divide(vectors, length, out=np.zeros_like(vectors), where=length > 0)
+
+def same_directions(a, b, tolerance):
+    # unit vectors (n,3) a and b are equal up to tolerance (distance between them)
+    if a.shape != b.shape:
+        return False
+    difference = a - b
+    return bool(np.all(np.einsum("ij,ij->i", difference, difference) <= tolerance ** 2))
+
+def transform_rows(matrices, ids, rows):
+    # apply matrices[ids[n]] to rows[n], for all n at once
+    return np.einsum("nij,nj->ni", matrices[ids], rows)
+
+# Coordinate systems: a 3x3 basis matrix converts sanmodel coordinates to Blender coordinates,
+# its inverse converts back. The transform_* functions apply it to whole (n,3)/(n,4) arrays.
+
+def coordinate_basis(swap_yz_axis=True, mirror_x_axis=False, scale=1.0):
+    """
+    Matrix from sanmodel to Blender coordinates.
+    swap_yz_axis: sanmodel (Unity) is y up, Blender is z up
+    mirror_x_axis: mirror x, changes the handedness without swapping axes
+    scale: Blender units per sanmodel unit
+    """
+    basis = np.eye(3)
+    if swap_yz_axis:
+        basis = basis[[0, 2, 1]]
+    if mirror_x_axis:
+        basis[0] *= -1.0
+    return basis * scale
+
+def flips_handedness(basis):
+    return np.linalg.det(basis) < 0
+
+def transform_points(basis, points):
+    return np.asarray(points, dtype=np.float64).reshape(-1, 3) @ basis.T
+
+def transform_normals(basis, normals):
+    # inverse transpose, normalized: scaling doesn't change the normals
+    return normalize(np.asarray(normals, dtype=np.float64).reshape(-1, 3) @ np.linalg.inv(basis))
+
+def transform_triangles(basis, triangles):
+    # a handedness change flips the winding, the front faces stay in front
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    return triangles[:, [0, 2, 1]] if flips_handedness(basis) else triangles
+
+def transform_matrix(basis, matrix):
+    # 4x4 transform expressed in the coordinates of basis (ex: a Blender matrix_world in sanmodel coordinates)
+    change = np.eye(4)
+    change[:3, :3] = basis
+    return change @ np.asarray(matrix, dtype=np.float64) @ np.linalg.inv(change)
+
+# Tangents (MikkTSpace conventions): per triangle directions of increasing u (tangent) from the uv gradients,
+# projected on the plane of each corner normal, weighted by the corner angle and summed per vertex.
+# The sign w is the orientation of the uv of the vertex faces: bitangent = w * cross(normal, tangent).
+
+def any_perpendicular(normals):
+    # a unit vector perpendicular to each normal, for the vertices without uv gradient
+    axis = np.zeros_like(normals)
+    axis[np.arange(len(normals)), np.argmin(np.abs(normals), axis=1)] = 1.0
+    return normalize(np.cross(normals, axis))
+
+def compute_tangents(vertices, normals, uv, triangles):
+    """
+    Per vertex tangents (n, 4) of a split mesh, in the coordinates of the vertices: xyz unit direction, w bitangent sign (+-1).
+    vertices (n, 3), normals (n, 3), uv (n, 2), triangles (m, 3): the arrays of the segments, flat arrays work too.
+    The uv are used as they are written (mirrored or not), the sign follows them.
+    """
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    normals = normalize(np.asarray(normals, dtype=np.float32).reshape(-1, 3))
+    uv = np.asarray(uv, dtype=np.float32).reshape(-1, 2)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    amount = len(vertices)
+
+    corners = vertices[triangles]
+    # edges and unit edges of each triangle: 0->1, 1->2, 2->0
+    edges = np.roll(corners, -1, axis=1) - corners
+    units = normalize(edges.reshape(-1, 3)).reshape(-1, 3, 3)
+    # corner c is between the edges c and c-1 (reversed)
+    angles = np.arccos(np.clip(-np.einsum("mcj,mcj->mc", units, np.roll(units, 1, axis=1)), -1.0, 1.0))
+    st = uv[triangles]
+    d1, d2 = st[:, 1] - st[:, 0], st[:, 2] - st[:, 0]
+    area = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0] # signed uv area (x2)
+    orientation = np.where(area < 0, -1.0, 1.0).astype(np.float32)
+    # the direction only: the magnitude would favor the triangles with small uv
+    e1, e2 = edges[:, 0], -edges[:, 2]
+    tangent = normalize((e1 * d2[:, 1:] - e2 * d1[:, 1:]) * orientation[:, None])
+    angles *= (area != 0)[:, None] # no contribution of the triangles with degenerate uv
+
+    # all the corners at once: projected on the plane of their normal, weighted by their angle
+    ids = triangles.ravel()
+    n = normals[ids]
+    tangent = np.repeat(tangent, 3, axis=0)
+    projected = normalize(tangent - n * np.einsum("ij,ij->i", n, tangent)[:, None]) * angles.reshape(-1, 1)
+    summed = np.column_stack([np.bincount(ids, projected[:, k], amount) for k in range(3)]).astype(np.float32)
+    signs = np.bincount(ids, (orientation[:, None] * angles).ravel(), amount)
+
+    result = np.empty((amount, 4), dtype=np.float32)
+    summed -= normals * np.einsum("ij,ij->i", normals, summed)[:, None]
+    result[:, :3] = normalize(summed)
+    missing = np.einsum("ij,ij->i", summed, summed) < 1e-24
+    if np.any(missing):
+        result[missing, :3] = any_perpendicular(normals[missing])
+    result[:, 3] = np.where(signs < 0, -1.0, 1.0)
+    return result
+
+def merge_segments(parts, matrices):
+    """
+    Merge several models into a single one.
+    parts: list of segments lists (flat arrays, same layout as a sanmodel file)
+    matrices: one 4x4 matrix per part, in sanmodel coordinates, relative to the merge root
+    Bindposes are dropped, a merged model is a static mesh.
+    """
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    linear = matrices[:, :3, :3]
+    normal_matrices = np.linalg.pinv(linear).transpose(0, 2, 1)
+    mirrored = np.linalg.det(linear) < 0
+
+    vcounts = np.array([len(p[SAN_VERTICES]) // seg_vars[SAN_VERTICES] for p in parts], dtype=np.int64)
+    ids = np.repeat(np.arange(len(parts)), vcounts)
+    merged = [[] for i in range(len(seg_vars))]
+
+    vertices = np.concatenate([np.reshape(p[SAN_VERTICES], (-1, 3)) for p in parts]).astype(np.float64)
+    merged[SAN_VERTICES] = transform_rows(linear, ids, vertices) + matrices[ids, :3, 3]
+
+    for i in (SAN_NORMALS, SAN_TANGENTS, SAN_UV1, SAN_UV2, SAN_UV3, SAN_COLORS):
+        if not any(len(p[i]) for p in parts):
+            continue
+        default = np.array(seg_defaults[i], dtype=np.float64)
+        chunks = []
+        for p, n in zip(parts, vcounts):
+            if len(p[i]) == n * seg_vars[i]:
+                chunks.append(np.reshape(p[i], (-1, seg_vars[i])))
+            else:
+                chunks.append(np.broadcast_to(default, (n, seg_vars[i])))
+        merged[i] = np.concatenate(chunks).astype(np.float64)
+
+    if len(merged[SAN_NORMALS]):
+        merged[SAN_NORMALS] = normalize(transform_rows(normal_matrices, ids, merged[SAN_NORMALS]))
+    if len(merged[SAN_TANGENTS]):
+        tangents = merged[SAN_TANGENTS]
+        tangents[:, :3] = normalize(transform_rows(linear, ids, tangents[:, :3]))
+        # a mirroring transform flips the bitangent
+        tangents[mirrored[ids], 3] *= -1.0
+
+    # offset the indices of each part by the amount of vertices before it
+    offsets = np.concatenate(([0], np.cumsum(vcounts)[:-1]))
+    tcounts = np.array([len(p[SAN_INDICES]) // 3 for p in parts], dtype=np.int64)
+    tri_ids = np.repeat(np.arange(len(parts)), tcounts)
+    triangles = np.concatenate([np.reshape(p[SAN_INDICES], (-1, 3)) for p in parts]).astype(np.int64)
+    triangles += offsets[tri_ids][:, None]
+    # a mirroring transform flips the triangles winding
+    flip = mirrored[tri_ids]
+    triangles[flip] = triangles[flip][:, [0, 2, 1]]
+    merged[SAN_INDICES] = triangles
+
+    return [np.asarray(s, dtype=seg_dtype(i)).flatten() if len(s) else [] for i, s in enumerate(merged)]
+
+def hash_rows(rows, cell_size=None, shift=0.0):
+    """
+    One uint64 key per row, equal for rows whose values fall in the same cell of a grid.
+    shift moves the grid by a fraction of a cell.
+    Without cell_size, the key is made from the exact float64 values.
+    """
+    if cell_size is None:
+        cells = np.ascontiguousarray(rows, dtype=np.float64).view(np.uint64)
+    else:
+        cells = np.floor(rows * (1.0 / cell_size) + shift).astype(np.int64).view(np.uint64)
+    keys = np.full(len(rows), 0xcbf29ce484222325, dtype=np.uint64)
+    for column in cells.T:
+        # FNV-1a on whole columns, the shift mixes the high bits (ex: signs) down
+        keys = (keys ^ column) * np.uint64(0x100000001b3)
+        keys ^= keys >> np.uint64(29)
+    return keys
+
+def vertex_rows(segments, attributes):
+    # the per vertex attributes side by side, shape (n, sum of their seg_vars)
+    amount = len(np.reshape(segments[SAN_VERTICES], (-1, 3)))
+    columns = []
+    for i in attributes:
+        column = np.reshape(segments[i], (-1, seg_vars[i]))
+        if len(column) == amount:
+            columns.append(column)
+    return np.concatenate(columns, axis=1, dtype=np.float64)
+
+def weld_segments(segments, tolerance=1e-6):
+    """
+    Merge the vertices that have the same attributes (up to tolerance), as the opposite of the export split.
+    segments: arrays of shape (n, seg_vars[i]), indices as triangles (n, 3)
+    Returns the welded segments and, for each original vertex, its new index.
+    """
+    attributes = (SAN_VERTICES, SAN_NORMALS, SAN_TANGENTS, SAN_UV1, SAN_UV2, SAN_UV3, SAN_COLORS)
+    rows = vertex_rows(segments, attributes)
+    # a 64 bits hash collision would weld 2 different vertices, it is unlikely enough to be ignored here
+    keys = hash_rows(rows, tolerance)
+    unique, first, remap = np.unique(keys, return_index=True, return_inverse=True)
+    welded = list(segments)
+    for i in attributes:
+        if len(segments[i]) and len(segments[i]) == len(rows):
+            welded[i] = segments[i][first]
+    if len(segments[SAN_INDICES]):
+        welded[SAN_INDICES] = remap[segments[SAN_INDICES]]
+    return welded, remap
+
+DEGENERATE_AREA = 1e-12 # triangles with a smaller area are removed on export
+PER_VERTEX = (SAN_VERTICES, SAN_NORMALS, SAN_TANGENTS, SAN_UV1, SAN_UV2, SAN_UV3, SAN_COLORS)
+
+def triangle_areas(vertices, triangles):
+    v0, v1, v2 = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+    return 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1)
+
+def clean_segments(segments, min_area=DEGENERATE_AREA):
+    """
+    Validate the segments of a mesh before writing them (same layout as a sanmodel file: flat arrays).
+    Removes the triangles with an invalid index, a non finite vertex, a repeated vertex or an area below min_area,
+    then the vertices no triangle uses. Non finite values of the other attributes are replaced by seg_defaults,
+    the non finite bindposes are only flagged (no default matrix is right for a bone).
+    Returns the cleaned segments, the new index of each original vertex (-1 if removed) and a report dict.
+    """
+    vertices = np.asarray(segments[SAN_VERTICES], dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(segments[SAN_INDICES], dtype=np.int64).reshape(-1, 3)
+    amount = len(vertices)
+    report = {"vertices": amount, "triangles": len(triangles), "non_finite": {}}
+
+    finite = np.all(np.isfinite(vertices), axis=1)
+    if not np.all(finite):
+        report["non_finite"][SAN_VERTICES] = int(np.count_nonzero(~finite))
+    cleaned = list(segments)
+    for i in PER_VERTEX:
+        values = np.asarray(segments[i]).reshape(-1, seg_vars[i])
+        if i == SAN_VERTICES or len(values) != amount:
+            continue
+        bad = ~np.all(np.isfinite(values), axis=1)
+        if np.any(bad):
+            report["non_finite"][i] = int(np.count_nonzero(bad))
+            values = values.copy()
+            values[bad] = seg_defaults[i]
+            cleaned[i] = values.ravel()
+    bindposes = np.asarray(segments[SAN_BINDPOSES]).reshape(-1, seg_vars[SAN_BINDPOSES])
+    bad = ~np.all(np.isfinite(bindposes), axis=1)
+    if np.any(bad):
+        report["non_finite"][SAN_BINDPOSES] = int(np.count_nonzero(bad))
+
+    valid = np.all((triangles >= 0) & (triangles < amount), axis=1)
+    report["invalid_indices"] = int(np.count_nonzero(~valid))
+    safe = np.where(valid[:, None], triangles, 0)
+    valid &= np.all(finite[safe], axis=1)
+    report["non_finite_triangles"] = int(np.count_nonzero(~valid)) - report["invalid_indices"]
+    repeated = (safe[:, 0] == safe[:, 1]) | (safe[:, 1] == safe[:, 2]) | (safe[:, 0] == safe[:, 2])
+    with np.errstate(invalid="ignore"): # non finite vertices, already removed
+        degenerate = valid & (repeated | ~(triangle_areas(vertices, safe) > min_area))
+    report["degenerate"] = int(np.count_nonzero(degenerate))
+    triangles = triangles[valid & ~degenerate]
+
+    used = np.zeros(amount, dtype=bool)
+    used[triangles.ravel()] = True
+    remap = np.full(amount, -1, dtype=np.int64)
+    remap[used] = np.arange(np.count_nonzero(used))
+    report["unused_vertices"] = amount - int(np.count_nonzero(used))
+    if report["unused_vertices"]:
+        for i in PER_VERTEX:
+            values = np.asarray(cleaned[i])
+            if len(values) == amount * seg_vars[i] and amount:
+                cleaned[i] = values.reshape(amount, seg_vars[i])[used].ravel()
+    cleaned[SAN_INDICES] = remap[triangles].astype(seg_dtype(SAN_INDICES)).ravel()
+    report["removed_triangles"] = report["triangles"] - len(triangles)
+    return cleaned, remap, report
+
+def format_cleaning(report):
+    # one line, empty if nothing was changed
+    parts = []
+    if report["degenerate"]:
+        parts.append(f"{report['degenerate']} degenerate triangles")
+    if report["invalid_indices"]:
+        parts.append(f"{report['invalid_indices']} triangles with invalid indices")
+    if report["non_finite_triangles"]:
+        parts.append(f"{report['non_finite_triangles']} triangles with NaN/Inf vertices")
+    if report["unused_vertices"]:
+        parts.append(f"{report['unused_vertices']} unused vertices")
+    line = ("removed " + ", ".join(parts)) if parts else ""
+    if report["non_finite"]:
+        flagged = ", ".join(f"{seg_names[i]}: {n}" for i, n in report["non_finite"].items())
+        line += ("; " if line else "") + f"NaN/Inf values ({flagged})"
+    return line
+
+CHUNK_TRIANGLES = 124 # triangles per chunk, a common meshlet size
+MORTON_BITS = 10 # per axis, 30 bits codes
+
+def spread_bits(x):
+    # 10 bits value -> 30 bits, with 2 zero bits between each bit
+    x = x.astype(np.uint32) & 0x3ff
+    x = (x | (x << 16)) & 0x030000ff
+    x = (x | (x << 8)) & 0x0300f00f
+    x = (x | (x << 4)) & 0x030c30c3
+    x = (x | (x << 2)) & 0x09249249
+    return x
+
+def morton_codes(points, low=None, high=None):
+    # position along a Z-order curve in the bounding box of points (or low, high)
+    if low is None:
+        low, high = points.min(axis=0), points.max(axis=0)
+    cells = (points - low) / np.maximum(high - low, 1e-12) * ((1 << MORTON_BITS) - 1)
+    cells = np.clip(cells, 0, (1 << MORTON_BITS) - 1)
+    return spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << 1) | (spread_bits(cells[:, 2]) << 2)
+
+def chunk_spheres(corners, starts):
+    """
+    Bounding sphere of each chunk of consecutive triangles (starts: first triangle of each chunk),
+    centered on the chunk bounding box, conservative but computed for all the chunks at once.
+    corners: (m, 3, 3) vertices of each triangle
+    Returns centers (k,3) and radii (k,)
+    """
+    low = np.minimum.reduceat(corners.min(axis=1), starts)
+    high = np.maximum.reduceat(corners.max(axis=1), starts)
+    centers = (low + high) / 2
+    chunk_ids = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(corners))))
+    offsets = corners - centers[chunk_ids, None]
+    distances = np.sqrt(np.einsum("nij,nij->ni", offsets, offsets).max(axis=1))
+    return centers, np.maximum.reduceat(distances, starts)
+
+LEAF_POINTS = 8 # points per leaf of the nearest_points tree
+QUERY_CHUNK = 1 << 11 # queries walked together, bounds the memory of the (query, node) pairs
+
+def cube(points):
+    # bounding cube of points: the Morton cells are cubes too, the leaves of a flat model stay compact
+    low = points.min(axis=0)
+    return low, low + (points.max(axis=0) - low).max()
+
+def point_tree(points):
+    """
+    Binary tree of boxes over points sorted along a Morton curve, LEAF_POINTS per leaf (cf nearest_points).
+    Returns the points order, their codes and the (low, high) boxes of each level, from the root to the leaves.
+    The leaves are padded to a power of 2 with empty boxes (infinitely far).
+    """
+    low, high = cube(points)
+    codes = morton_codes(points, low, high)
+    order = np.argsort(codes, kind="stable")
+    sorted_points = points[order]
+    leaves = -(-len(points) // LEAF_POINTS)
+    width = 1 << int(np.ceil(np.log2(leaves)))
+    low = np.full((width, 3), np.inf)
+    high = np.full((width, 3), -np.inf)
+    starts = np.arange(0, len(points), LEAF_POINTS)
+    low[:leaves] = np.minimum.reduceat(sorted_points, starts)
+    high[:leaves] = np.maximum.reduceat(sorted_points, starts)
+    levels = [(low, high)]
+    while len(levels[-1][0]) > 1:
+        low, high = levels[-1]
+        levels.append((np.minimum(low[0::2], low[1::2]), np.maximum(high[0::2], high[1::2])))
+    return order, codes[order], levels[::-1]
+
+def run_minima(values, runs):
+    # minimum of each run of equal consecutive values in runs (sorted), and the start of each run
+    starts = np.flatnonzero(np.concatenate(([True], runs[1:] != runs[:-1])))
+    return np.minimum.reduceat(values, starts), starts
+
+def nearest_points(points, queries):
+    """
+    For each query, the index of the nearest point (-1 only if there are no points, or the query isn't finite) and its distance.
+    The tree of point_tree is walked one level at a time for a chunk of queries together, a node is skipped when its box
+    is farther than a point already found, or than the farthest corner of the box of another node (which has a closer point).
+    The first point found is in the leaf of the query position along the Morton curve, usually close.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+    index = np.full(len(queries), -1, dtype=np.int64)
+    distance = np.full(len(queries), np.inf)
+    amount = len(points)
+    if not amount or not len(queries):
+        return index, distance
+    order, sorted_codes, levels = point_tree(points)
+    # a query that isn't finite never gets closer than its (NaN) bound, any start will do
+    positions = np.searchsorted(sorted_codes, morton_codes(np.where(np.isfinite(queries), queries, 0.0), *cube(points)))
+    first = order[np.minimum(positions, amount - 1)]
+    for chunk in range(0, len(queries), QUERY_CHUNK):
+        q_chunk = queries[chunk:chunk + QUERY_CHUNK]
+        offsets = points[first[chunk:chunk + QUERY_CHUNK]] - q_chunk
+        bound = np.einsum("ij,ij->i", offsets, offsets) # squared distances
+        # (query, node) pairs still possible, sorted by query
+        pair_query = np.arange(len(q_chunk))
+        pair_node = np.zeros(len(q_chunk), dtype=np.int64)
+        for depth, (low, high) in enumerate(levels):
+            if depth:
+                pair_query = np.repeat(pair_query, 2)
+                pair_node = (pair_node[:, None] * 2 + np.arange(2)).ravel()
+            q = q_chunk[pair_query]
+            with np.errstate(invalid="ignore"): # empty boxes
+                near = np.maximum(np.maximum(low[pair_node] - q, q - high[pair_node]), 0.0)
+                far = np.maximum(np.abs(q - low[pair_node]), np.abs(q - high[pair_node]))
+            near = np.einsum("ij,ij->i", near, near)
+            if len(pair_query):
+                minima, starts = run_minima(np.einsum("ij,ij->i", far, far), pair_query)
+                bound[pair_query[starts]] = np.minimum(bound[pair_query[starts]], minima)
+            keep = near <= bound[pair_query]
+            pair_query, pair_node = pair_query[keep], pair_node[keep]
+        if not len(pair_query):
+            continue
+
+        # the points of the leaves left
+        pair_point = (pair_node[:, None] * LEAF_POINTS + np.arange(LEAF_POINTS)).ravel()
+        pair_query = np.repeat(pair_query, LEAF_POINTS)
+        valid = pair_point < amount
+        pair_point, pair_query = order[pair_point[valid]], pair_query[valid]
+        offsets = points[pair_point] - q_chunk[pair_query]
+        d = np.einsum("ij,ij->i", offsets, offsets)
+        minima, starts = run_minima(d, pair_query)
+        queried = pair_query[starts]
+        distance[chunk + queried] = minima
+        # the smallest point index among the closest ones, so the result doesn't depend on the pairs order
+        candidates = np.where(d == np.repeat(minima, np.diff(np.append(starts, len(d)))), pair_point, amount)
+        index[chunk + queried] = np.minimum.reduceat(candidates, starts)
+    return index, np.sqrt(distance)
+
+def indices_in_range(segments):
+    # every index refers to a vertex, always true after clean_segments
+    indices = np.asarray(segments[SAN_INDICES])
+    amount = len(segments[SAN_VERTICES]) // 3
+    return not len(indices) or (indices.min() >= 0 and indices.max() < amount)
+
+def spatial_sort(segments, chunk_triangles=CHUNK_TRIANGLES):
+    """
+    Reorder the triangles along a Morton curve of their centroids, so that consecutive triangles are close in space,
+    then the vertices by first use, for the memory locality.
+    The triangles are grouped by chunk_triangles in chunks, with a bounding sphere each (for culling).
+    segments: flat arrays (same layout as a sanmodel file), with valid indices (cf indices_in_range, clean_segments)
+    Returns the reordered segments and the chunks, an array of rows (first triangle, triangles, center x, y, z, radius)
+    """
+    vertices = np.asarray(segments[SAN_VERTICES], dtype=np.float32).reshape(-1, 3)
+    triangles = np.asarray(segments[SAN_INDICES], dtype=np.int64).reshape(-1, 3)
+    amount = len(vertices)
+    if not len(triangles):
+        return list(segments), np.zeros((0, 6))
+
+    corners = vertices[triangles]
+    order = np.argsort(morton_codes(corners.mean(axis=1)), kind="stable")
+    triangles = triangles[order]
+    corners = corners[order]
+
+    # vertices by first use, the unused ones at the end
+    # (np.unique gives the first occurrence, the order of repeated fancy index writes isn't defined)
+    first = np.full(amount, len(triangles) * 3, dtype=np.int64)
+    used, uses = np.unique(triangles.ravel(), return_index=True)
+    first[used] = uses
+    new_order = np.argsort(first, kind="stable")
+    remap = np.empty(amount, dtype=np.int64)
+    remap[new_order] = np.arange(amount)
+    result = list(segments)
+    for i in PER_VERTEX:
+        values = np.asarray(segments[i])
+        if len(values) == amount * seg_vars[i] and amount:
+            result[i] = values.reshape(amount, seg_vars[i])[new_order].ravel()
+    triangles = remap[triangles]
+    result[SAN_INDICES] = triangles.astype(seg_dtype(SAN_INDICES)).ravel()
+
+    starts = np.arange(0, len(triangles), chunk_triangles)
+    centers, radii = chunk_spheres(corners, starts)
+    counts = np.diff(np.append(starts, len(triangles)))
+    return result, np.column_stack((starts, counts, centers, radii))
+
+PROXY_RESOLUTION = 32 # grid cells along the longest side of the model
+
+def cluster_simplify(vertices, triangles, resolution=PROXY_RESOLUTION):
+    """
+    Vertex clustering: the vertices are merged per cell of a grid over the bounding box (resolution cells on its longest side),
+    at the mean position of the cell. Collapsed and duplicated triangles are removed.
+    vertices (n, 3), triangles (m, 3)
+    Returns the simplified vertices and triangles, and the cluster of each original vertex (-1 if it's in no simplified triangle).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    if not len(vertices):
+        return vertices, triangles, np.zeros(0, dtype=np.int64)
+    low = vertices.min(axis=0)
+    cell_size = max((vertices.max(axis=0) - low).max() / resolution, 1e-12)
+    cells = np.minimum((vertices - low) / cell_size, resolution - 1).astype(np.int64)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    unique, clusters = np.unique(keys, return_inverse=True)
+    clusters = clusters.ravel()
+    counts = np.bincount(clusters, minlength=len(unique))
+    centers = np.column_stack([np.bincount(clusters, vertices[:, k], len(unique)) for k in range(3)]) / counts[:, None]
+
+    simplified = clusters[triangles]
+    collapsed = (simplified[:, 0] == simplified[:, 1]) | (simplified[:, 1] == simplified[:, 2]) | (simplified[:, 0] == simplified[:, 2])
+    simplified = simplified[~collapsed]
+    # a triangle and its copies (same vertices, in any order and winding) are kept once
+    _, first = np.unique(np.sort(simplified, axis=1), axis=0, return_index=True)
+    simplified = simplified[np.sort(first)]
+    # clusters left without triangle are removed, their vertices have no cluster (-1)
+    used = np.zeros(len(unique), dtype=bool)
+    used[simplified.ravel()] = True
+    remap = np.cumsum(used) - 1
+    remap[~used] = -1
+    return centers[used], remap[simplified], remap[clusters]
+
+def fit_channel(values, width, colors=False):
+    """
+    Values (n, k) of a layer to the width of a segment: the extra components are dropped, the missing ones are 0.
+    colors: the missing alpha is 1, a single component is a gray.
+    """
+    values = np.asarray(values, dtype=np.float32).reshape(len(values), -1)
+    if colors and values.shape[1] == 1:
+        values = np.repeat(values, 3, axis=1)
+    result = np.zeros((len(values), width), dtype=np.float32)
+    if colors and width == 4:
+        result[:, 3] = 1.0
+    k = min(width, values.shape[1])
+    result[:, :k] = values[:, :k]
+    return result
+
+def strongest_groups(vertex_ids, group_ids, weights, amount):
+    """
+    The group with the highest weight of each vertex, -1 for the vertices in no group.
+    vertex_ids, group_ids, weights: one row per (vertex, group) membership
+    """
+    result = np.full(amount, -1, dtype=np.int64)
+    if len(vertex_ids):
+        order = np.lexsort((-np.asarray(weights), vertex_ids))
+        vertices, first = np.unique(np.asarray(vertex_ids)[order], return_index=True)
+        result[vertices] = np.asarray(group_ids)[order][first]
+    return result
@@ -3,10 +3,14 @@ from bpy.types import (
     Operator,
     Panel,
 )
-from mathutils import (
-    Vector,
+from bpy.props import (
+    StringProperty,
 )
 from . import sanmodel as S
+from . import sanmodel_diff
+from . import async_ops
+from . import library_ops
+from . import sanmodel_exporter
 
 from .utils import (
     CONSOLE_DEBUG,
@@ -16,35 +20,63 @@ from .utils import (
     getDeepSelectionMeshes,
 )
 
+ESTIMATES_DISPLAYED = 20
+
+def format_size(size, text="{}"):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024 or unit == "MB":
+            return text.format(f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}")
+        size /= 1024
+
 class MESH_OT_debug_diff_sanmodel(Operator):
-    """debug operator: diff for the 2 last imported .sanmodel"""
+    """diff of 2 .sanmodel files (the 2 last imported .sanmodel if no file is set)"""
     bl_idname = "test.debug_diff_sanmodel"
     bl_label = "debug diff sanmodel"
 
-    @staticmethod
-    def list_numdiff(a, b):
-        len_a = len(a)
-        len_b = len(b)
-        len_min = min(len_a, len_b)
-        console_debug(f"\tlen a: {len_a}")
-        console_debug(f"\tlen b: {len_b}")
-        console_debug(f"\tlen b - a: {len_b - len_a}")
-        for i in range(0, len_min):
-            if a[i] != b[i]:
-                dif = (Vector(b[i])-Vector(a[i]))[:]
-                console_debug(f"\t{i}: {dif}")
+    path_a: StringProperty(
+        description="Full path of the reference sanmodel file",
+        default="",
+        )
+    path_b: StringProperty(
+        description="Full path of the compared sanmodel file",
+        default="",
+        )
+
+    def execute(self, context):
+        settings = context.scene.san_settings
+        path_a = bpy.path.abspath(self.path_a or settings.diff_path_a)
+        path_b = bpy.path.abspath(self.path_b or settings.diff_path_b)
+        # the models are shared with the importer through the registry
+        if path_a and path_b:
+            models = (S.load_model(path_a), S.load_model(path_b))
+        else:
+            models = S.last_models()
+            if not models:
+                console_notice("diff: set 2 files, or import 2 .sanmodel")
+                self.report({"ERROR"}, "Nothing to compare")
+                return {"CANCELLED"}
+        report = None
+        if all(models):
+            report = sanmodel_diff.diff_models(models[0].segments, models[1].segments, settings.diff_tolerance, settings.diff_weld)
+        if report is None:
+            self.report({"ERROR"}, f"Error with the specified file (see System Console for more detail)")
+            return {"CANCELLED"}
+
+        lines = sanmodel_diff.format_report(report)
+        for line in lines:
+            console_notice(line)
+        self.report({"INFO"} if report["ok"] else {"WARNING"}, lines[-1])
+        return {"FINISHED"}
+class SANMODEL_OT_registry_clear(Operator):
+    """remove every parsed model from the session registry"""
+    bl_idname = "sanmodel.registry_clear"
+    bl_label = "Clear parsed models"
 
     def execute(self, context):
-        if S.smd==None or S.smd_old==None:
-            console_debug("diff: {S.smd} and/or {S.smd_old} is 'None'\n")
-            return {"FINISHED"}
-        for i, e in enumerate(S.seg_names):
-            dif = S.smd.segments[i] != S.smd_old.segments[i]
-            if dif:
-                console_debug(f"{S.seg_names[i]} diff:")
-                MESH_OT_debug_diff_sanmodel.list_numdiff(S.smd.segments[i], S.smd_old.segments[i])
-        console_debug("checkdiff end\n")
+        S.models.clear()
+        console_notice("registry cleared")
         return {"FINISHED"}
+
 class MESH_OT_debug_sanmodel(Operator):
     """debug operator for currently selected object [0]"""
     bl_idname = "test.debug_sanmodel"
@@ -145,25 +177,104 @@ class VIEW_3D_PT_sanmodel_import_panel(SanmodelPanel, Panel):
             icon = "IMPORT",
             )
 
-        # details
-        if settings.valid_file and S.smd:
+        # models of the archive, only its table of contents is read
+        if S.archive_toc and S.archive_path == settings.path:
+            box.prop(settings, "archive_search", text="", icon="VIEWZOOM")
+            search = settings.archive_search.lower()
+            names = [name for name in S.archive_toc if search in name.lower()]
+            col = box.column(align=True)
+            for name in names[:S.ARCHIVE_DISPLAYED]:
+                row = col.row()
+                row.operator("import.archive_entry", text=name, depress=name == settings.archive_entry).entry = name
+                row.label(text=format_size(S.archive_toc[name][1]))
+            if len(names) > S.ARCHIVE_DISPLAYED:
+                col.label(text=f"... and {len(names) - S.ARCHIVE_DISPLAYED} more, refine the search")
+
+        # details, from the header only (cf probe_sanmodel)
+        if settings.valid_file and S.header:
+            sizes = S.header["sizes"]
             details = box.column(align=True)
             details.label(text="name: " + settings.name)
-            details.label(text="vertices: " + settings.vertices)
-            details.label(text="normals: " + settings.normals)
-            details.label(text="tangents: " + settings.tangents)
-            details.label(text="uv: " + settings.uv)
-            details.label(text="uv2: " + settings.uv2)
-            details.label(text="uv3: " + settings.uv3)
-            details.label(text="colors: " + settings.colors)
-            details.label(text="triangles: " + settings.triangles)
-            details.label(text="bones: " + settings.bindposes)
+            if settings.archive_entry:
+                details.label(text="archive entry: " + settings.archive_entry)
+            details.label(text="file size: " + format_size(S.header["file_size"]) + (f" ({S.header['compression']})" if S.header["compression"] else ""))
+            details.label(text="vertices: " + settings.vertices + format_size(sizes[S.SAN_VERTICES], " ({})"))
+            details.label(text="normals: " + settings.normals + format_size(sizes[S.SAN_NORMALS], " ({})"))
+            details.label(text="tangents: " + settings.tangents + format_size(sizes[S.SAN_TANGENTS], " ({})"))
+            details.label(text="uv: " + settings.uv + format_size(sizes[S.SAN_UV1], " ({})"))
+            details.label(text="uv2: " + settings.uv2 + format_size(sizes[S.SAN_UV2], " ({})"))
+            details.label(text="uv3: " + settings.uv3 + format_size(sizes[S.SAN_UV3], " ({})"))
+            details.label(text="colors: " + settings.colors + format_size(sizes[S.SAN_COLORS], " ({})"))
+            details.label(text="triangles: " + settings.triangles + format_size(sizes[S.SAN_INDICES], " ({})"))
+            details.label(text="bones: " + settings.bindposes + format_size(sizes[S.SAN_BINDPOSES], " ({})"))
             details.label(text="boneweights: " + settings.boneweights)
+            if S.header["bounds"]:
+                low, high = S.header["bounds"]
+                details.label(text="bounds min: " + ", ".join(f"{v:.3f}" for v in low))
+                details.label(text="bounds max: " + ", ".join(f"{v:.3f}" for v in high))
+            if S.header["sphere"]:
+                sphere = S.header["sphere"]
+                details.label(text="sphere: " + ", ".join(f"{v:.3f}" for v in sphere["center"]) + f", radius {sphere['radius']:.3f}")
+            if S.header["bones"]:
+                details.label(text=f"bounds of {len(S.header['bones'])} bones (_bounds.json)")
 
             # create model
-            layout.operator("mesh.sanmodel_import",
+            layout.operator("sanmodel.async_create",
                 text="Create new object",
                 icon="MESH_CUBE")
+
+        # proxies of the heavy models
+        col = layout.column(align=True)
+        col.prop(settings, "use_proxy")
+        if settings.use_proxy:
+            col.prop(settings, "proxy_min_triangles")
+            col.prop(settings, "proxy_resolution")
+        # imported objects updated when their file changes, cf watch_ops
+        box = layout.box()
+        row = box.row(align=True)
+        row.prop(settings, "watch_changes")
+        row.operator("sanmodel.watch_sync", text="", icon="FILE_REFRESH")
+        if settings.watch_changes:
+            box.prop(settings, "watch_interval")
+            box.prop(settings, "watch_folder")
+
+        proxies = sum(1 for obj in context.selected_objects if obj.get("sanmodel_proxy"))
+        if proxies:
+            layout.operator("sanmodel.full_resolution",
+                text=f"Full resolution ({proxies} proxies)",
+                icon="MOD_DECIM")
+class VIEW_3D_PT_sanmodel_library_panel(SanmodelPanel, Panel):
+    bl_label = "Library"
+    bl_idname = "SANMODEL_PANEL_PT_sanmodel_library_panel"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context):
+        settings = context.scene.san_settings
+        layout = self.layout
+        row = layout.row(align=True)
+        row.prop(settings, "library_folder", text="")
+        row.operator("sanmodel.library_scan", text="", icon="FILE_REFRESH")
+        if not settings.library_folder:
+            return
+        col = layout.column(align=True)
+        col.prop(settings, "library_search", text="", icon="VIEWZOOM")
+        col.prop(settings, "library_max_triangles")
+
+        folder = library_ops.library_folder(settings)
+        results = library_ops.search_results(settings)
+        if not results:
+            layout.label(text="no model, scan the folder" if settings.library_search == "" and not settings.library_max_triangles else "no model found")
+            return
+        col = layout.column(align=True)
+        for entry in results[:library_ops.LIBRARY_DISPLAYED]:
+            row = col.row()
+            row.label(text="", icon_value=library_ops.thumbnail_icon(folder, entry))
+            row.label(text=entry["name"])
+            row.label(text=f"{entry['triangles']} tris")
+            row.operator("sanmodel.library_import", text="", icon="IMPORT").path = entry["path"]
+        if len(results) > library_ops.LIBRARY_DISPLAYED:
+            col.label(text="... refine the search to see more")
+
 class VIEW_3D_PT_sanmodel_export_panel(SanmodelPanel, Panel):
     bl_label = "Export"
     bl_idname = "SANMODEL_PANEL_PT_sanmodel_export_panel"
@@ -177,9 +288,83 @@ class VIEW_3D_PT_sanmodel_export_panel(SanmodelPanel, Panel):
 
         col = self.layout.column(align=False)
         # col.prop(settings, "model_name")
-        col.operator("mesh.sanmodel_export",
+        # channels table: source of the UV1, UV2, UV3 and colors segments
+        box = col.box()
+        for channel, segment in S.CHANNELS:
+            row = box.row(align=True)
+            row.prop(settings, channel + "_source")
+            if getattr(settings, channel + "_source") not in ("NONE", "BONES", "MATERIAL"):
+                row.prop(settings, channel + "_layer", text="")
+        col.prop(settings, "clean_on_export")
+        col.prop(settings, "reuse_unmodified")
+        col.prop(settings, "write_bounds")
+        budgets = col.row(align=True)
+        budgets.prop(settings, "vertex_budget", text="Vertices")
+        budgets.prop(settings, "triangle_budget", text="Triangles")
+        col.prop(settings, "spatial_sort")
+        if settings.spatial_sort:
+            col.prop(settings, "chunk_triangles")
+            col.prop(settings, "chunk_bounds")
+        col.prop(settings, "compression")
+        col.prop(settings, "pack_on_export")
+        col.prop(settings, "merge_on_export")
+        if settings.merge_on_export:
+            col.prop(settings, "use_atlas")
+        col.operator("sanmodel.async_export",
                 text=f"export {selected} ({deep_selected}) objects",
                 icon="EXPORT")
+        col.operator("sanmodel.export_estimate", icon="PREVIEW_RANGE")
+
+        # dry run: 1 row per file, the columns headers sort the table
+        estimates = sanmodel_exporter.estimates
+        if not estimates:
+            return
+        box = self.layout.box()
+        header = box.row(align=True)
+        for key in ("NAME", "VERTICES", "TRIANGLES", "SIZE", "MS"):
+            header.prop_enum(settings, "estimate_sort", key)
+        key = settings.estimate_sort.lower()
+        rows = sorted(estimates, key=lambda e: e[key], reverse=key != "name")
+        col = box.column(align=True)
+        for estimate in rows[:ESTIMATES_DISPLAYED]:
+            row = col.row(align=True)
+            row.label(text=estimate["name"], icon="ERROR" if estimate["over_budget"] else "NONE")
+            row.label(text=str(estimate["vertices"]))
+            row.label(text=str(estimate["triangles"]))
+            row.label(text=format_size(estimate["size"]))
+            row.label(text=f"{estimate['ms'] / 1000:.1f} s")
+        if len(rows) > ESTIMATES_DISPLAYED:
+            col.label(text=f"... and {len(rows) - ESTIMATES_DISPLAYED} more")
+        total = box.row(align=True)
+        total.label(text=f"{len(rows)} files")
+        total.label(text=str(sum(e["vertices"] for e in rows)))
+        total.label(text=str(sum(e["triangles"] for e in rows)))
+        total.label(text=format_size(sum(e["size"] for e in rows)))
+        total.label(text=f"{sum(e['ms'] for e in rows) / 1000:.1f} s")
+
+class VIEW_3D_PT_sanmodel_tasks_panel(SanmodelPanel, Panel):
+    bl_label = "Tasks"
+    bl_idname = "SANMODEL_PANEL_PT_sanmodel_tasks_panel"
+
+    @classmethod
+    def poll(cls, context):
+        return bool(async_ops.task["name"])
+
+    def draw(self, context):
+        layout = self.layout
+        task = async_ops.task
+        state = f"{task['done']}/{task['total']}" if task["running"] else "finished"
+        layout.label(text=f"{task['name']}: {state}", icon="SORTTIME" if task["running"] else "CHECKMARK")
+        if task["running"]:
+            layout.label(text="Esc to cancel")
+        col = layout.column(align=True)
+        status = async_ops.status
+        for name, state in status[-async_ops.STATUS_DISPLAYED:]:
+            row = col.row()
+            row.label(text=name)
+            row.label(text=state)
+        if len(status) > async_ops.STATUS_DISPLAYED:
+            col.label(text=f"... and {len(status) - async_ops.STATUS_DISPLAYED} more")
 
 class VIEW_3D_PT_sanmodel_settings_panel(SanmodelPanel, Panel):
     bl_label = "Settings"
@@ -198,9 +383,14 @@ class VIEW_3D_PT_sanmodel_settings_panel(SanmodelPanel, Panel):
         # settings
         # layout.prop(settings, rna_path.identifier, text=rna_path.name)
         layout.prop(settings, rna_swap_yz.identifier, text=rna_swap_yz.name)
+        layout.prop(settings, "mirror_x_axis")
+        layout.prop(settings, "unit_scale")
         layout.prop(settings, rna_mirror_uv_vertically.identifier, text=rna_mirror_uv_vertically.name)
         layout.prop(settings, rna_use_vertex_color.identifier, text=rna_use_vertex_color.name)
-        if settings.use_vertex_colors:
+        layout.prop(settings, "use_textures")
+        if settings.use_textures:
+            layout.prop(settings, "textures_folder")
+        if settings.use_vertex_colors or settings.use_textures:
             layout.prop(settings, rna_use_alpha.identifier, text=rna_use_alpha.name)
         layout.prop(settings, rna_shading_nodes.identifier, text=rna_shading_nodes.name)
 class VIEW_3D_PT_sanmodel_debug_panel(SanmodelPanel, Panel):
@@ -208,15 +398,30 @@ class VIEW_3D_PT_sanmodel_debug_panel(SanmodelPanel, Panel):
     bl_idname = "SANMODEL_PANEL_PT_sanmodel_debug_panel"
     
     def draw(self, context):
-        # settings = context.scene.san_settings
+        settings = context.scene.san_settings
         layout = self.layout
         if CONSOLE_DEBUG:
             layout.operator("test.debug_sanmodel",
                 text = "selected objects debug",
                 icon = "INFO")
-            layout.operator("test.debug_diff_sanmodel",
-                text = "diff of the 2 last imported .sanmodel",
-                icon = "ARROW_LEFTRIGHT")
+        box = layout.box()
+        box.prop(settings, "diff_path_a")
+        box.prop(settings, "diff_path_b")
+        row = box.row()
+        row.prop(settings, "diff_tolerance")
+        row.prop(settings, "diff_weld")
+        box.operator("test.debug_diff_sanmodel",
+            text = "diff" if settings.diff_path_a and settings.diff_path_b else "diff of the 2 last imported .sanmodel",
+            icon = "ARROW_LEFTRIGHT")
+
+        # parsed models of the session, cf registry.py
+        stats = S.models.stats()
+        box = layout.box()
+        box.prop(settings, "registry_budget")
+        col = box.column(align=True)
+        col.label(text=f"models: {stats['models']}, " + format_size(stats["resident"], "{} of ") + format_size(stats["budget"]))
+        col.label(text=f"hits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']}")
+        box.operator("sanmodel.registry_clear", icon="TRASH")
 
 # UI example : File > import
 # def import_menu_draw(self, context):
@@ -230,11 +435,14 @@ class VIEW_3D_PT_sanmodel_debug_panel(SanmodelPanel, Panel):
 
 blender_classes = [ 
     VIEW_3D_PT_sanmodel_import_panel,
+    VIEW_3D_PT_sanmodel_library_panel,
     VIEW_3D_PT_sanmodel_export_panel,
+    VIEW_3D_PT_sanmodel_tasks_panel,
     VIEW_3D_PT_sanmodel_settings_panel,
     VIEW_3D_PT_sanmodel_debug_panel,
     MESH_OT_debug_sanmodel,
-    MESH_OT_debug_diff_sanmodel
+    MESH_OT_debug_diff_sanmodel,
+    SANMODEL_OT_registry_clear,
 ]
 
 def register():
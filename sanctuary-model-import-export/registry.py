@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Parsed models of the session (no bpy), shared by the importer, the diff and the batch operations.
+# Models are keyed by their source (path, archive entry), a model is read again when its file changed.
+# Models have a segments list of numpy arrays, and an optional proxy (cf SanmodelData).
+# The least recently used models are evicted when their memory is over the budget.
+
+REGISTRY_BUDGET_MB = 512
+
+def model_bytes(model):
+    # the segments are numpy arrays (cf SanmodelData)
+    size = sum(s.nbytes for s in model.segments)
+    if getattr(model, "proxy", None):
+        size += sum(array.nbytes for array in model.proxy[1:])
+    return size
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+class ModelRegistry:
+    """least recently used cache of parsed models, thread safe (models are read in the async_ops threads)"""
+    def __init__(self, budget_mb=REGISTRY_BUDGET_MB):
+        self.budget = budget_mb * 1024 * 1024
+        self.models = OrderedDict() # source: (signature, model, bytes), the most recent last
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident = 0
+
+    def lookup(self, source):
+        # the model if it's loaded and its file didn't change, without reading it
+        try:
+            signature = file_signature(source[0])
+        except OSError:
+            signature = None
+        with self.lock:
+            entry = self.models.get(source)
+            if entry is None or entry[0] != signature:
+                return None
+            self.models.move_to_end(source)
+            self.hits += 1
+            return entry[1]
+
+    def get(self, source, load):
+        """the model of source = (path, entry), load() reads it when it isn't loaded (or its file changed), returns None on error"""
+        model = self.lookup(source)
+        if model is not None:
+            return model
+        with self.lock:
+            self.misses += 1
+        try:
+            signature = file_signature(source[0])
+        except OSError:
+            return None
+        model = load()
+        if model is not None:
+            self.put(source, model, signature)
+        return model
+
+    def put(self, source, model, signature=None):
+        size = model_bytes(model)
+        if signature is None:
+            signature = file_signature(source[0])
+        with self.lock:
+            self.discard_locked(source)
+            self.models[source] = (signature, model, size)
+            self.resident += size
+            self.evict_locked()
+
+    def update_size(self, source, model):
+        # model grew since it was put (its proxy was computed), its memory is counted again
+        with self.lock:
+            entry = self.models.get(source)
+            if entry is None or entry[1] is not model:
+                return
+            size = model_bytes(model)
+            self.models[source] = (entry[0], model, size)
+            self.resident += size - entry[2]
+            self.evict_locked()
+
+    def discard_locked(self, source):
+        entry = self.models.pop(source, None)
+        if entry:
+            self.resident -= entry[2]
+
+    def evict_locked(self):
+        # the last model is kept even over the budget, it's the one being used
+        while self.resident > self.budget and len(self.models) > 1:
+            _, (_, _, size) = self.models.popitem(last=False)
+            self.resident -= size
+            self.evictions += 1
+
+    def discard(self, source):
+        with self.lock:
+            self.discard_locked(source)
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = budget_mb * 1024 * 1024
+            self.evict_locked()
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            self.resident = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": len(self.models),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident": self.resident,
+                "budget": self.budget,
+            }
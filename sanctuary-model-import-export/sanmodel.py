@@ -1,9 +1,10 @@
 
 import numpy as np
-from io import StringIO
 import struct
-import random
 import os
+import json
+import hashlib
+import types
 import bpy
 from array import array
 from mathutils import (
@@ -34,34 +35,59 @@ from .utils import (
     console_notice,
     console_debug,
     console_debug_data,
-    vecSanmodelToBlender,
-    vecBlenderToSanmodel,
 )
+from . import mesh_ops
+from . import bounds
+from . import archive
+from . import registry
 
-seg_names = ["vertices", "normals", "tangents", "uv1", "uv2 (boneweights)", "uv3", "colors", "indices", "bindposes"]
-seg_vars = [3, 3, 4, 2, 2, 2, 4, 1, 16] # cf file structure
-smd_old = None
-smd = None
-SAN_ENDIAN = "<"
-SAN_VERTICES = 0
-SAN_NORMALS = 1
-SAN_TANGENTS = 2
-SAN_UV1 = 3
-SAN_UV2 = 4
-SAN_UV3 = 5
-SAN_COLORS = 6
-SAN_INDICES = 7
-SAN_BINDPOSES = 8
+from .sanmodel_format import (
+    seg_names,
+    seg_vars,
+    SAN_ENDIAN,
+    SAN_VERTICES,
+    SAN_NORMALS,
+    SAN_TANGENTS,
+    SAN_UV1,
+    SAN_UV2,
+    SAN_UV3,
+    SAN_COLORS,
+    SAN_INDICES,
+    SAN_BINDPOSES,
+    probe_sanmodel,
+    parse_sanmodel,
+    read_sanmodel_bytes,
+)
+
+header = None # probe_sanmodel() of the file in the import panel, the file is decoded only to create the object
+archive_path = "" # archive opened in the import panel, and its table of contents {name: (offset, length)}
+archive_toc = {}
+ARCHIVE_DISPLAYED = 30
+models = registry.ModelRegistry() # parsed models of the session, by (path, archive entry)
+recent = [] # the 2 last created models, compared by the diff (kept even if the registry evicted or replaced them)
 UV1_NAME = "UV1Map"
 UV2_NAME = "UV2Map"
 UV3_NAME = "UV3Map"
 
-# int.from_bytes(b"\x00\x00\x00\xff", byteorder="big") # 255
-# int.from_bytes(b"\x00\x00\x00\xff", byteorder="little") # 4278190080
-# https://docs.python.org/3/library/struct.html
-def reinterpret_float_to_int(float_value):
-    return struct.unpack(SAN_ENDIAN+"i", struct.pack(SAN_ENDIAN+"f", float_value))[0]
+# exported channels: (settings prefix, segment), each one has a <prefix>_source and a <prefix>_layer setting
+CHANNELS = [
+    ("uv1", SAN_UV1),
+    ("uv2", SAN_UV2),
+    ("uv3", SAN_UV3),
+    ("colors", SAN_COLORS),
+]
+CHANNEL_SOURCES = [
+    ("NONE", "None", "Empty segment"),
+    ("UV", "UV layer", "UV layer by name, or by index (0 is the first one)"),
+    ("COLOR", "Color attribute", "Color attribute by name, the active one if empty"),
+    ("GROUP", "Vertex group", "Weight of the vertex group with this name"),
+    ("BONES", "Bone ids", "Bone of the strongest vertex group of each vertex (boneweights). Without an armature, the UV2Map layer for UV2"),
+    ("ATTRIBUTE", "Attribute", "Float, vector or color attribute by name, on the points or the face corners"),
+    ("MATERIAL", "Material", "Active color attribute, or the color of the material for all vertices"),
+]
 
+def update_registry_budget(self, context):
+    models.set_budget(self.registry_budget)
 
 class SanImportSettings(PropertyGroup):
     # internal properties
@@ -83,6 +109,12 @@ class SanImportSettings(PropertyGroup):
     bindposes : StringProperty(name="bones", default = "0")
     boneweights : StringProperty(name="boneweights", default = "0")  
     valid_file : BoolProperty(name="validation check", default = False)
+    archive_entry : StringProperty(
+        name="archive entry",
+        description="name of the model in the archive, empty if the file is a sanmodel",
+        default = "",
+        options={'SKIP_SAVE'}
+        )
     
     # user settings
     swap_yz_axis : BoolProperty(
@@ -90,6 +122,19 @@ class SanImportSettings(PropertyGroup):
         description="Swap y and z coordinates of vertices",
         default = True
         )
+    mirror_x_axis : BoolProperty(
+        name="Mirror X axis",
+        description="Mirror x coordinates of vertices, changes the handedness (and the triangles winding) like swapping Y and Z",
+        default = False
+        )
+    unit_scale : FloatProperty(
+        name="Scale",
+        description="Blender units per sanmodel unit, the export divides by it",
+        default = 1.0,
+        min = 1e-6,
+        soft_min = 0.001,
+        soft_max = 1000.0
+        )
     mirror_uv_vertically : BoolProperty(
         name="Mirror UV vertically",
         description="Blender handle some textures differently.",
@@ -97,7 +142,7 @@ class SanImportSettings(PropertyGroup):
         )
     use_vertex_colors : BoolProperty(
         name="Use vertex colors",
-        description="Enable or disable the use of vertex colors for triangles shading",
+        description="Shade the triangles with the vertex colors (the colors are always imported as a color attribute)",
         default = False
         )
     use_alpha : BoolProperty(
@@ -110,6 +155,195 @@ class SanImportSettings(PropertyGroup):
         description="Generate shading nodes depending on previous settings (vertex_color, uv)",
         default = False
         )
+    use_textures : BoolProperty(
+        name="Load textures",
+        description="Find the textures by name (<name>.dds, <name>_normal.dds, <name>_mask.dds) and create a material with them",
+        default = False
+        )
+    textures_folder : StringProperty(
+        name="Textures folder",
+        description="Folder of the textures. If empty, the 'Textures' folder next to the models folder is used",
+        default = "",
+        subtype = 'DIR_PATH'
+        )
+    uv1_source : EnumProperty(name="UV1", description="Source of the UV1 segment", items=CHANNEL_SOURCES, default = "UV")
+    uv1_layer : StringProperty(name="UV1 layer", description="Name (or UV layer index) of the source", default = "0")
+    uv2_source : EnumProperty(name="UV2", description="Source of the UV2 segment, the game reads the bone ids in it", items=CHANNEL_SOURCES, default = "BONES")
+    uv2_layer : StringProperty(name="UV2 layer", description="Name (or UV layer index) of the source", default = "")
+    uv3_source : EnumProperty(name="UV3", description="Source of the UV3 segment", items=CHANNEL_SOURCES, default = "UV")
+    uv3_layer : StringProperty(name="UV3 layer", description="Name (or UV layer index) of the source", default = "1")
+    colors_source : EnumProperty(name="Colors", description="Source of the colors segment", items=CHANNEL_SOURCES, default = "MATERIAL")
+    colors_layer : StringProperty(name="Colors layer", description="Name of the source", default = "")
+    clean_on_export : BoolProperty(
+        name="Clean on export",
+        description="Remove degenerate triangles (zero area), triangles with invalid or NaN/Inf vertices, and unused vertices",
+        default = True
+        )
+    reuse_unmodified : BoolProperty(
+        name="Reuse unmodified imports",
+        description="Write the objects unmodified since their import from the segments of their file, without evaluating their mesh",
+        default = True
+        )
+    spatial_sort : BoolProperty(
+        name="Spatial sort",
+        description="Reorder the triangles along a Morton curve, in chunks of close triangles, and the vertices by first use",
+        default = False
+        )
+    chunk_triangles : IntProperty(
+        name="Chunk triangles",
+        description="Triangles per chunk of the spatial sort",
+        default = 124,
+        min = 1
+        )
+    chunk_bounds : BoolProperty(
+        name="Chunk bounds",
+        description="Write the bounding sphere of each chunk in <name>_chunks.json",
+        default = False
+        )
+    write_bounds : BoolProperty(
+        name="Write bounds",
+        description="Write the bounding box, bounding sphere and per bone bounds in <name>_bounds.json",
+        default = True
+        )
+    vertex_budget : IntProperty(
+        name="Vertex budget",
+        description="Files with more vertices are flagged in the export manifest (0: no budget)",
+        default = 0,
+        min = 0
+        )
+    triangle_budget : IntProperty(
+        name="Triangle budget",
+        description="Files with more triangles are flagged in the export manifest (0: no budget)",
+        default = 0,
+        min = 0
+        )
+    merge_on_export : BoolProperty(
+        name="Merge on export",
+        description="Merge the selected objects (or each selected EMPTY with its children) into a single sanmodel",
+        default = False
+        )
+    registry_budget : IntProperty(
+        name="Models memory (MB)",
+        description="Memory of the parsed models kept for the session, the least recently used ones are removed over it",
+        default = registry.REGISTRY_BUDGET_MB,
+        min = 1,
+        update = update_registry_budget
+        )
+    diff_path_a : StringProperty(
+        name="Reference",
+        description="Reference sanmodel file of the diff",
+        default = "",
+        subtype = 'FILE_PATH'
+        )
+    diff_path_b : StringProperty(
+        name="Compared",
+        description="Sanmodel file compared to the reference",
+        default = "",
+        subtype = 'FILE_PATH'
+        )
+    diff_tolerance : FloatProperty(
+        name="Tolerance",
+        description="Maximum difference for 2 values to be considered equal",
+        default = 1e-4,
+        min = 0.0,
+        precision = 6
+        )
+    diff_weld : BoolProperty(
+        name="Weld",
+        description="Merge identical vertices before comparing, to compare a split export with its source",
+        default = False
+        )
+    use_atlas : BoolProperty(
+        name="Texture atlas",
+        description="When merging, pack the textures of the objects in one atlas image and remap their UV1",
+        default = False
+        )
+    use_proxy : BoolProperty(
+        name="Proxy for heavy models",
+        description="Create a simplified mesh (vertex clustering) for the models with many triangles, the full resolution is loaded on demand",
+        default = False
+        )
+    proxy_min_triangles : IntProperty(
+        name="From triangles",
+        description="Models with at least this amount of triangles are created as a proxy",
+        default = 20000,
+        min = 0
+        )
+    proxy_resolution : IntProperty(
+        name="Proxy resolution",
+        description="Cells of the clustering grid on the longest side of the model, the proxy has at most one vertex per cell",
+        default = 32,
+        min = 2,
+        max = 1024
+        )
+    library_folder : StringProperty(
+        name="Library",
+        description="Folder of sanmodel files, indexed with their thumbnail (sanmodel_library.db in this folder)",
+        default = "",
+        subtype = 'DIR_PATH'
+        )
+    library_search : StringProperty(
+        name="Search",
+        description="Only list the models with this text in their name",
+        default = "",
+        options={'TEXTEDIT_UPDATE'}
+        )
+    archive_search : StringProperty(
+        name="Search",
+        description="Only list the archive entries with this text in their name",
+        default = "",
+        options={'TEXTEDIT_UPDATE'}
+        )
+    compression : EnumProperty(
+        name="Compression",
+        description="Write compressed sanmodel files, the game must support the compressed container",
+        items=[
+            ("NONE", "None", "Plain sanmodel files"),
+            ("ZLIB", "zlib", "Fast to decompress"),
+            ("LZMA", "lzma", "Smaller files, slower to decompress"),
+        ],
+        default = "NONE"
+        )
+    watch_changes : BoolProperty(
+        name="Watch imported files",
+        description="Update the imported objects in place when their file changes (transform, materials and modifiers are kept)",
+        default = False
+        )
+    watch_interval : FloatProperty(
+        name="Interval",
+        description="Seconds between the checks of the imported files",
+        default = 2.0,
+        min = 0.5,
+        )
+    watch_folder : StringProperty(
+        name="Watched folder",
+        description="Only watch the files of this folder, every imported file if empty",
+        default = "",
+        subtype = "DIR_PATH",
+        )
+    estimate_sort : EnumProperty(
+        name="Sort",
+        description="Order of the export estimates, the heaviest first",
+        items=[
+            ("MS", "time", "Estimated export duration"),
+            ("SIZE", "size", "Estimated file size"),
+            ("TRIANGLES", "tris", "Triangles"),
+            ("VERTICES", "verts", "Vertices after splitting"),
+            ("NAME", "name", "File name"),
+        ],
+        default = "MS"
+        )
+    pack_on_export : BoolProperty(
+        name="Pack in archive",
+        description="Also pack the files of the export in _sanmodel_exports/sanmodels.sanpack",
+        default = False
+        )
+    library_max_triangles : IntProperty(
+        name="Max triangles",
+        description="Only list the models with at most this amount of triangles (0: no limit)",
+        default = 0,
+        min = 0
+        )
     
     # model_name is not used anymore for export, it may change later.
     # https://blender.stackexchange.com/questions/203442/how-to-pass-a-bpy-data-objects-bpy-data-materials-etc-to-an-operator-from-th
@@ -121,123 +355,309 @@ class SanImportSettings(PropertyGroup):
         )
 
 class SanmodelData():
-    content: bytes
-    name: StringIO
-    segments: list
-    
-    def process_data(self, context):
-        # read name
-        try:
-            self.name, self.content = self.content.split(b'\0', 1)
-        except ValueError:
-            console_notice("Error with the specified file, invalid data")
-            return False
-        self.name = self.name.decode()
-        content_len = len(self.content)
-        bsize = 4 # size for each value in bytes
-        console_notice("model name: %s, content len: %d bytes, %d values" % (self.name, content_len, content_len/bsize))
-        if (content_len % bsize) > 0:
-            console_notice("Error with the specified file, invalid data: should be only 4 bytes number after the null terminated name")
-            return False
+    """
+    A parsed sanmodel: its name and its segments, as numpy arrays of shape (n, seg_vars[i]) (indices as triangles, shape (n, 3)).
+    The arrays are views on the content of the file (cf parse_sanmodel), ~12 bytes per vertex for the positions.
+    """
+    __slots__ = ("name", "segments", "path", "entry", "proxy")
 
-        console_debug("---------------- File content (without the name) -----------------")
-        console_debug_data(self.content)
-        console_debug("---------------- END ---------------------------------------------")
-        # convert bytes to floats
-        self.content = np.array(list(struct.iter_unpack(SAN_ENDIAN+"f", self.content[0:content_len])), dtype=float).flatten()
-        
-        # build segments arrays
+    def __init__(self, path="", entry=""):
+        self.name = ""
         self.segments = []
-        global seg_names
-        global seg_vars
-        for i, vars in enumerate(seg_vars):
-            if not len(self.content):
-                console_notice("Error with the specified file, invalid data: missing data")
-                return False
-            segment_len = reinterpret_float_to_int(self.content[0]) * vars
-            console_debug(f"[Read Process] segment[{i}]: {seg_names[i]}: {segment_len/seg_vars[i]}, {segment_len} values ({segment_len*4} bytes)")
-            if (segment_len):
-                # console_debug("slicing data:")
-                data = self.content[1:1+segment_len]
-
-                #reinterpret indices and boneWeights data as int
-                if i == SAN_INDICES:
-                    for j in range(len(data)):
-                        data[j] = reinterpret_float_to_int(data[j])
-
-                console_debug_data(data)
-                self.segments.append(data) # will rebuild this as tuples later
-                self.content = self.content[1+segment_len:]
-            else:
-                # console_debug("slicing nothing")
-                self.content = self.content[1:]
-                self.segments.append([])
-        console_debug(f"data left: {len(self.content)}")
-        if len(self.content):
-            console_debug_data(self.content)
-        if len(self.content):
-            console_notice("Error with the specified file, invalid data: slicing left some data, this shouldn't be the case.")
+        self.path = path
+        self.entry = entry # name in the archive path
+        self.proxy = None # (resolution, vertices, triangles), cf simplify
+
+    def process_data(self, content):
+        # content: the bytes of a plain sanmodel file
+        parsed = parse_sanmodel(content)
+        if parsed is None:
             return False
-        
-        #reinterpret indices and boneWeights data as int
-        #for i in range(7, 9):
-        #    for j in range(len(self.segments[i])):
-        #        self.segments[i][j] = reinterpret_float_to_int(self.segments[i][j]) # and automatically recasted as float because it's a float array
-        
-        # rebuild float arrays to tuple arrays, ex:
-        # from : [0, 1, 2, 3, 4, 5, 6, 7, 8]
-        # to : [(0, 1, 2), (3, 4, 5), (6, 7, 8)]
-        # tuple len is seg_vars[i]
-        seg_vars[SAN_INDICES] = 3 # group indices as tuple(1,2,3) for 1 triangle/face
-        r = len(seg_vars) - 1 # for now, ignore the last one (bindposes) 
-        for i in range(r):
-            tmp = []
-            for j in range(len(self.segments[i])//seg_vars[i]):
-                tmp.append(tuple(self.segments[i][j*seg_vars[i]:j*seg_vars[i]+seg_vars[i]]))
-            self.segments[i] = tmp
-        seg_vars[SAN_INDICES] = 1
-
-        # SAN_INDICES: convert tuple(float,float,float) to tuple(int,int,int)
-        self.segments[SAN_INDICES] = [tuple(map(int, t)) for t in self.segments[SAN_INDICES]]
+        self.name, segments = parsed
+        console_notice(f"model name: {self.name}, content len: {len(content)} bytes")
+        self.segments = list(segments)
+        self.segments[SAN_INDICES] = segments[SAN_INDICES].reshape(-1, 3) # 1 triangle/face per row
         return True
-    
-    def create_obj(self, context):
-        settings = context.scene.san_settings
-        console_notice("building mesh...")
-        mesh = bpy.data.meshes.new(self.name + "Mesh")
 
-        #swap z and y axis to match unity
-        vertices = self.segments[SAN_VERTICES][:]
-        indices = self.segments[SAN_INDICES][:]
-        if settings.swap_yz_axis:
-            vertices = [vecSanmodelToBlender(v) for v in vertices]
-            indices = [vecSanmodelToBlender(i) for i in indices]
+    def simplify(self, resolution):
+        # vertex clustering of the model (no bpy call, it can run in a thread), computed once per resolution
+        if self.proxy is None or self.proxy[0] != resolution:
+            vertices, triangles, _ = mesh_ops.cluster_simplify(self.segments[SAN_VERTICES], self.segments[SAN_INDICES], resolution)
+            self.proxy = (resolution, vertices, triangles)
+            models.update_size((self.path, self.entry), self)
+        return self.proxy[1], self.proxy[2]
+
+    def geometry(self, settings, proxy_resolution=0):
+        # vertices and triangles in Blender coordinates (of the proxy if proxy_resolution)
+        #swap z and y axis to match unity, the winding follows the handedness
+        basis = coordinate_basis(settings)
+        if proxy_resolution:
+            vertices, indices = self.simplify(proxy_resolution)
+        else:
+            vertices, indices = self.segments[SAN_VERTICES], self.segments[SAN_INDICES]
+        vertices = mesh_ops.transform_points(basis, vertices)
+        indices = mesh_ops.transform_triangles(basis, np.asarray(indices, dtype=np.int32))
+        return vertices, indices
 
-        mesh.from_pydata(vertices,[],indices)
-        
-        mesh.update(calc_edges=True)
+    def create_obj(self, context, proxy_resolution=0):
+        # proxy_resolution: create the simplified mesh instead, the object keeps its source to load the full resolution later
+        settings = context.scene.san_settings
+        console_notice("building proxy mesh..." if proxy_resolution else "building mesh...")
+        mesh = bpy.data.meshes.new(self.name + "Mesh")
+        vertices, indices = self.geometry(settings, proxy_resolution)
+        fill_mesh(mesh, vertices, indices)
         # create new obj with the mesh
         obj = bpy.data.objects.new(self.name, mesh)
         obj.location = context.scene.cursor.location
         context.scene.collection.objects.link(obj)
         context.view_layer.objects.active = obj
         obj.select_set(True)
+        # source of the object, to load its full resolution or update it when the file changes (cf watch_ops)
+        obj["sanmodel_path"] = self.path
+        obj["sanmodel_entry"] = self.entry
+        obj["sanmodel_signature"] = source_signature(self.path)
+        obj["sanmodel_settings"] = import_settings(settings) # also for the proxies, cf update_obj
+        if proxy_resolution:
+            obj["sanmodel_proxy"] = proxy_resolution # the resolution it's rebuilt with when its file changes
+            console_notice(f"proxy: {len(vertices)} vertices, {len(indices)} triangles")
         return obj
+
+    def update_obj(self, context, obj, proxy_resolution=0):
+        # rebuilds the mesh of obj in place with foreach_set: the object keeps its transform, materials and modifiers
+        # and its coordinates: the settings may have changed since its import
+        settings = object_settings(obj, context.scene.san_settings)
+        vertices, indices = self.geometry(settings, proxy_resolution)
+        obj.data.clear_geometry()
+        fill_mesh(obj.data, vertices, indices)
+        console_notice(f"{obj.name}: updated, {len(vertices)} vertices, {len(indices)} triangles")
  
+def fill_mesh(mesh, vertices, indices):
+    # the triangles of an empty mesh with foreach_set (from_pydata doesn't take numpy arrays in 3.2)
+    mesh.vertices.add(len(vertices))
+    mesh.loops.add(indices.size)
+    mesh.polygons.add(len(indices))
+    mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+    mesh.loops.foreach_set("vertex_index", indices.ravel())
+    mesh.polygons.foreach_set("loop_start", np.arange(0, indices.size, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(len(indices), 3, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+def coordinate_basis(settings):
+    # sanmodel -> blender, cf mesh_ops.coordinate_basis. The export uses its inverse.
+    return mesh_ops.coordinate_basis(settings.swap_yz_axis, settings.mirror_x_axis, settings.unit_scale)
+
+def source_signature(path):
+    # "mtime:size" of the file of an imported object, "" if it can't be read (an IDProperty int is only 32 bits)
+    try:
+        return "{}:{}".format(*registry.file_signature(path))
+    except OSError:
+        return ""
+
+# the settings that change the object created from a file
+IMPORT_SETTINGS = ["swap_yz_axis", "mirror_x_axis", "unit_scale", "mirror_uv_vertically"]
+
+def import_settings(settings):
+    # stored on the object as json
+    return json.dumps({name: getattr(settings, name) for name in IMPORT_SETTINGS}, sort_keys=True)
+
+def object_settings(obj, settings):
+    # the import settings obj was created with (the current ones for an object without them), to update it the same way
+    stored = json.loads(obj.get("sanmodel_settings", "{}"))
+    return types.SimpleNamespace(**{name: stored.get(name, getattr(settings, name)) for name in IMPORT_SETTINGS})
+
+def default_channels(settings):
+    # the channels table is the default one: the export writes the segments where the importer read them
+    props = settings.bl_rna.properties
+    return all(getattr(settings, name) == props[name].default
+        for channel, _ in CHANNELS for name in (channel + "_source", channel + "_layer"))
+
+def foreach_bytes(collection, attribute, size, dtype=np.float32):
+    values = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attribute, values)
+    return values.tobytes()
+
+def material_color_bytes(obj):
+    # the colors the export uses without a color attribute (cf MESH_OT_sanmodel_export.extract_colors)
+    mat = obj.active_material
+    if not mat:
+        return b""
+    colors = [mat.diffuse_color]
+    bsdf = mat.node_tree.nodes.get("Principled BSDF") if mat.use_nodes else None
+    if bsdf:
+        colors.append(bsdf.inputs["Base Color"].default_value)
+    return mat.name.encode() + np.array([tuple(color) for color in colors], dtype=np.float32).tobytes()
+
+def geometry_hash(obj):
+    """
+    blake2b of what the export reads from obj: vertices, faces, shading and split normals, uv layers, color attributes
+    (the material colors without them), vertex groups and the rest pose of its armature.
+    Everything but the vertex groups is read with foreach_get.
+    """
+    mesh = obj.data
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(foreach_bytes(mesh.vertices, "co", 3))
+    digest.update(foreach_bytes(mesh.loops, "vertex_index", 1, np.int32))
+    digest.update(foreach_bytes(mesh.polygons, "loop_start", 1, np.int32))
+    digest.update(foreach_bytes(mesh.polygons, "use_smooth", 1, bool))
+    digest.update(str(mesh.has_custom_normals).encode())
+    mesh.calc_normals_split() # the custom normals values and the auto smooth, like the export
+    digest.update(foreach_bytes(mesh.loops, "normal", 3))
+    for uv_layer in mesh.uv_layers:
+        digest.update(uv_layer.name.encode())
+        digest.update(foreach_bytes(uv_layer.data, "uv", 2))
+    for attribute in mesh.color_attributes:
+        digest.update(f"{attribute.name}{attribute.domain}".encode())
+        digest.update(foreach_bytes(attribute.data, "color", 4))
+    if not mesh.color_attributes.active_color:
+        digest.update(material_color_bytes(obj))
+    if obj.vertex_groups:
+        digest.update(",".join(group.name for group in obj.vertex_groups).encode())
+        digest.update(np.array([(v.index, g.group, g.weight) for v in mesh.vertices for g in v.groups], dtype=np.float64).tobytes())
+    armature = obj.find_armature()
+    if armature:
+        # the bindposes are written from the rest pose (cf MESH_OT_sanmodel_export.extract_bindposes), at_rest checks the pose
+        bones = armature.data.bones
+        digest.update(",".join(bone.name for bone in bones).encode())
+        digest.update(foreach_bytes(bones, "matrix_local", 16))
+        digest.update(foreach_bytes(bones, "length", 1))
+    return digest.hexdigest()
+
+def store_metadata(context, obj, smd, settings=None):
+    # what the export needs to know the object is unmodified since it was imported, cf MESH_OT_sanmodel_export.original_segments
+    # settings: the ones obj was created with, the current ones by default
+    obj["sanmodel_name"] = smd.name
+    obj["sanmodel_settings"] = import_settings(settings or context.scene.san_settings)
+    obj["sanmodel_hash"] = geometry_hash(obj)
+
+def archive_span(path, entry):
+    # (offset, length) of an entry of the archive path, None if it isn't in the archive
+    toc = archive_toc if path == archive_path else archive.read_toc(path)
+    return toc.get(entry) if toc else None
+
+def proxy_resolution(context, header):
+    # resolution of the proxy of a probed file, 0 if the full resolution is created
+    settings = context.scene.san_settings
+    if settings.use_proxy and header["amounts"][SAN_INDICES] // 3 >= settings.proxy_min_triangles:
+        return settings.proxy_resolution
+    return 0
+
+def read_header(path, entry=""):
+    # probe_sanmodel(), with the bounds of <name>_bounds.json when it's up to date: the vertices are not read
+    # entry: name of the model in the archive path
+    if entry:
+        span = archive_span(path, entry)
+        if not span:
+            console_notice(f"Error: {entry} not found in {path}")
+            return None
+        model_bounds = None
+        header = probe_sanmodel(path, True, *span)
+    else:
+        model_bounds = bounds.read_bounds(path)
+        header = probe_sanmodel(path, bounds=model_bounds is None)
+    if header:
+        header["entry"] = entry
+        header["sphere"] = None
+        header["bones"] = []
+        if model_bounds:
+            header["bounds"] = (model_bounds["aabb"]["min"], model_bounds["aabb"]["max"])
+            header["sphere"] = model_bounds["sphere"]
+            header["bones"] = model_bounds["bones"]
+    return header
+
+def read_sanmodel_file(path, entry=""):
+    # no bpy call here, it can run in a thread (cf async_ops)
+    # entry: name of the model in the archive path, only its bytes are read
+    # compressed files are decompressed while they're read, process_data gets the plain content
+    data = SanmodelData(path, entry)
+    span = archive_span(path, entry) if entry else (0, -1)
+    if not span:
+        console_notice(f"Error: {entry} not found in {path}")
+        return None
+    try:
+        content = read_sanmodel_bytes(path, *span)
+    except OSError as e:
+        console_notice(f"Error with the specified file: {e}")
+        return None
+    if content is None or not data.process_data(content):
+        return None
+    return data
+
+def source_amounts(path, entry=""):
+    # the 9 amounts of a file, from its model if it's loaded, else probed (the payloads are not read). None if it can't be read
+    smd = models.lookup((path, entry))
+    if smd is not None:
+        return [segment.size // seg_vars[i] for i, segment in enumerate(smd.segments)]
+    span = archive_span(path, entry) if entry else (0, None)
+    try:
+        data = probe_sanmodel(path, False, *span) if span else None
+    except OSError:
+        return None
+    return data["amounts"] if data else None
+
+def show_header(context, data):
+    # the probed file becomes the one displayed in the import panel, nothing is decoded yet
+    settings = context.scene.san_settings
+    global header
+    header = data
+    amounts = header["amounts"]
+    settings.valid_file = True
+    settings.archive_entry = header["entry"]
+    settings.model_name = header["name"] #export name
+    settings.name = header["name"]
+    settings.vertices = str(amounts[SAN_VERTICES])
+    settings.normals = str(amounts[SAN_NORMALS])
+    settings.tangents = str(amounts[SAN_TANGENTS])
+    settings.uv = str(amounts[SAN_UV1])
+    settings.uv2 = str(amounts[SAN_UV2])
+    settings.uv3 = str(amounts[SAN_UV3])
+    settings.colors = str(amounts[SAN_COLORS])
+    settings.triangles = str(amounts[SAN_INDICES] // 3)
+    settings.bindposes = str(amounts[SAN_BINDPOSES]) # 1 matrix per bone
+    settings.boneweights = str(amounts[SAN_UV2])
+    if context.area:
+        context.area.tag_redraw()
+    console_notice("header read, you can create a blender object with the button 'Create new object'")
+
+def load_model(path, entry=""):
+    # the parsed model from the session registry, the file is read only if it isn't loaded or changed
+    # no bpy call here, it can run in a thread (cf async_ops)
+    return models.get((path, entry), lambda: read_sanmodel_file(path, entry))
+
+def current_model(context):
+    # the decoded model of the file in the import panel, None if it isn't in the registry
+    settings = context.scene.san_settings
+    return models.lookup((settings.path, settings.archive_entry))
+
+def set_current_model(context, data):
+    # the model is used by "Create new object", the 2 last ones are compared by the diff
+    # the models themselves are kept: a regenerated file gets a new model, the diff compares it with the previous one
+    models.set_budget(context.scene.san_settings.registry_budget)
+    if any(model is data for model in recent):
+        recent.remove(data)
+    recent.append(data)
+    del recent[:-2]
+
+def last_models():
+    # (previous, last) created models, None if there aren't 2
+    if len(recent) < 2:
+        return None
+    return recent[0], recent[1]
+
 class OT_ImportFilebrowser(Operator, ImportHelper):
     bl_idname = "import.open_filebrowser"
     bl_label = "Open"
     filename_ext = ".sanmodel"
-    filter_glob: StringProperty( default='*.sanmodel', options={'HIDDEN'} )
+    filter_glob: StringProperty( default='*.sanmodel;*'+archive.ARCHIVE_EXT, options={'HIDDEN'} )
     
     def execute(self, context):
         """Do something with the selected file(s)."""
+        global archive_path
+        global archive_toc
         settings = context.scene.san_settings
         settings.valid_file = False
-        global smd
-        global smd_old
-        smd_old = smd
-        smd = SanmodelData()
+        settings.archive_entry = ""
+        archive_path = ""
+        archive_toc = {}
 
         if self.filepath == "":
             console_notice(f"'{settings.path}' not found")
@@ -246,28 +666,50 @@ class OT_ImportFilebrowser(Operator, ImportHelper):
 
         settings.path = self.filepath
         console_notice(f"opening '{settings.path}' ...")
-        with open(settings.path, 'rb') as fs:#todo:check for error
-            smd.content = (fs.read())
-        
-        settings.valid_file = smd.process_data(context)
-        if not settings.valid_file:
+        if archive.is_archive(settings.path):
+            # only the table of contents is read, the entries are listed in the import panel
+            toc = archive.read_toc(settings.path)
+            if toc is None:
+                self.report({'ERROR'}, f"Error with the specified archive (see System Console for more detail)")
+                return {"CANCELLED"}
+            archive_path, archive_toc = settings.path, toc
+            console_notice(f"archive: {len(toc)} models, choose one in the import panel")
+            return {"FINISHED"}
+        # only the amounts and the bounds are read, the full decode is done by "Create new object"
+        try:
+            data = read_header(settings.path)
+        except OSError as e:
+            console_notice(f"Error with the specified file: {e}")
+            data = None
+        if not data:
             self.report({'ERROR'}, f"Error with the specified file (see System Console for more detail)")
             return {"CANCELLED"}
-        
-        settings.model_name = smd.name #export name
-        settings.name = smd.name
-        settings.vertices = str(len(smd.segments[SAN_VERTICES]))
-        settings.normals = str(len(smd.segments[SAN_NORMALS]))
-        settings.tangents = str(len(smd.segments[SAN_TANGENTS]))
-        settings.uv = str(len(smd.segments[SAN_UV1]))
-        settings.uv2 = str(len(smd.segments[SAN_UV2]))
-        settings.uv3 = str(len(smd.segments[SAN_UV3]))
-        settings.colors = str(len(smd.segments[SAN_COLORS]))
-        settings.triangles = str(len(smd.segments[SAN_INDICES]))
-        settings.bindposes = str(len(smd.segments[SAN_BINDPOSES]))
-        settings.boneweights = str(len(smd.segments[SAN_UV2]))
-        context.area.tag_redraw()
-        console_notice("import done, you can create a blender object with the button 'Create new object'")
+        show_header(context, data)
+        return {"FINISHED"}
+
+class OT_ImportArchiveEntry(Operator):
+    """display this model of the archive, it's created with the button 'Create new object'"""
+    bl_idname = "import.archive_entry"
+    bl_label = "Open archive entry"
+
+    entry: StringProperty(
+        description="Name of the model in the archive of the import panel",
+        default="",
+        )
+
+    def execute(self, context):
+        settings = context.scene.san_settings
+        try:
+            data = read_header(archive_path, self.entry) if archive_path else None
+        except OSError as e:
+            console_notice(f"Error with the specified file: {e}")
+            data = None
+        if not data:
+            self.report({'ERROR'}, f"Error with the specified archive (see System Console for more detail)")
+            return {"CANCELLED"}
+        settings.path = archive_path
+        console_notice(f"opening '{self.entry}' of '{archive_path}' ...")
+        show_header(context, data)
         return {"FINISHED"}
 
 class OT_ExportFilebrowser(Operator, ExportHelper):
@@ -294,6 +736,7 @@ class OT_ExportFilebrowser(Operator, ExportHelper):
 blender_classes = [
     SanImportSettings,
     OT_ImportFilebrowser,
+    OT_ImportArchiveEntry,
     OT_ExportFilebrowser,
 ]
 
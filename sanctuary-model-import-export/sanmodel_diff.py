@@ -0,0 +1,295 @@
+import numpy as np
+from .sanmodel_format import (
+    seg_names,
+    seg_vars,
+    load_sanmodel,
+    SAN_VERTICES,
+    SAN_NORMALS,
+    SAN_TANGENTS,
+    SAN_UV1,
+    SAN_UV2,
+    SAN_UV3,
+    SAN_COLORS,
+    SAN_INDICES,
+    SAN_BINDPOSES,
+)
+from . import mesh_ops
+
+# Geometry diff of 2 models (no bpy).
+# Vertices are matched by hash even if their order changed (or with the closest vertex if they moved),
+# then every attribute is compared on the matched pairs, and triangles are compared independently
+# from their order and first vertex.
+
+DIFF_TOLERANCE = 1e-4
+ATTRIBUTES = [SAN_VERTICES, SAN_NORMALS, SAN_TANGENTS, SAN_UV1, SAN_UV2, SAN_UV3, SAN_COLORS]
+MATCH_KEYS = [
+    tuple(ATTRIBUTES),
+    (SAN_VERTICES, SAN_NORMALS, SAN_UV1), # split vertices share positions, use their normal and uv too
+    (SAN_VERTICES,),
+]
+
+def as_segments(segments):
+    # accepts flat arrays, arrays of rows (cf SanmodelData.segments) or lists of tuples
+    # numpy arrays are only reshaped (no copy), lists are converted
+    result = []
+    for i, s in enumerate(segments):
+        if not isinstance(s, np.ndarray):
+            s = np.array(s, dtype=np.int64 if i == SAN_INDICES else np.float64)
+        result.append(s.reshape(-1, 3 if i == SAN_INDICES else seg_vars[i]))
+    return result
+
+ROW_CHUNK = 1 << 14 # rows compared together, big temporary arrays are slow to allocate
+
+def close_rows(rows_a, index_a, rows_b, index_b, tolerance):
+    # rows_a[index_a] equals rows_b[index_b] up to tolerance (NaN never does)
+    close = np.empty(len(index_a), dtype=bool)
+    for i in range(0, len(index_a), ROW_CHUNK):
+        chunk = slice(i, i + ROW_CHUNK)
+        close[chunk] = np.all(np.abs(rows_a[index_a[chunk]] - rows_b[index_b[chunk]]) <= tolerance, axis=1)
+    return close
+
+def sorted_search(keys, queries):
+    # np.searchsorted, faster with sorted queries on big arrays
+    order = np.argsort(queries)
+    positions = np.empty(len(queries), dtype=np.int64)
+    positions[order] = np.searchsorted(keys, queries[order])
+    return np.minimum(positions, len(keys) - 1)
+
+FEW_LEFT = 64 # cf match_vertices
+
+def sorted_keys(rows):
+    # hash keys of rows, sorted, and their order (stable: the first of equal keys has the smallest index)
+    keys = mesh_ops.hash_rows(rows)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order
+
+def representatives(rows, tolerance, keys=None, order=None):
+    # for each vertex, the first vertex with the same values: equivalent vertices share their representative
+    if keys is None:
+        keys, order = sorted_keys(rows)
+    starts = np.concatenate(([True], keys[1:] != keys[:-1]))
+    first = order[np.maximum.accumulate(np.where(starts, np.arange(len(keys)), 0))]
+    # same key is not enough: hash collisions, NaN
+    same = close_rows(rows, first, rows, order, tolerance)
+    representative = np.empty(len(keys), dtype=np.int64)
+    representative[order] = np.where(same, first, order)
+    return representative
+
+def cell_lookup(rows_a, rows_b, todo, cell_size, shift):
+    # for the vertices todo of b, the first vertex of a in the same grid cell, or len(rows_a)
+    # the cells of a are looked up in the (usually few) cells left in b
+    cells, inverse = np.unique(mesh_ops.hash_rows(rows_b[todo], cell_size, shift), return_inverse=True)
+    keys = mesh_ops.hash_rows(rows_a, cell_size, shift)
+    positions = sorted_search(cells, keys)
+    inside = np.flatnonzero(cells[positions] == keys)
+    first = np.full(len(cells), len(rows_a), dtype=np.int64)
+    np.minimum.at(first, positions[inside], inside)
+    return first[inverse]
+
+def nearest_vertices(a, b, todo, rows_a=None, rows_b=None):
+    """
+    For the vertices todo of b, the vertex of a with the closest position (-1 only if a is empty or the position isn't finite).
+    Split vertices of a share their position, the one with the closest rows is used (if given).
+    """
+    index = mesh_ops.nearest_points(a[SAN_VERTICES], b[SAN_VERTICES][todo])[0]
+    found = np.flatnonzero(index >= 0)
+    if not len(found) or rows_a is None:
+        return index
+    # the vertices of a at the position of the nearest one
+    keys, order = sorted_keys(a[SAN_VERTICES])
+    query_keys = keys[sorted_search(keys, mesh_ops.hash_rows(a[SAN_VERTICES][index[found]]))]
+    low = np.searchsorted(keys, query_keys, "left")
+    counts = np.searchsorted(keys, query_keys, "right") - low
+    pair_query = np.repeat(np.arange(len(found)), counts)
+    pair_vertex = order[np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+    offsets = rows_a[pair_vertex] - rows_b[todo[found[pair_query]]]
+    distances = np.einsum("ij,ij->i", offsets, offsets)
+    minima, starts = mesh_ops.run_minima(distances, pair_query)
+    # NaN attributes: keep the nearest position
+    closest = np.where(distances == np.repeat(minima, np.diff(np.append(starts, len(distances)))), pair_vertex, len(rows_a))
+    closest = np.minimum.reduceat(closest, starts)
+    index[found] = np.where(closest < len(rows_a), closest, index[found])
+    return index
+
+def match_vertices(a, b, tolerance):
+    """
+    For each vertex of b, the index of the matching vertex of a, and the representative of each vertex of a.
+    Vertices with the same attributes (up to tolerance) match first, for each key of MATCH_KEYS: exactly,
+    then on 2 grids shifted by half a cell so that close values on both sides of a cell border still match.
+    The other vertices of b match the closest vertex of a, whatever the distance: the attribute errors show how far it is.
+    -1 only if a is empty or the position isn't finite.
+    Matches are representatives, so equivalent vertices of a always give the same index.
+    """
+    amount_a = len(a[SAN_VERTICES])
+    match = np.full(len(b[SAN_VERTICES]), -1, dtype=np.int64)
+    rows_a = mesh_ops.vertex_rows(a, MATCH_KEYS[0])
+    keys, order = sorted_keys(rows_a)
+    representative = representatives(rows_a, tolerance, keys, order)
+    if not amount_a:
+        return match, representative
+    comparable = None # the most complete rows of both, to choose between split vertices
+    for level, attributes in enumerate(MATCH_KEYS):
+        for cell_size, shift in [(None, 0.0), (2 * tolerance, 0.0), (2 * tolerance, 0.5)]:
+            todo = np.flatnonzero(match < 0)
+            # few vertices left: the nearest search costs less than hashing a again
+            if len(todo) * FEW_LEFT < amount_a:
+                break
+            if cell_size is None:
+                rows_b = mesh_ops.vertex_rows(b, attributes)
+                if level:
+                    rows_a = mesh_ops.vertex_rows(a, attributes)
+                if rows_a.shape[1] != rows_b.shape[1]:
+                    break
+                if level:
+                    keys, order = sorted_keys(rows_a)
+                if comparable is None:
+                    comparable = rows_a, rows_b
+                keys_b = mesh_ops.hash_rows(rows_b[todo])
+                positions = sorted_search(keys, keys_b)
+                candidates = np.where(keys[positions] == keys_b, order[positions], amount_a)
+            else:
+                candidates = cell_lookup(rows_a, rows_b, todo, cell_size, shift)
+            found = candidates < amount_a
+            todo = todo[found]
+            candidates = representative[candidates[found]]
+            # same key is not enough: hash collisions and cell size > tolerance
+            close = close_rows(rows_a, candidates, rows_b, todo, tolerance)
+            match[todo[close]] = candidates[close]
+    todo = np.flatnonzero(match < 0)
+    if len(todo):
+        nearest = nearest_vertices(a, b, todo, *(comparable or ()))
+        match[todo] = np.where(nearest >= 0, representative[nearest], -1)
+    return match, representative
+
+def canonical_triangles(triangles):
+    # rotate each triangle to start with its smallest index, the winding is kept
+    start = np.argmin(triangles, axis=1)
+    order = (start[:, None] + np.arange(3)) % 3
+    return np.take_along_axis(triangles, order, axis=1)
+
+def triangle_codes(triangles, amount):
+    # one int64 per triangle (< 2**62, a bit is left), amount**3 fits up to ~1.6M vertices
+    t = canonical_triangles(triangles).astype(np.int64)
+    if amount ** 3 < 2 ** 62:
+        return (t[:, 0] * amount + t[:, 1]) * amount + t[:, 2]
+    return np.unique(t, axis=0, return_inverse=True)[1] # slower, but no overflow
+
+def error_stats(errors):
+    if not len(errors):
+        return 0.0, 0.0
+    return float(errors.max()), float(np.sqrt(np.mean(errors ** 2)))
+
+def attribute_errors(a, b, match, identity):
+    # distance between the matched rows
+    if identity:
+        return np.linalg.norm(b.astype(np.float64) - a, axis=1)
+    valid = match >= 0
+    return np.linalg.norm(b[valid].astype(np.float64) - a[match[valid]], axis=1)
+
+def compare_triangles(a, b, match, representative):
+    # returns the amount of triangles of a missing in b, and of triangles of b not in a
+    # equivalent vertices of a are merged (match is a representative too), so that the triangles of b can use any of them
+    complete = np.all(match[b[SAN_INDICES]] >= 0, axis=1)
+    triangles = np.concatenate((representative[a[SAN_INDICES]], match[b[SAN_INDICES][complete]]))
+    # one sort for both, the lowest bit tells where the triangle comes from (a first)
+    codes = triangle_codes(triangles, max(len(a[SAN_VERTICES]), 1)) * 2
+    codes[len(a[SAN_INDICES]):] += 1
+    codes.sort()
+    in_b = codes & 1
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] >> 1 != codes[:-1] >> 1)))
+    count_b = np.add.reduceat(in_b, starts) if len(codes) else in_b
+    count_a = np.diff(np.append(starts, len(codes))) - count_b
+    missing = int(count_a[count_b == 0].sum())
+    extra = int(count_b[count_a == 0].sum()) + int(np.count_nonzero(~complete))
+    return missing, extra
+
+def diff_models(a, b, tolerance=DIFF_TOLERANCE, weld=False, ignore=()):
+    """
+    Compare 2 models segments (a is the reference).
+    weld: merge identical vertices first, to compare a split export with its source.
+    ignore: segments (SAN_*) still reported, but that don't make the models different (known issues).
+    Returns a report dict: counts, unmatched vertices, max/rms error per attribute, missing/extra triangles, "ok".
+    """
+    a = as_segments(a)
+    b = as_segments(b)
+    if weld:
+        a = mesh_ops.weld_segments(a)[0]
+        b = mesh_ops.weld_segments(b)[0]
+    amount_a = len(a[SAN_VERTICES])
+    amount_b = len(b[SAN_VERTICES])
+
+    # same order is the common case, and much cheaper: same index buffer, or same positions
+    same_indices = np.array_equal(a[SAN_INDICES], b[SAN_INDICES])
+    identity = amount_a == amount_b and (same_indices or np.all(np.abs(a[SAN_VERTICES] - b[SAN_VERTICES]) <= tolerance))
+    if identity:
+        match = np.arange(amount_b)
+        representative = None if same_indices else representatives(mesh_ops.vertex_rows(a, MATCH_KEYS[0]), tolerance)
+    else:
+        match, representative = match_vertices(a, b, tolerance)
+    report = {
+        "tolerance": tolerance,
+        "vertices": [amount_a, amount_b],
+        "unmatched": int(np.count_nonzero(match < 0)),
+        "attributes": {},
+    }
+
+    ok = report["unmatched"] == 0
+    for i in ATTRIBUTES:
+        entry = {"count": [len(a[i]), len(b[i])]}
+        if len(a[i]) == amount_a and len(b[i]) == amount_b and amount_a:
+            entry["max"], entry["rms"] = error_stats(attribute_errors(a[i], b[i], match, identity))
+            same = entry["max"] <= tolerance
+        else:
+            same = len(a[i]) == len(b[i])
+        if i in ignore:
+            entry["ignored"] = True
+        else:
+            ok = ok and same
+        report["attributes"][seg_names[i]] = entry
+
+    missing, extra = (0, 0) if identity and same_indices else compare_triangles(a, b, match, representative)
+    report["triangles"] = {
+        "count": [len(a[SAN_INDICES]), len(b[SAN_INDICES])],
+        "missing": missing,
+        "extra": extra,
+    }
+    ok = ok and missing == 0 and extra == 0
+
+    entry = {"count": [len(a[SAN_BINDPOSES]), len(b[SAN_BINDPOSES])]}
+    if len(a[SAN_BINDPOSES]) == len(b[SAN_BINDPOSES]):
+        entry["max"] = float(np.abs(a[SAN_BINDPOSES] - b[SAN_BINDPOSES]).max()) if len(a[SAN_BINDPOSES]) else 0.0
+        same = entry["max"] <= tolerance
+    else:
+        same = False
+    if SAN_BINDPOSES in ignore:
+        entry["ignored"] = True
+    else:
+        ok = ok and same
+    report["bindposes"] = entry
+    report["ok"] = bool(ok)
+    return report
+
+def diff_files(path_a, path_b, tolerance=DIFF_TOLERANCE, weld=False):
+    model_a = load_sanmodel(path_a)
+    model_b = load_sanmodel(path_b)
+    if model_a is None or model_b is None:
+        return None
+    return diff_models(model_a[1], model_b[1], tolerance, weld)
+
+def format_report(report):
+    lines = [
+        f"vertices: {report['vertices'][0]} -> {report['vertices'][1]}, unmatched: {report['unmatched']}",
+    ]
+    for name, entry in report["attributes"].items():
+        line = f"{name}: {entry['count'][0]} -> {entry['count'][1]}"
+        if "max" in entry:
+            line += f", max: {entry['max']:.3g}, rms: {entry['rms']:.3g}"
+        if entry.get("ignored"):
+            line += " (ignored)"
+        lines.append(line)
+    t = report["triangles"]
+    lines.append(f"triangles: {t['count'][0]} -> {t['count'][1]}, missing: {t['missing']}, extra: {t['extra']}")
+    bp = report["bindposes"]
+    lines.append(f"bindposes: {bp['count'][0]} -> {bp['count'][1]}" + (f", max: {bp['max']:.3g}" if "max" in bp else "") + (" (ignored)" if bp.get("ignored") else ""))
+    lines.append(("OK" if report["ok"] else "DIFFERENT") + f" (tolerance {report['tolerance']})")
+    return lines
@@ -1,9 +1,11 @@
 import os
+import json
 import numpy as np
 import bmesh
 import struct
 import pathlib
 import copy
+import time
 import bpy
 from bpy.types import (
     Operator,
@@ -12,15 +14,35 @@ from .utils import (
     console_notice,
     console_debug,
     console_debug_data,
-    vecSanmodelToBlender,
-    vecBlenderToSanmodel,
     getDeepSelectionMeshes,
 )
 from . import sanmodel as S
+from . import sanmodel_format as F
+from . import mesh_ops
+from . import atlas
+from . import bounds
+from . import manifest
+from . import archive
+from . import estimate
 
 
-def boneweights_to_uv(boneweights):
-    return np.array([[e, 0.0] for e in boneweights], dtype=S.SAN_ENDIAN+"f").flatten()
+# report of clean_segments for each exported object name, when something was removed or flagged
+cleaning_reports = {}
+
+# names of the objects exported from their original segments in the last extraction, cf original_segments
+original_exports = set()
+
+# estimates of the last dry run, one per file to write, cf MESH_OT_sanmodel_export.estimate_export
+estimates = []
+
+# data_type: (foreach field, components) of the attributes that can be exported in a channel
+ATTRIBUTE_FIELDS = {
+    "FLOAT": ("value", 1),
+    "FLOAT2": ("vector", 2),
+    "FLOAT_VECTOR": ("vector", 3),
+    "FLOAT_COLOR": ("color", 4),
+    "BYTE_COLOR": ("color", 4),
+}
 
 def getParents(obj):
     # objects can probably have only 1 "EMPTY" parent, check this
@@ -76,8 +98,6 @@ class MESH_OT_sanmodel_export(Operator):
 
         mesh.calc_normals()
         mesh.calc_normals_split()
-        if mesh.uv_layers.get(S.UV1_NAME):
-            mesh.calc_tangents(uvmap=S.UV1_NAME)
         mesh.calc_loop_triangles()
 
         # https://blender.stackexchange.com/questions/31738/how-to-fix-outdated-internal-index-table-in-an-addon
@@ -91,108 +111,163 @@ class MESH_OT_sanmodel_export(Operator):
         return mesh
 
     @staticmethod
-    def extract_vertices(mesh, swap_yz_axis):
-        if swap_yz_axis:
-            return np.array([vecBlenderToSanmodel(v.co) for v in mesh.vertices], dtype=S.SAN_ENDIAN+"f").flatten()
-        else:
-            return np.array([v.co[:] for v in mesh.vertices], dtype=S.SAN_ENDIAN+"f").flatten()
+    def loop_values(mesh, attribute, size, dtype=np.float32):
+        values = np.empty(len(mesh.loops) * size, dtype=dtype)
+        mesh.loops.foreach_get(attribute, values)
+        return values.reshape(-1, size)
 
     @staticmethod
-    def extract_normals(mesh, amount, swap_yz_axis):
-        normals = np.empty(amount*3, dtype=S.SAN_ENDIAN+"f")
-        for loop in mesh.loops:
-            idx = loop.vertex_index
-            if swap_yz_axis:
-                normals[idx*3:idx*3+3] = vecBlenderToSanmodel(loop.normal)
-            else:
-                normals[idx*3:idx*3+3] = loop.normal[:]
-        return normals
-
-    @staticmethod
-    def extract_tangents(mesh, amount, swap_yz_axis, mirror_uv_vertically):
-        tangents = np.empty(amount*4, dtype=S.SAN_ENDIAN+"f")
-        for loop in mesh.loops:
-            i = loop.vertex_index
-            tangents[i*4:i*4+3] = vecBlenderToSanmodel(loop.tangent) if swap_yz_axis else loop.tangent[:]
-            tangents[i*4+3] = loop.bitangent_sign if (mirror_uv_vertically==swap_yz_axis) else -loop.bitangent_sign
-        # blender's bitangent_sign with TestCube.sanmodel (file sign is -)
-        # | swap yz | mirror uv | sign |
-        # |   Y     |     Y     |   -  |
-        # |   N     |     N     |   -  |
-        # |   Y     |     N     |   +  |
-        # |   N     |     Y     |   +  |
-        # this may be caused by the use of cross() when blender is computing tangents
-        return tangents
-
-    @staticmethod
-    def extract_uv(mesh, amount, name, mirror_uv_vertically):
-        uv_layer = mesh.uv_layers.get(name)
-        if not uv_layer:
-            #console_notice(f"uv_layer '{name}' not found")
-            return []
-        uvmap = np.empty(amount*2, dtype=S.SAN_ENDIAN+"f")
-        i = 0
-        for poly in mesh.polygons:
-            for idx in poly.vertices:
-                uv = uv_layer.data[i].uv[:]
-                if mirror_uv_vertically:
-                    uv = [uv[0], 1-uv[1]]
-                uvmap[idx*2:idx*2+2] = uv
-                i += 1
-        return uvmap
-
-    @staticmethod
-    def extract_colors(obj, bmesh, amount):
+    def per_vertex(mesh, amount, loop_values, vertex_index=None):
+        # the value of the last loop of each vertex (the mesh is split, all the loops of a vertex are the same)
+        if vertex_index is None:
+            vertex_index = MESH_OT_sanmodel_export.loop_values(mesh, "vertex_index", 1, np.int32).ravel()
+        values = np.zeros((amount, loop_values.shape[1]), dtype=loop_values.dtype)
+        values[vertex_index] = loop_values
+        return values
+
+    @staticmethod
+    def extract_vertices(mesh, to_sanmodel):
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        return mesh_ops.transform_points(to_sanmodel, co).astype(S.SAN_ENDIAN+"f").flatten()
+
+    @staticmethod
+    def extract_normals(mesh, amount, to_sanmodel):
+        normals = MESH_OT_sanmodel_export.loop_values(mesh, "normal", 3)
+        normals = MESH_OT_sanmodel_export.per_vertex(mesh, amount, normals)
+        return mesh_ops.transform_normals(to_sanmodel, normals).astype(S.SAN_ENDIAN+"f").flatten()
+
+    @staticmethod
+    def extract_tangents(vertices, normals, uv1, indices):
+        # computed from the exported arrays, in sanmodel coordinates with the uv as written: no handedness to fix
+        # without uv1 the tangents are any direction perpendicular to the normals, the file still has one per vertex
+        if not len(uv1):
+            uv1 = np.zeros(len(vertices) // 3 * 2, dtype=np.float32)
+        return mesh_ops.compute_tangents(vertices, normals, uv1, indices).astype(S.SAN_ENDIAN+"f").flatten()
+
+    @staticmethod
+    def uv_layer(mesh, name):
+        # by name, or by index ("0" is the first layer)
+        # the UV2 layer of the imported props isn't counted, UV1 and UV3 keep the indices of the channels table
+        if name.isdigit():
+            layers = [layer for layer in mesh.uv_layers if layer.name != S.UV2_NAME]
+            index = int(name)
+            return layers[index] if index < len(layers) else None
+        return mesh.uv_layers.get(name)
+
+    @staticmethod
+    def attribute_values(mesh, attribute, amount, vertex_index):
+        # values of a point or face corner attribute, one row per vertex
+        field, size = ATTRIBUTE_FIELDS.get(attribute.data_type, (None, 0))
+        if not field or attribute.domain not in ("POINT", "CORNER"):
+            console_notice(f"attribute {attribute.name}: {attribute.data_type} on {attribute.domain} can't be exported")
+            return None
+        values = np.empty(len(attribute.data) * size, dtype=np.float32)
+        attribute.data.foreach_get(field, values)
+        values = values.reshape(-1, size)
+        if attribute.domain == "CORNER":
+            values = MESH_OT_sanmodel_export.per_vertex(mesh, amount, values, vertex_index)
+        return values
+
+    @staticmethod
+    def vertex_groups(mesh):
+        # (vertex, group, weight) of every membership, group memberships can't be read with foreach_get
+        rows = np.array([(v.index, g.group, g.weight) for v in mesh.vertices for g in v.groups], dtype=np.float64).reshape(-1, 3)
+        return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2]
+
+    @staticmethod
+    def bone_ids(obj, armature, groups, amount):
+        # bone of the strongest vertex group of each vertex (boneweights, 0 without group), groups are matched to bones by name
+        bones = {bone.name: i for i, bone in enumerate(armature.data.bones)}
+        group_bone = np.array([bones.get(group.name, -1) for group in obj.vertex_groups] + [-1], dtype=np.int64)
+        strongest = mesh_ops.strongest_groups(*groups, amount)
+        ids = group_bone[strongest] # -1 (no group) is the last value
+        return np.maximum(ids, 0).reshape(-1, 1)
+
+    @staticmethod
+    def extract_colors(obj, mesh, amount, vertex_index):
         # there should only be 1 mat per mesh
         # https://blender.stackexchange.com/questions/122251/how-to-get-diffuse-color-of-a-material-via-python
         
         # if not len(obj.material_slots):
         if not obj.active_material:
             console_notice(f"no material found, ignoring colors")
-            return []
+            return None
         
-        colors = np.empty(amount*4, dtype=S.SAN_ENDIAN+"f")
         mat = obj.active_material
         if not mat.use_nodes:
             console_notice(f"BSDF_PRINCIPLED is not used for the colors, getting 1 color for all vertices")
-            return np.array([mat.diffuse_color for i in range(0, amount)], dtype=S.SAN_ENDIAN+"f").flatten()
+            return np.tile(np.array(mat.diffuse_color, dtype=np.float32), (amount, 1))
         bsdf = mat.node_tree.nodes.get("Principled BSDF") # "Principled BSDF" is the name, "BSDF_PRINCIPLED" is the type
         if not bsdf:
             console_notice(f"BSDF_PRINCIPLED is not used for the colors, ignoring colors")
-            return []
-        color_layer = bmesh.vertex_colors.active
+            return None
+        color_layer = mesh.color_attributes.active_color
         if not color_layer:
             console_notice(f"vertex color is not used for the colors, getting 1 color from BSDF_PRINCIPLED for all vertices")
-            colors = np.array([bsdf.inputs.get("Base Color").default_value[0:4] for i in range(0, amount)], dtype=S.SAN_ENDIAN+"f").flatten()
             # if settings.extract_with_global_alpha: # object alpha is different from vertices alpha
                 # colors[3::4] = [bsdf.inputs.get("Alpha").default_value for i in range(0, amount)]
-            return colors
-        
-        i = 0
-        for poly in bmesh.polygons:
-            for idx in poly.vertices:
-                colors[idx*4:idx*4+4] = color_layer.data[i].color[:]
-                i += 1
-        return colors.flatten()
+            return np.tile(np.array(bsdf.inputs.get("Base Color").default_value[0:4], dtype=np.float32), (amount, 1))
+        return MESH_OT_sanmodel_export.attribute_values(mesh, color_layer, amount, vertex_index)
 
     @staticmethod
-    def extract_indices(mesh, swap_yz_axis):
-        if swap_yz_axis:
-            return np.array([vecBlenderToSanmodel(t.vertices) for t in mesh.loop_triangles], dtype=S.SAN_ENDIAN+"i").flatten()
-        else:
-            return np.array([t.vertices[:] for t in mesh.loop_triangles], dtype=S.SAN_ENDIAN+"i").flatten()
+    def extract_channels(context, obj, armature, mesh, amount):
+        """
+        The UV1, UV2, UV3 and colors segments, from the layers of the channels table (cf S.CHANNELS).
+        The face corner layers are read with foreach_get and written per vertex with the same corner -> vertex map.
+        """
+        settings = context.scene.san_settings
+        export = MESH_OT_sanmodel_export
+        vertex_index = export.loop_values(mesh, "vertex_index", 1, np.int32).ravel()
+        groups = None
+        channels = {}
+        for channel, segment in S.CHANNELS:
+            source = getattr(settings, channel + "_source")
+            layer = getattr(settings, channel + "_layer")
+            values = None
+            uv_layer = None
+            if source == "UV":
+                uv_layer = export.uv_layer(mesh, layer)
+            elif source in ("COLOR", "ATTRIBUTE"):
+                if layer:
+                    attribute = mesh.attributes.get(layer)
+                else:
+                    attribute = mesh.color_attributes.active_color if source == "COLOR" else None
+                if attribute:
+                    values = export.attribute_values(mesh, attribute, amount, vertex_index)
+            elif source == "GROUP":
+                group = obj.vertex_groups.get(layer)
+                if group:
+                    groups = groups or export.vertex_groups(mesh)
+                    vertex_ids, group_ids, weights = groups
+                    values = np.zeros((amount, 1), dtype=np.float32)
+                    member = group_ids == group.index
+                    values[vertex_ids[member], 0] = weights[member]
+            elif source == "BONES":
+                if armature:
+                    groups = groups or export.vertex_groups(mesh)
+                    values = export.bone_ids(obj, armature, groups, amount)
+                elif segment == S.SAN_UV2:
+                    # a prop: its UV2 isn't bone ids, it was imported in its own layer (cf apply_uv2)
+                    uv_layer = mesh.uv_layers.get(S.UV2_NAME)
+            elif source == "MATERIAL":
+                values = export.extract_colors(obj, mesh, amount, vertex_index)
+            if uv_layer:
+                values = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+                uv_layer.data.foreach_get("uv", values)
+                values = export.per_vertex(mesh, amount, values.reshape(-1, 2), vertex_index)
+                if settings.mirror_uv_vertically:
+                    values[:, 1] = 1 - values[:, 1]
+            if source != "NONE" and values is None:
+                console_notice(f"{obj.name}: {channel}: {source.lower()} '{layer}' not found, the segment is empty")
+            channels[segment] = [] if values is None else mesh_ops.fit_channel(values, S.seg_vars[segment], segment == S.SAN_COLORS).astype(S.SAN_ENDIAN+"f").flatten()
+        return channels
 
     @staticmethod
-    def extract_boneWeights(armature, obj):
-        if not armature:
-            return []
-        boneweights = []
-        for v in obj.data.vertices:
-            group = sorted([(g.group, obj.vertex_groups[g.group].weight(v.index)) for g in v.groups], key=lambda tup: tup[1], reverse=True)[0]
-            boneweights.append(group[0]) if len(boneweights) > 0 else boneweights.append(0)
-        console_debug(f"boneweights : {len(boneweights)}")
-        console_debug_data(boneweights)
-        return np.array(boneweights, dtype=S.SAN_ENDIAN+"i").flatten()
+    def extract_indices(mesh, to_sanmodel):
+        triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", triangles)
+        return mesh_ops.transform_triangles(to_sanmodel, triangles).astype(S.SAN_ENDIAN+"i").flatten()
 
     @staticmethod
     def extract_bindposes(armature):
@@ -212,113 +287,509 @@ class MESH_OT_sanmodel_export(Operator):
         return matrix
 
     @staticmethod
-    def export_object(context, obj, path):
-        settings = context.scene.san_settings
-        export_path = pathlib.Path(path)
-        console_notice("export as:")
-        console_notice(export_path.name)
-        console_notice(export_path.absolute())
-
+    def resolve_object(obj):
+        # returns the mesh object and its armature (if any)
         if obj.type == 'ARMATURE':
             bl_armature = obj
             bl_obj = bl_armature.children[0]
         else:
             bl_obj = obj
             bl_armature = bl_obj.find_armature()
-        
-        data = bytearray(export_path.stem + "\0", "utf-8") # [name\0]
+        return bl_obj, bl_armature
+
+    @staticmethod
+    def at_rest(armature):
+        # the armature doesn't deform the mesh: rest position, or no bone moved
+        return (armature is None or armature.data.pose_position == "REST"
+            or all(np.allclose(np.array(bone.matrix_basis), np.eye(4)) for bone in armature.pose.bones))
+
+    @staticmethod
+    def unmodified(context, obj, armature):
+        # obj is unmodified since its import (same geometry hash, import settings and file) and the channels table is the default one
+        settings = context.scene.san_settings
+        path = obj.get("sanmodel_path")
+        if not (settings.reuse_unmodified and path and obj.get("sanmodel_hash")) or obj.get("sanmodel_proxy"):
+            return False
+        if obj.get("sanmodel_settings") != S.import_settings(settings) or not S.default_channels(settings):
+            return False
+        if obj.data.shape_keys or any(modifier.type != "ARMATURE" for modifier in obj.modifiers) or not MESH_OT_sanmodel_export.at_rest(armature):
+            return False
+        return S.source_signature(path) == obj.get("sanmodel_signature") and S.geometry_hash(obj) == obj["sanmodel_hash"]
+
+    @staticmethod
+    def original_segments(context, obj, armature):
+        """
+        The segments of the file obj was imported from, when obj is unmodified (cf unmodified):
+        the export writes them again instead of evaluating and splitting the mesh.
+        None otherwise (cf S.store_metadata).
+        """
+        if not MESH_OT_sanmodel_export.unmodified(context, obj, armature):
+            return None
+        path = obj["sanmodel_path"]
+        smd = S.load_model(path, obj.get("sanmodel_entry", ""))
+        if smd is None:
+            return None
+        console_notice(f"{obj.name}: unmodified since its import, original segments of {os.path.basename(path)}")
+        return [segment.ravel() for segment in smd.segments]
+
+    @staticmethod
+    def extract_segments(context, obj):
+        settings = context.scene.san_settings
+        bl_obj, bl_armature = MESH_OT_sanmodel_export.resolve_object(obj)
+        segments = MESH_OT_sanmodel_export.original_segments(context, bl_obj, bl_armature)
+        original_exports.discard(obj.name)
+        if segments is None:
+            segments = MESH_OT_sanmodel_export.evaluate_segments(context, bl_obj, bl_armature)
+        else:
+            original_exports.add(obj.name)
+        if settings.clean_on_export:
+            segments, remap, report = mesh_ops.clean_segments(segments)
+            cleaning = mesh_ops.format_cleaning(report)
+            cleaning_reports.pop(obj.name, None)
+            if cleaning:
+                cleaning_reports[obj.name] = report
+                console_notice(f"{obj.name}: {cleaning}")
+        return segments
+
+    @staticmethod
+    def evaluate_segments(context, bl_obj, bl_armature):
+        # segments of the evaluated mesh (modifiers applied), split and triangulated
+        settings = context.scene.san_settings
         bl_mesh = MESH_OT_sanmodel_export.prepare_mesh(context, bl_obj)
         
         len_vertices = len(bl_mesh.vertices)
         console_debug(f"vertices: {len_vertices}")
 
-        console_debug(f"# grabbing uv_layers names (same order as in the UI)")
-        uv_names = ["0", "1"] # only 2 UV layers max, because one UV segment of sanmodel is reserved for boneweights 
-        for i, l in enumerate(bl_mesh.uv_layers):
-            uv_names[i] = l.name
-            console_debug(f"found UV layer: {l.name}")
-
-        segments = [
-            MESH_OT_sanmodel_export.extract_vertices(bl_mesh, settings.swap_yz_axis),
-            MESH_OT_sanmodel_export.extract_normals(bl_mesh, len_vertices, settings.swap_yz_axis),
-            MESH_OT_sanmodel_export.extract_tangents(bl_mesh, len_vertices, settings.swap_yz_axis, settings.mirror_uv_vertically),
-            MESH_OT_sanmodel_export.extract_uv(bl_mesh, len_vertices, uv_names[0], settings.mirror_uv_vertically),
-            # There is still a bug with boneweights when importing-exporting-reimporting-reexporting a sanmodel 
-            # (importing and reexporting blender generated sanmodels) 
-            # boneweights_to_uv(MESH_OT_sanmodel_export.extract_boneWeights(bl_armature, bl_obj)), # UV2 segment for boneweights
-            [],
-            MESH_OT_sanmodel_export.extract_uv(bl_mesh, len_vertices, uv_names[1], settings.mirror_uv_vertically),
-            MESH_OT_sanmodel_export.extract_colors(bl_obj, bl_mesh, len_vertices),
-            MESH_OT_sanmodel_export.extract_indices(bl_mesh, settings.swap_yz_axis),
+        to_sanmodel = np.linalg.inv(S.coordinate_basis(settings))
+        # UV1, UV2 (boneweights by default), UV3 and colors, cf the channels table of the export panel
+        channels = MESH_OT_sanmodel_export.extract_channels(context, bl_obj, bl_armature, bl_mesh, len_vertices)
+        vertices = MESH_OT_sanmodel_export.extract_vertices(bl_mesh, to_sanmodel)
+        normals = MESH_OT_sanmodel_export.extract_normals(bl_mesh, len_vertices, to_sanmodel)
+        indices = MESH_OT_sanmodel_export.extract_indices(bl_mesh, to_sanmodel)
+        return [
+            vertices,
+            normals,
+            MESH_OT_sanmodel_export.extract_tangents(vertices, normals, channels[S.SAN_UV1], indices),
+            channels[S.SAN_UV1],
+            channels[S.SAN_UV2],
+            channels[S.SAN_UV3],
+            channels[S.SAN_COLORS],
+            indices,
             MESH_OT_sanmodel_export.extract_bindposes(bl_armature),
         ]
-        console_debug(f"tmp: boneweights to uv len : {len(segments[S.SAN_UV2])}")
-        # console_debug(segments[S.SAN_UV2])
-
-        for i, s in enumerate(segments):
-            array_size = len(s)
-            export_n = array_size // S.seg_vars[i]
-
-            console_debug(f"[Write Process] segment[{i}]: {S.seg_names[i]}: {export_n}, {array_size} values ({array_size*4} bytes)")
-            if (array_size != export_n * S.seg_vars[i]):
-                console_notice(f"Error: array size is not a multiple of {S.seg_vars[i]}")
-                return {"CANCELLED"}
-
-            b_n = struct.pack(S.SAN_ENDIAN+"i", export_n) #bytearray([export_n])
-            b_array = bytearray(s)#todo: force endian
-            
-            b_array_len = len(b_array)
-            if (b_array_len != array_size*4):
-                console_notice(f"Error with the byte data: byte array size: {b_array_len}, ie {b_array_len/4} values")
-                console_notice(f"[Write Process] segment[{i}]: {S.seg_names[i]}: {export_n}, {array_size} values ({array_size*4} bytes)")
-                return {"CANCELLED"}
-            
-            data[len(data):] = b_n
-            data[len(data):] = b_array
-            console_debug(f"full data len: {len(data)}")
-        
-        console_debug("export full data:")
-        console_debug_data(data)
-        f = open(export_path.absolute(), 'wb')
-        f.write(data)
-        f.close()
+
+    @staticmethod
+    def export_options(settings):
+        # settings used by the write functions, read in the main thread (the writes may run in a thread)
+        return {
+            "spatial_sort": settings.spatial_sort,
+            "chunk_triangles": settings.chunk_triangles,
+            "chunk_bounds": settings.spatial_sort and settings.chunk_bounds,
+            "bounds": settings.write_bounds,
+            "vertex_budget": settings.vertex_budget,
+            "triangle_budget": settings.triangle_budget,
+            "compression": None if settings.compression == "NONE" else settings.compression.lower(),
+            "pack": settings.pack_on_export, # for the estimate, the archive is written at the end of the run (cf pack_exports)
+        }
+
+    @staticmethod
+    def write_chunks(path, chunks):
+        # sidecar of a spatially sorted export: triangles range and bounding sphere of each chunk, in sanmodel coordinates
+        export_path = pathlib.Path(path)
+        content = {
+            "model": export_path.name,
+            "chunks": [
+                {"first_triangle": int(c[0]), "triangles": int(c[1]), "center": c[2:5].tolist(), "radius": float(c[5])}
+                for c in chunks
+            ],
+        }
+        with open(export_path.with_name(export_path.stem + "_chunks.json").absolute(), "w") as f:
+            json.dump(content, f, indent=4)
+
+    @staticmethod
+    def write_segments(path, segments, options=None):
+        # no bpy call here, it can run in a thread (cf async_ops)
+        options = options or {}
+        start = time.perf_counter()
+        export_path = pathlib.Path(path)
+        console_notice("export as:")
+        console_notice(export_path.name)
+        console_notice(export_path.absolute())
+        chunks = None
+        if options.get("spatial_sort") and not mesh_ops.indices_in_range(segments):
+            console_notice("spatial sort skipped: indices out of range (enable Clean on export to remove their triangles)")
+        elif options.get("spatial_sort"):
+            sort_start = time.perf_counter()
+            segments, chunks = mesh_ops.spatial_sort(segments, options["chunk_triangles"])
+            console_notice(f"spatial sort: {len(chunks)} chunks in {(time.perf_counter() - sort_start)*1000:.1f} ms")
+        if not F.write_sanmodel(export_path.absolute(), export_path.stem, segments, options.get("compression")):
+            return {"CANCELLED"}
+        if options.get("chunk_bounds") and chunks is not None:
+            MESH_OT_sanmodel_export.write_chunks(path, chunks)
+        if options.get("bounds"):
+            # original segments keep the bindposes of the file, the extracted ones are in the exporter layout
+            model_bounds = bounds.model_bounds(segments, exported_bindposes=not options.get("original"))
+            if model_bounds:
+                bounds.write_bounds(str(export_path.absolute()), model_bounds)
+        if "manifest" in options:
+            # list of the export run, cf manifest.write_manifest
+            entry = manifest.manifest_entry(export_path.absolute(), segments, options.get("extract_ms", 0.0), (time.perf_counter() - start) * 1000,
+                options["vertex_budget"], options["triangle_budget"])
+            if options.get("original"):
+                entry["original"] = True # nothing was extracted, cf estimate.extract_cost
+            options["manifest"].append(entry)
+            if entry["over_budget"]:
+                console_notice(f"{export_path.name}: over the {' and '.join(entry['over_budget'])} budget ({entry['vertices']} vertices, {entry['triangles']} triangles)")
         console_notice("export done")
         return {"FINISHED"}
 
+    @staticmethod
+    def export_object(context, obj, path, entries=None):
+        # entries: list of the export run manifest
+        start = time.perf_counter()
+        segments = MESH_OT_sanmodel_export.extract_segments(context, obj)
+        options = MESH_OT_sanmodel_export.export_options(context.scene.san_settings)
+        options["original"] = obj.name in original_exports
+        if entries is not None:
+            options.update(manifest=entries, extract_ms=(time.perf_counter() - start) * 1000)
+        return MESH_OT_sanmodel_export.write_segments(path, segments, options)
+
+    @staticmethod
+    def relative_matrix(root, obj, to_sanmodel):
+        # world transform of obj relative to root, in sanmodel coordinates
+        matrix = np.array(root.matrix_world.inverted() @ obj.matrix_world)
+        return mesh_ops.transform_matrix(to_sanmodel, matrix)
+
+    @staticmethod
+    def material_image(obj):
+        # image of the "Image Texture" node linked to the Base Color, or the first one found
+        mat = obj.active_material
+        if not mat or not mat.use_nodes:
+            return None
+        bsdf = mat.node_tree.nodes.get("Principled BSDF")
+        if bsdf and bsdf.inputs["Base Color"].is_linked:
+            node = bsdf.inputs["Base Color"].links[0].from_node
+            if node.type == "TEX_IMAGE" and node.image:
+                return node.image
+        for node in mat.node_tree.nodes:
+            if node.type == "TEX_IMAGE" and node.image:
+                return node.image
+        return None
+
+    @staticmethod
+    def image_pixels(image):
+        # rgba float array (height, width, 4), bottom row first
+        w, h = image.size
+        channels = image.channels
+        pixels = np.empty(w * h * channels, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        pixels = pixels.reshape(h, w, channels)
+        if channels == 4:
+            return pixels
+        rgba = np.ones((h, w, 4), dtype=np.float32)
+        rgba[..., :3] = pixels[..., :3] if channels >= 3 else pixels[..., :1]
+        return rgba
+
+    @staticmethod
+    def bake_atlas(objects, parts, path, mirror_uv_vertically):
+        # packs the textures of the objects in one image, and moves their UV1 in the atlas regions
+        export_path = pathlib.Path(path)
+        images = []
+        used = [] # index in images for each part
+        for obj, part in zip(objects, parts):
+            bl_obj, bl_armature = MESH_OT_sanmodel_export.resolve_object(obj)
+            image = MESH_OT_sanmodel_export.material_image(bl_obj)
+            if not image or not image.size[0]:
+                console_notice(f"{obj.name}: no image texture found, uv are not remapped")
+                used.append(None)
+                continue
+            if atlas.tiled_uv(part[S.SAN_UV1]):
+                console_notice(f"{obj.name}: uv outside [0,1] (tiled texture), kept out of the atlas")
+                used.append(None)
+                continue
+            if image not in images:
+                images.append(image)
+            used.append(images.index(image))
+        if not images:
+            return
+
+        sizes = [tuple(image.size) for image in images]
+        positions, atlas_size = atlas.pack_shelves(sizes)
+        for part, i in zip(parts, used):
+            if i is None or not len(part[S.SAN_UV1]):
+                continue
+            rect = (*positions[i], *sizes[i])
+            part[S.SAN_UV1] = atlas.remap_uv(part[S.SAN_UV1], rect, atlas_size, mirror_uv_vertically).astype(S.SAN_ENDIAN+"f").flatten()
+
+        pixels = atlas.compose_atlas([MESH_OT_sanmodel_export.image_pixels(image) for image in images], positions, atlas_size)
+        atlas_name = export_path.stem + "_atlas.png"
+        bl_image = bpy.data.images.new(atlas_name, atlas_size[0], atlas_size[1], alpha=True)
+        bl_image.pixels.foreach_set(pixels.ravel())
+        bl_image.filepath_raw = str(export_path.with_name(atlas_name).absolute())
+        bl_image.file_format = "PNG"
+        bl_image.save()
+        bpy.data.images.remove(bl_image)
+
+        objects_regions = {obj.name: images[i].name for obj, i in zip(objects, used) if i is not None}
+        mapping = atlas.atlas_mapping(atlas_name, [image.name for image in images], sizes, positions, atlas_size, objects_regions)
+        atlas.write_mapping(export_path.with_name(export_path.stem + "_atlas.json").absolute(), mapping)
+        console_notice(f"atlas: {len(images)} textures packed in {atlas_size[0]}x{atlas_size[1]}")
+
+    @staticmethod
+    def extract_part(context, root, obj):
+        # segments of obj and its transform relative to root, for merge_segments
+        settings = context.scene.san_settings
+        bl_obj, bl_armature = MESH_OT_sanmodel_export.resolve_object(obj)
+        if bl_armature:
+            console_notice(f"{obj.name}: bindposes are ignored when merging")
+        segments = MESH_OT_sanmodel_export.extract_segments(context, obj)
+        return segments, MESH_OT_sanmodel_export.relative_matrix(root, bl_obj, np.linalg.inv(S.coordinate_basis(settings)))
+
+    @staticmethod
+    def write_merged(path, parts, matrices, options=None):
+        # no bpy call here, it can run in a thread (cf async_ops)
+        start = time.perf_counter()
+        segments = mesh_ops.merge_segments(parts, matrices)
+        console_notice(f"merged {len(parts)} objects in {(time.perf_counter() - start)*1000:.1f} ms")
+        return MESH_OT_sanmodel_export.write_segments(path, segments, options)
+
+    @staticmethod
+    def export_merged(context, root, objects, path, entries=None):
+        # all objects are baked in a single vertex/index buffer, relative to root
+        settings = context.scene.san_settings
+        start = time.perf_counter()
+        parts = []
+        matrices = []
+        for obj in objects:
+            segments, matrix = MESH_OT_sanmodel_export.extract_part(context, root, obj)
+            parts.append(segments)
+            matrices.append(matrix)
+        if not parts:
+            return {"CANCELLED"}
+        if settings.use_atlas:
+            MESH_OT_sanmodel_export.bake_atlas(objects, parts, path, settings.mirror_uv_vertically)
+        options = MESH_OT_sanmodel_export.export_options(settings)
+        if entries is not None:
+            options.update(manifest=entries, extract_ms=(time.perf_counter() - start) * 1000)
+        return MESH_OT_sanmodel_export.write_merged(path, parts, matrices, options)
+
+    @staticmethod
+    def export_path(export_folder, obj, reserved=(), create=True):
+        # the file will be created in folders with parents names (create: make the folders)
+        parents = getParents(obj)
+        console_debug(f"{len(parents)} parents")
+        parents_folders = ""
+        for p in parents:
+            parents_folders = parents_folders + p.name + "\\"
+        if create:
+            os.makedirs(f"{export_folder.absolute()}\\{parents_folders}", exist_ok=True)
+
+        # checks if the file already exists, if needed, adds a suffix in windows style. ex: "filename (1).sanmodel"
+        suffix = ""
+        inc = 0
+        while (pathlib.Path(f"{export_folder}\\{parents_folders}{obj.name}{suffix}.sanmodel").is_file()
+                or f"{export_folder}\\{parents_folders}{obj.name}{suffix}.sanmodel" in reserved):
+            inc = inc + 1
+            suffix = f" ({inc})"
+        return f"{export_folder}\\{parents_folders}{obj.name}{suffix}.sanmodel"
+
     # https://blender.stackexchange.com/questions/57327/get-hard-shading-normals-in-bpy
+    @staticmethod
+    def has_ancestor(obj, ancestors):
+        parent = obj.parent
+        while parent:
+            if parent in ancestors:
+                return True
+            parent = parent.parent
+        return False
+
+    @staticmethod
+    def plan_export(context, export_folder, create=True, skipped=None):
+        """
+        One job per file to write: {"root", "objects", "path", "merge"}
+        merge: the objects are merged in one file, relative to root (cf settings.merge_on_export)
+        create: make the folders of the files (not for a dry run)
+        skipped: list receiving the proxies of the selection, they are not exported (only their simplified mesh is in Blender)
+        """
+        settings = context.scene.san_settings
+        if settings.merge_on_export:
+            # each selected EMPTY is merged with its hierarchy in a file named after it,
+            # the other selected objects are merged together in a file named after the active object
+            roots = [obj for obj in context.selected_objects if obj.type == "EMPTY"]
+            # an object under a selected EMPTY is already in its file
+            loose = getDeepSelectionMeshes([obj for obj in context.selected_objects
+                if obj.type != "EMPTY" and not MESH_OT_sanmodel_export.has_ancestor(obj, roots)])
+            groups = [(root, getDeepSelectionMeshes(root.children)) for root in roots]
+            if loose:
+                active = context.active_object
+                groups.append((active if active in loose else loose[0], loose))
+        else:
+            groups = [(obj, [obj]) for obj in getDeepSelectionMeshes(context.selected_objects)]
+
+        jobs = []
+        reserved = set() # paths of the previous jobs, their files are not written yet
+        skipped = [] if skipped is None else skipped
+        for root, objects in groups:
+            skipped.extend(obj for obj in objects if obj.get("sanmodel_proxy"))
+            objects = [obj for obj in objects if not obj.get("sanmodel_proxy")]
+            if not objects:
+                continue
+            path = MESH_OT_sanmodel_export.export_path(export_folder, root, reserved, create)
+            reserved.add(path)
+            jobs.append({"root": root, "objects": objects, "path": path, "merge": settings.merge_on_export})
+        if skipped:
+            console_notice(f"proxies not exported (load their full resolution first): {', '.join(obj.name for obj in skipped)}")
+        return jobs
+
+    @staticmethod
+    def skipped_report(skipped):
+        # end report part of the proxies left out by plan_export
+        return f", {len(skipped)} proxies skipped (load their full resolution first)" if skipped else ""
+
+    @staticmethod
+    def written_channels(settings, obj, armature, mesh):
+        # the UV1, UV2, UV3 and colors segments the channels table will fill, cf extract_channels
+        written = []
+        for channel, segment in S.CHANNELS:
+            source = getattr(settings, channel + "_source")
+            layer = getattr(settings, channel + "_layer")
+            if source == "UV":
+                found = MESH_OT_sanmodel_export.uv_layer(mesh, layer) is not None
+            elif source == "COLOR":
+                found = (mesh.attributes.get(layer) if layer else mesh.color_attributes.active_color) is not None
+            elif source == "ATTRIBUTE":
+                found = bool(layer) and mesh.attributes.get(layer) is not None
+            elif source == "GROUP":
+                found = obj.vertex_groups.get(layer) is not None
+            elif source == "BONES":
+                found = armature is not None
+            else:
+                found = source == "MATERIAL" and obj.active_material is not None
+            if found:
+                written.append(segment)
+        return written
+
+    @staticmethod
+    def mesh_statistics(context, obj):
+        """
+        (vertices, triangles, bones, channels) of the export of obj, from its evaluated mesh (modifiers applied) without splitting it:
+        the export splits every edge, each face corner becomes a vertex.
+        """
+        settings = context.scene.san_settings
+        bl_obj, bl_armature = MESH_OT_sanmodel_export.resolve_object(obj)
+        object_eval = bl_obj.evaluated_get(context.evaluated_depsgraph_get())
+        mesh = object_eval.to_mesh()
+        corners = len(mesh.loops)
+        triangles = corners - 2 * len(mesh.polygons) # a polygon of n corners is n - 2 triangles
+        channels = MESH_OT_sanmodel_export.written_channels(settings, bl_obj, bl_armature, mesh)
+        object_eval.to_mesh_clear()
+        bones = len(bl_armature.data.bones) if bl_armature else 0
+        return corners, triangles, bones, channels
+
+    @staticmethod
+    def estimate_export(context, export_folder):
+        """
+        Dry run: the estimate of each file the export would write (cf estimate.estimate_file), nothing is written.
+        The extraction cost comes from the manifest of the last export in export_folder.
+        The unmodified imported objects are estimated from the amounts of their file, they are not extracted (cf original_segments).
+        """
+        settings = context.scene.san_settings
+        options = MESH_OT_sanmodel_export.export_options(settings)
+        extract_us = estimate.extract_cost(manifest.read_manifest(export_folder))
+        results = []
+        for job in MESH_OT_sanmodel_export.plan_export(context, export_folder, create=False):
+            name = pathlib.Path(job["path"]).stem
+            if not job["merge"]:
+                obj, armature = MESH_OT_sanmodel_export.resolve_object(job["root"])
+                amounts = MESH_OT_sanmodel_export.unmodified(context, obj, armature) and S.source_amounts(obj["sanmodel_path"], obj.get("sanmodel_entry", ""))
+                if amounts:
+                    result = estimate.estimate_file(name, amounts, options, extract_us, original=True)
+                    result["objects"] = 1
+                    results.append(result)
+                    continue
+            vertices = triangles = bones = 0
+            channels = set()
+            for obj in job["objects"]:
+                stats = MESH_OT_sanmodel_export.mesh_statistics(context, obj)
+                vertices += stats[0]
+                triangles += stats[1]
+                bones += 0 if job["merge"] else stats[2] # bindposes are ignored when merging
+                channels.update(stats[3]) # merged parts without a segment get default values
+            amounts = estimate.segment_amounts(vertices, triangles, bones, sorted(channels))
+            result = estimate.estimate_file(name, amounts, options, extract_us)
+            result["objects"] = len(job["objects"])
+            results.append(result)
+        return results
+
+    @staticmethod
+    def finish_manifest(context, export_folder, entries):
+        # writes the manifest of the export run, returns the over budget part of the end report
+        settings = context.scene.san_settings
+        path = manifest.write_manifest(export_folder, entries, settings.vertex_budget, settings.triangle_budget)
+        console_notice(f"manifest: {path}")
+        over = [entry for entry in entries if entry["over_budget"]]
+        return f", {len(over)} over budget" if over else ""
+
+    @staticmethod
+    def pack_exports(context, export_folder, entries):
+        # packs the files written by the export run in an archive, returns its part of the end report
+        settings = context.scene.san_settings
+        if not (settings.pack_on_export and entries):
+            return ""
+        folder = os.path.abspath(export_folder)
+        files = [(os.path.relpath(os.path.abspath(entry["path"]), folder).replace(os.sep, "/"), entry["path"])
+            for entry in sorted(entries, key=lambda e: e["path"])]
+        path = os.path.join(folder, "sanmodels" + archive.ARCHIVE_EXT)
+        archive.write_archive(path, files)
+        console_notice(f"archive: {path}")
+        return f", packed in {os.path.basename(path)}"
+
     def execute(self, context):
         export_folder = pathlib.Path("./_sanmodel_exports")
-        deep_selected = getDeepSelectionMeshes(context.selected_objects)
         console_notice("=================== EXPORT ===================")
         console_notice(f"export folder: {export_folder.absolute()}")
 
-        for obj in deep_selected:
-            # the file will be created in folders with parents names
-            parents = getParents(obj)
-            console_debug(f"{len(parents)} parents")
-            parents_folders = ""
-            for p in parents:
-                parents_folders = parents_folders + p.name + "\\"
-            os.makedirs(f"{export_folder.absolute()}\\{parents_folders}", exist_ok=True)
-
-            # checks if the file already exists, if needed, adds a suffix in windows style. ex: "filename (1).sanmodel"
-            suffix = ""
-            inc = 0
-            while (pathlib.Path(f"{export_folder}\\{parents_folders}{obj.name}{suffix}.sanmodel").is_file()):
-                inc = inc + 1
-                suffix = f" ({inc})"
-
-            MESH_OT_sanmodel_export.export_object(context, obj, f"{export_folder}\\{parents_folders}{obj.name}{suffix}.sanmodel")
+        exported = 0
+        entries = []
+        skipped = []
+        for job in MESH_OT_sanmodel_export.plan_export(context, export_folder, skipped=skipped):
+            if job["merge"]:
+                console_notice(f"merging {len(job['objects'])} objects as {job['root'].name}")
+                MESH_OT_sanmodel_export.export_merged(context, job["root"], job["objects"], job["path"], entries)
+            else:
+                MESH_OT_sanmodel_export.export_object(context, job["root"], job["path"], entries)
             console_notice("----")
+            exported += len(job["objects"])
         
-        end_report = f"exported {len(deep_selected)} objects"
-        self.report({"INFO"}, end_report)
+        end_report = f"exported {exported} objects" + MESH_OT_sanmodel_export.finish_manifest(context, export_folder, entries)
+        end_report += MESH_OT_sanmodel_export.pack_exports(context, export_folder, entries)
+        end_report += MESH_OT_sanmodel_export.skipped_report(skipped)
+        self.report({"WARNING"} if skipped else {"INFO"}, end_report)
         console_notice(end_report)
         console_notice("================= EXPORT END =================")
         return {"FINISHED"}
-   
+
+class SANMODEL_OT_export_estimate(Operator):
+    """estimate the size and duration of the export of the selection, without writing anything"""
+    bl_idname = "sanmodel.export_estimate"
+    bl_label = "Estimate export"
+
+    @classmethod
+    def poll(cls, context):
+        return (len(context.selected_objects) > 0)
+
+    def execute(self, context):
+        start = time.perf_counter()
+        estimates[:] = MESH_OT_sanmodel_export.estimate_export(context, pathlib.Path("./_sanmodel_exports"))
+        total_ms = sum(e["ms"] for e in estimates)
+        report = f"estimate: {len(estimates)} files, {sum(e['size'] for e in estimates)} bytes, about {total_ms / 1000:.1f} s"
+        console_notice(report + f" (estimated in {(time.perf_counter() - start)*1000:.1f} ms)")
+        self.report({"INFO"}, report)
+        return {"FINISHED"}
+
 blender_classes = [ 
     MESH_OT_sanmodel_export,
+    SANMODEL_OT_export_estimate,
 ]
 
 def register():
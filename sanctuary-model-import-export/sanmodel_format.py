@@ -0,0 +1,367 @@
+import os
+import zlib
+import lzma
+import struct
+import numpy as np
+from .utils import (
+    console_notice,
+    console_debug,
+    console_debug_data,
+)
+
+# sanmodel byte layout, shared by the importer, the exporter and the bpy-free tools.
+# This module must not import bpy. cf file structure in __init__.py
+seg_names = ["vertices", "normals", "tangents", "uv1", "uv2 (boneweights)", "uv3", "colors", "indices", "bindposes"]
+seg_vars = [3, 3, 4, 2, 2, 2, 4, 1, 16] # cf file structure
+SAN_ENDIAN = "<"
+SAN_VERTICES = 0
+SAN_NORMALS = 1
+SAN_TANGENTS = 2
+SAN_UV1 = 3
+SAN_UV2 = 4
+SAN_UV3 = 5
+SAN_COLORS = 6
+SAN_INDICES = 7
+SAN_BINDPOSES = 8
+
+# Optional compressed container, the segments are filtered then compressed with zlib or lzma:
+# [magic][version: uint8][codec: uint8][flags: uint8][reserved: uint8][name length: uint16][name: utf-8][9 amounts: int32]
+# followed by the compressed stream of the segments, with the layout of a sanmodel file without the name ([amount: int32][values]...).
+# Filters (flag FILTERED): the indices are delta encoded, then the values of each segment are split in 4 byte planes
+# (first byte of every value, then the second...), close floats share their high bytes and compress much better that way.
+COMPRESSED_MAGIC = b"\x89SANZ\r\n\x1a" # can't be the start of a name, 0x89 isn't valid utf-8
+COMPRESSED_VERSION = 1
+COMPRESSED_HEADER = "<8sBBBBH"
+CODECS = {"zlib": 1, "lzma": 2}
+FILTERED = 1
+STREAM_CHUNK = 1 << 16
+
+def seg_dtype(i):
+    # indices are the only int segment, everything else is float
+    return np.dtype(SAN_ENDIAN + ("i" if i == SAN_INDICES else "f"))
+
+def filter_segment(i, values):
+    # filtered bytes of a segment, cf compressed container
+    data = np.ascontiguousarray(values, dtype=seg_dtype(i)).ravel()
+    if i == SAN_INDICES and len(data):
+        delta = data.copy()
+        delta[1:] = data[1:] - data[:-1] # wraps like the int32 sum of unfilter_segment
+        data = delta
+    return data.view(np.uint8).reshape(-1, 4).T.tobytes()
+
+def unfilter_segment(i, raw):
+    # restores the values of a filtered segment in place, raw is a writable buffer
+    planes = np.frombuffer(raw, dtype=np.uint8).reshape(4, -1)
+    values = np.ascontiguousarray(planes.T).view(seg_dtype(i)).ravel()
+    if i == SAN_INDICES:
+        values = np.cumsum(values, dtype=seg_dtype(i))
+    np.frombuffer(raw, dtype=np.uint8)[:] = values.view(np.uint8)
+
+def pack_sanmodel(name, segments):
+    """
+    Serialize a name and the 9 flat segments arrays to the sanmodel layout.
+    Returns None if a segment has an invalid size.
+    """
+    data = bytearray(name + "\0", "utf-8") # [name\0]
+    for i, s in enumerate(segments):
+        array_size = len(s)
+        export_n = array_size // seg_vars[i]
+
+        console_debug(f"[Write Process] segment[{i}]: {seg_names[i]}: {export_n}, {array_size} values ({array_size*4} bytes)")
+        if (array_size != export_n * seg_vars[i]):
+            console_notice(f"Error: array size is not a multiple of {seg_vars[i]}")
+            return None
+
+        b_n = struct.pack(SAN_ENDIAN+"i", export_n)
+        b_array = np.ascontiguousarray(s, dtype=seg_dtype(i)).tobytes()
+
+        b_array_len = len(b_array)
+        if (b_array_len != array_size*4):
+            console_notice(f"Error with the byte data: byte array size: {b_array_len}, ie {b_array_len/4} values")
+            console_notice(f"[Write Process] segment[{i}]: {seg_names[i]}: {export_n}, {array_size} values ({array_size*4} bytes)")
+            return None
+
+        data[len(data):] = b_n
+        data[len(data):] = b_array
+        console_debug(f"full data len: {len(data)}")
+    return data
+
+def compressor(codec, level=None):
+    if codec == "zlib":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError(f"unknown codec {codec}, expected one of {', '.join(CODECS)}")
+
+def compress_sanmodel(f, name, segments, codec="zlib", level=None, filters=True):
+    """
+    Write a name and the 9 flat segments arrays in f as a compressed container, each segment is compressed as soon as it's filtered.
+    Returns False if a segment has an invalid size.
+    """
+    values = []
+    for i, s in enumerate(segments):
+        data = np.ascontiguousarray(s, dtype=seg_dtype(i)).ravel()
+        if len(data) % seg_vars[i]:
+            console_notice(f"Error: array size is not a multiple of {seg_vars[i]}")
+            return False
+        values.append(data)
+    amounts = [len(data) // seg_vars[i] for i, data in enumerate(values)]
+    encoded_name = name.encode()
+    stream = compressor(codec, level)
+    f.write(struct.pack(COMPRESSED_HEADER, COMPRESSED_MAGIC, COMPRESSED_VERSION, CODECS[codec], FILTERED if filters else 0, 0, len(encoded_name)))
+    f.write(encoded_name)
+    f.write(struct.pack(SAN_ENDIAN + "9i", *amounts))
+    for i, data in enumerate(values):
+        f.write(stream.compress(struct.pack(SAN_ENDIAN+"i", amounts[i])))
+        f.write(stream.compress(filter_segment(i, data) if filters else data.tobytes()))
+    f.write(stream.flush())
+    return True
+
+def write_sanmodel(path, name, segments, codec=None, level=None):
+    # codec: None for a plain sanmodel file, or a compressed container (cf CODECS)
+    if codec:
+        with open(path, 'wb') as f:
+            return compress_sanmodel(f, name, segments, codec, level)
+    data = pack_sanmodel(name, segments)
+    if data is None:
+        return False
+    console_debug("export full data:")
+    console_debug_data(data)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+def name_end(content, chunk=256):
+    # index of the null terminating the name, content can be any buffer (bytes, mmap, memoryview)
+    start = 0
+    while start < len(content):
+        end = bytes(content[start:start + chunk]).find(b'\0')
+        if end >= 0:
+            return start + end
+        start += chunk
+    return -1
+
+def parse_sanmodel(content):
+    """
+    Parse the content of a sanmodel file without copying the payload, content can be any buffer (bytes, mmap, memoryview).
+    Returns the name and the 9 segments as numpy arrays of shape (n, seg_vars[i]), or None if the data is invalid.
+    """
+    end = name_end(content)
+    if end < 0:
+        console_notice("Error with the specified file, invalid data")
+        return None
+    name = bytes(content[:end]).decode()
+    offset = end + 1
+    segments = []
+    for i, vars in enumerate(seg_vars):
+        if offset + 4 > len(content):
+            console_notice("Error with the specified file, invalid data: missing data")
+            return None
+        n = struct.unpack_from(SAN_ENDIAN+"i", content, offset)[0]
+        offset += 4
+        if n < 0 or offset + n * vars * 4 > len(content):
+            console_notice(f"Error with the specified file, invalid data: {seg_names[i]} amount is {n}")
+            return None
+        segments.append(np.frombuffer(content, dtype=seg_dtype(i), count=n*vars, offset=offset).reshape(n, vars))
+        offset += n * vars * 4
+        console_debug(f"[Read Process] segment[{i}]: {seg_names[i]}: {n}, {n*vars} values ({n*vars*4} bytes)")
+    if offset != len(content):
+        console_notice("Error with the specified file, invalid data: slicing left some data, this shouldn't be the case.")
+        return None
+    return name, segments
+
+def is_compressed(f):
+    # f: file (or mmap) at the start of the model, its position is restored
+    position = f.tell()
+    magic = f.read(len(COMPRESSED_MAGIC))
+    f.seek(position)
+    return magic == COMPRESSED_MAGIC
+
+def compressed_header(f):
+    # codec, flags, name and amounts of the container at the position of f, which is moved to the compressed stream
+    raw = f.read(struct.calcsize(COMPRESSED_HEADER))
+    if len(raw) < struct.calcsize(COMPRESSED_HEADER):
+        console_notice("Error with the specified file, invalid data: missing data")
+        return None
+    magic, version, codec, flags, _, name_length = struct.unpack(COMPRESSED_HEADER, raw)
+    codecs = {v: k for k, v in CODECS.items()}
+    if magic != COMPRESSED_MAGIC or version != COMPRESSED_VERSION or codec not in codecs:
+        console_notice(f"Error with the specified file, unsupported compressed container (version {version}, codec {codec})")
+        return None
+    name = f.read(name_length)
+    raw = f.read(4 * len(seg_vars))
+    if len(name) < name_length or len(raw) < 4 * len(seg_vars):
+        console_notice("Error with the specified file, invalid data: missing data")
+        return None
+    amounts = list(struct.unpack(SAN_ENDIAN + f"{len(seg_vars)}i", raw))
+    if min(amounts) < 0:
+        console_notice("Error with the specified file, invalid data: negative amount")
+        return None
+    return {
+        "codec": codecs[codec],
+        "flags": flags,
+        "name": name.decode(),
+        "amounts": amounts,
+        "size": len(COMPRESSED_MAGIC) + 6 + name_length + 4 * len(seg_vars),
+    }
+
+def decompress_sanmodel(f, size=-1, until=None):
+    """
+    Decompress the container at the position of f (size bytes at most) to the content of the plain sanmodel file.
+    The stream is decompressed chunk by chunk in the final buffer, then the filters are reverted in place.
+    until: only the first segments are needed, the decompression stops after them (the next bytes are left to 0).
+    Returns a bytearray, or None if the data is invalid.
+    """
+    info = compressed_header(f)
+    if info is None:
+        return None
+    name = info["name"].encode()
+    sizes = [4 + n * vars * 4 for n, vars in zip(info["amounts"], seg_vars)]
+    content = bytearray(len(name) + 1 + sum(sizes))
+    content[:len(name)] = name
+    view = memoryview(content)
+    until = len(seg_vars) if until is None else until
+    end = len(name) + 1 + sum(sizes[:until])
+    position = len(name) + 1
+    remaining = size - info["size"] if size >= 0 else -1
+    stream = zlib.decompressobj() if info["codec"] == "zlib" else lzma.LZMADecompressor()
+    while position < end and remaining != 0:
+        chunk = f.read(STREAM_CHUNK if remaining < 0 else min(STREAM_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        data = stream.decompress(chunk)
+        if position + len(data) > len(content):
+            console_notice("Error with the specified file, invalid data: more data than the amounts")
+            return None
+        view[position:position + len(data)] = data
+        position += len(data)
+    if position < end:
+        console_notice("Error with the specified file, invalid data: missing data")
+        return None
+
+    offset = len(name) + 1
+    for i in range(until):
+        n = struct.unpack_from(SAN_ENDIAN+"i", content, offset)[0]
+        if n != info["amounts"][i]:
+            console_notice(f"Error with the specified file, invalid data: {seg_names[i]} amount is {n}, {info['amounts'][i]} in the header")
+            return None
+        if info["flags"] & FILTERED and n:
+            unfilter_segment(i, view[offset + 4:offset + sizes[i]])
+        offset += sizes[i]
+    return content
+
+def read_sanmodel_bytes(path, start=0, size=-1):
+    # content of a sanmodel file (or of the model at start in the file), decompressed if it's a compressed container
+    with open(path, 'rb') as f:
+        f.seek(start)
+        if is_compressed(f):
+            return decompress_sanmodel(f, size)
+        return f.read(size)
+
+def load_sanmodel(path):
+    content = read_sanmodel_bytes(path)
+    return parse_sanmodel(content) if content is not None else None
+
+def probe_sanmodel(path, bounds=True, start=0, size=None):
+    """
+    Read the name and the 9 amounts of a sanmodel file, seeking over the payloads.
+    bounds: also compute the bounding box, only the vertices segment is read (memory mapped).
+    start, size: the model is a part of the file (an archive entry, cf archive.py), the offsets are from the start of the file.
+    Returns a dict (name, amounts, offsets and byte size of each segment, bounds), or None if the layout doesn't match the file.
+    """
+    file_size = os.path.getsize(path) - start if size is None else size
+    with open(path, 'rb') as f:
+        f.seek(start)
+        if is_compressed(f):
+            return probe_compressed(f, path, bounds, start, file_size)
+        name = b""
+        while True:
+            chunk = f.read(256)
+            end = chunk.find(b'\0')
+            if end >= 0:
+                name += chunk[:end]
+                break
+            if not chunk:
+                console_notice("Error with the specified file, invalid data")
+                return None
+            name += chunk
+        offset = start + len(name) + 1
+        file_size += start # end of the model in the file
+        amounts = []
+        offsets = []
+        for i, vars in enumerate(seg_vars):
+            f.seek(offset)
+            raw = f.read(4)
+            if len(raw) < 4:
+                console_notice("Error with the specified file, invalid data: missing data")
+                return None
+            n = struct.unpack(SAN_ENDIAN+"i", raw)[0]
+            offset += 4 + n * vars * 4
+            if n < 0 or offset > file_size:
+                console_notice(f"Error with the specified file, invalid data: {seg_names[i]} amount is {n}")
+                return None
+            amounts.append(n)
+            offsets.append(offset - n * vars * 4)
+    if offset != file_size:
+        console_notice("Error with the specified file, invalid data: slicing left some data, this shouldn't be the case.")
+        return None
+
+    header = {
+        "path": path,
+        "name": name.decode(),
+        "file_size": file_size - start,
+        "amounts": amounts,
+        "offsets": offsets,
+        "sizes": [4 + n * vars * 4 for n, vars in zip(amounts, seg_vars)],
+        "bounds": None,
+        "start": start,
+        "compression": None,
+    }
+    if bounds and amounts[SAN_VERTICES]:
+        vertices = np.memmap(path, dtype=seg_dtype(SAN_VERTICES), mode='r', offset=offsets[SAN_VERTICES], shape=(amounts[SAN_VERTICES], 3))
+        header["bounds"] = (vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist())
+        del vertices
+    return header
+
+def probe_compressed(f, path, bounds, start, size):
+    # probe_sanmodel of a compressed container: the amounts are in its header, only the vertices are decompressed for the bounds
+    info = compressed_header(f)
+    if info is None:
+        return None
+    amounts = info["amounts"]
+    header = {
+        "path": path,
+        "name": info["name"],
+        "file_size": size,
+        "amounts": amounts,
+        "offsets": None, # the segments are compressed, cf read_segment
+        "sizes": [4 + n * vars * 4 for n, vars in zip(amounts, seg_vars)],
+        "bounds": None,
+        "start": start,
+        "compression": info["codec"],
+    }
+    if bounds and amounts[SAN_VERTICES]:
+        vertices = read_segment(path, header, SAN_VERTICES)
+        if vertices is None:
+            return None
+        header["bounds"] = (vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist())
+    return header
+
+def read_segment(path, header, i):
+    """
+    one segment of a probed file (cf probe_sanmodel), read without decoding the others. Returns an array (n, seg_vars[i])
+    A compressed file is decompressed up to the end of the segment, None if its data is invalid.
+    """
+    amount = header["amounts"][i]
+    if header["compression"]:
+        with open(path, 'rb') as f:
+            f.seek(header["start"])
+            content = decompress_sanmodel(f, header["file_size"], i + 1)
+        if content is None:
+            return None
+        offset = len(header["name"].encode()) + 1 + sum(header["sizes"][:i]) + 4
+        data = np.frombuffer(content, dtype=seg_dtype(i), count=amount * seg_vars[i], offset=offset)
+    else:
+        data = np.fromfile(path, dtype=seg_dtype(i), count=amount * seg_vars[i], offset=header["offsets"][i])
+    return data.reshape(amount, seg_vars[i])
@@ -11,10 +11,12 @@ from .utils import (
     console_notice,
     console_debug,
     console_debug_data,
-    vecSanmodelToBlender,
-    vecBlenderToSanmodel,
 )
 from . import sanmodel as S
+from . import mesh_ops
+from . import textures
+
+NORMALS_TOLERANCE = 1e-3 # distance between unit normals, ~0.06°
 
 def uv_to_boneweights(uv_array):
     # uv are tuples of 2 float values
@@ -32,13 +34,39 @@ class MESH_OT_sanmodel_import(Operator):
         )
     
     @staticmethod
-    def apply_normals(obj, normals, swap_yz_axis):
-        obj.data.use_auto_smooth = True # or it will not work
-        used = normals[:]
-        if swap_yz_axis:
-            used = [vecSanmodelToBlender(n) for n in normals]
-        obj.data.normals_split_custom_set_from_vertices(used)
-        obj.data.calc_normals_split()
+    def apply_normals(obj, normals, basis, tolerance=NORMALS_TOLERANCE):
+        # custom split normals are expensive to store and evaluate,
+        # they are skipped when the file normals are the ones Blender computes (flat or smooth shading)
+        mesh = obj.data
+        if not len(normals):
+            return
+        used = mesh_ops.transform_normals(basis, normals).astype(np.float32)
+        if len(used) != len(mesh.vertices):
+            console_notice(f"normals: {len(used)} normals for {len(mesh.vertices)} vertices, ignored")
+            return
+
+        loop_vertex = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertex)
+        loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+        loop_polygon = np.repeat(np.arange(len(mesh.polygons)), loop_total)
+        loop_normals = used[loop_vertex]
+
+        face_normals = np.empty(len(mesh.polygons) * 3, dtype=np.float32)
+        mesh.polygons.foreach_get("normal", face_normals)
+        if mesh_ops.same_directions(loop_normals, face_normals.reshape(-1, 3)[loop_polygon], tolerance):
+            console_notice("normals: same as the faces normals, flat shading")
+            return
+        vertex_normals = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("normal", vertex_normals)
+        if mesh_ops.same_directions(used, vertex_normals.reshape(-1, 3), tolerance):
+            console_notice("normals: same as the vertices normals, smooth shading")
+            mesh.polygons.foreach_set("use_smooth", np.ones(len(mesh.polygons), dtype=bool))
+            return
+
+        mesh.use_auto_smooth = True # or it will not work
+        mesh.normals_split_custom_set_from_vertices(used)
+        mesh.calc_normals_split()
 
     @staticmethod
     def apply_tangents(obj, tangents, uvname):
@@ -51,45 +79,47 @@ class MESH_OT_sanmodel_import(Operator):
     def create_uv_layer(obj, uv_name, uv):
         #https://b3d.interplanety.org/en/working-with-uv-maps-through-the-blender-api/
         #cube example : 6 quadfaces -> 12 triangles -> 36 vertices -> 36 uv
-        obj.data.uv_layers.new(name=uv_name)
-        i = 0
-        for poly in obj.data.polygons:
-            for idx in poly.vertices:
-                obj.data.uv_layers[uv_name].data[i].uv = uv[idx]
-                i += 1
-        console_notice(f"created uv_layer {uv_name} (len: {len(obj.data.uv_layers[uv_name].data)})")
+        # uv layers are per face corner: the uv of the vertex of each corner, written at once (the layer is reused if it exists)
+        mesh = obj.data
+        uv_layer = mesh.uv_layers.get(uv_name) or mesh.uv_layers.new(name=uv_name)
+        loop_vertex = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertex)
+        uv_layer.data.foreach_set("uv", np.asarray(uv, dtype=np.float32).reshape(-1, 2)[loop_vertex].ravel())
+        console_notice(f"created uv_layer {uv_name} (len: {len(uv_layer.data)})")
 
     @staticmethod
-    def apply_uv(context, obj, uv_array, uv_name):
+    def apply_uv(context, obj, uv_array, uv_name, settings=None):
+        # settings: the import settings, the current ones by default (cf update_object)
         if not len(uv_array):
             return
-        settings = context.scene.san_settings
-        used = uv_array
+        settings = settings or context.scene.san_settings
+        used = np.array(uv_array, dtype=np.float32).reshape(-1, 2)
         if settings.mirror_uv_vertically:
-            used = [(e[0], 1-e[1]) for e in uv_array]
+            used[:, 1] = 1 - used[:, 1]
         MESH_OT_sanmodel_import.create_uv_layer(obj, uv_name, used)
 
     @staticmethod
     def apply_colors(context, obj, colors):
+        # 1 color per vertex: a point domain color attribute, written at once (the face corners are not expanded)
+        # the export reads point and corner attributes, cf MESH_OT_sanmodel_export.attribute_values
         settings = context.scene.san_settings
 
         if len(colors) == 0:
             return
+        mesh = obj.data
+        colors = np.ascontiguousarray(colors, dtype=np.float32).reshape(-1, 4)
+        if len(colors) != len(mesh.vertices):
+            console_notice(f"colors: {len(colors)} colors for {len(mesh.vertices)} vertices, ignored")
+            return
         console_notice("applying colors...")
-        # https://blenderscripting.blogspot.com/2013/03/vertex-color-map.html
-        # further https://blenderscripting.blogspot.com/2013/03/painting-vertex-color-map-using.html
-        if not obj.data.vertex_colors:
-            obj.data.vertex_colors.new(name=obj.name+"VertexColor")
-        color_layer = obj.data.vertex_colors.active  
-
-        i = 0
-        for poly in obj.data.polygons:
-            for idx in poly.vertices:
-                color_layer.data[i].color = colors[idx]
-                i += 1
-        
-        if settings.shading_nodes:
-            # create a mat from the vertex_color
+        color_layer = mesh.color_attributes.get(obj.name+"VertexColor") # updated file, cf update_object
+        if not color_layer or color_layer.domain != "POINT" or color_layer.data_type != "FLOAT_COLOR":
+            color_layer = mesh.color_attributes.new(name=obj.name+"VertexColor", type="FLOAT_COLOR", domain="POINT")
+        color_layer.data.foreach_set("color", colors.ravel())
+        mesh.color_attributes.active_color = color_layer
+
+        if settings.use_vertex_colors and settings.shading_nodes and not mesh.materials:
+            # create a mat from the vertex_color (textures materials are used instead, if any)
             mat = bpy.data.materials.new(obj.name+"Mat")
             # todo: settings: [x] transparency
             obj.data.materials.append(mat)
@@ -107,14 +137,15 @@ class MESH_OT_sanmodel_import(Operator):
 
     @staticmethod
     def apply_bindposes(context, obj, data):
-        if len(data) == 0 or len(data) % 16 > 0:
+        # data: 1 row of 16 values per bone
+        if len(data) == 0:
             return
-        bone_count = len(data) // 16
-        bone_matrix = [Matrix(np.array(data[x*16:(x+1)*16]).reshape(4,4).tolist()) for x in range(bone_count)]
+        bone_count = len(data)
+        bone_matrix = [Matrix(np.reshape(row, (4, 4)).tolist()) for row in data]
 
         bpy.ops.object.armature_add(align='CURSOR')
         armature = context.active_object
-        armature.name = S.smd.name + 'Rig'
+        armature.name = obj.name + 'Rig'
 
         if False:
             # because the armature is created at the cursor and is parent to the mesh object, the mesh object must be set to 0 location, 
@@ -166,45 +197,169 @@ class MESH_OT_sanmodel_import(Operator):
         bpy.ops.object.modifier_add(type='ARMATURE')
         context.object.modifiers["Armature"].object = armature
 
+    @staticmethod
+    def apply_skinning(context, obj, segments):
+        if (not len(segments[S.SAN_BINDPOSES]) and len(segments[S.SAN_UV2])):
+            console_debug("Model has no bindposes. SAN_UV2 is not boneweights (cf apply_uv2).")
+        else:
+            MESH_OT_sanmodel_import.apply_boneweights(context, obj, uv_to_boneweights(segments[S.SAN_UV2]))
+
+    @staticmethod
+    def apply_uv2(context, obj, segments, settings=None):
+        # only skinned meshes use uv2.x as bone ids, props can have uv data for their shaders in it
+        if not len(segments[S.SAN_BINDPOSES]):
+            MESH_OT_sanmodel_import.apply_uv(context, obj, segments[S.SAN_UV2], S.UV2_NAME, settings)
+
+    @staticmethod
+    def update_boneweights(obj, segments):
+        # the bone groups of obj get the vertices of the updated file, the armature is kept
+        if not (len(segments[S.SAN_BINDPOSES]) and len(segments[S.SAN_UV2])):
+            return
+        bone_ids = np.asarray(uv_to_boneweights(segments[S.SAN_UV2])).astype(np.int64)
+        for i in range(len(segments[S.SAN_BINDPOSES])):
+            v_group = obj.vertex_groups.get('Bone_' + str(i))
+            if v_group:
+                v_group.add(np.flatnonzero(bone_ids == i).tolist(), 1.0, 'REPLACE')
+
+    @staticmethod
+    def update_object(context, obj, smd):
+        """
+        The file of obj changed: its mesh is rebuilt in place from smd (no bpy.ops, it runs in a timer, cf watch_ops),
+        with its normals, uv, colors and bone groups. The transform, materials, modifiers and armature are kept.
+        """
+        # the coordinates of its import, the settings may have changed since
+        settings = S.object_settings(obj, context.scene.san_settings)
+        op = MESH_OT_sanmodel_import
+        seg = smd.segments
+        if obj.get("sanmodel_proxy"):
+            # the resolution it was created with, the setting may have changed since
+            smd.update_obj(context, obj, obj["sanmodel_proxy"])
+            return
+        smd.update_obj(context, obj)
+        op.apply_normals(obj, seg[S.SAN_NORMALS], S.coordinate_basis(settings))
+        op.apply_uv(context, obj, seg[S.SAN_UV1], S.UV1_NAME, settings)
+        op.apply_uv(context, obj, seg[S.SAN_UV3], S.UV3_NAME, settings)
+        op.apply_uv2(context, obj, seg, settings)
+        op.apply_colors(context, obj, seg[S.SAN_COLORS])
+        op.update_boneweights(obj, seg)
+        S.store_metadata(context, obj, smd, settings)
+
+    @staticmethod
+    def import_steps(context, smd, proxy_resolution=0, created=None):
+        # the object creation split in steps, so it can also be run in chunks (cf async_ops)
+        # proxy_resolution: only the simplified mesh is created (cf SanmodelData.create_obj)
+        # created: list receiving the created object
+        settings = context.scene.san_settings
+        op = MESH_OT_sanmodel_import
+        seg = smd.segments
+        created = [] if created is None else created
+        def obj():
+            return created[0]
+
+        if proxy_resolution:
+            return [("proxy", lambda: created.append(smd.create_obj(context, proxy_resolution)))]
+        steps = [
+            ("mesh", lambda: created.append(smd.create_obj(context))),
+            ("normals", lambda: op.apply_normals(obj(), seg[S.SAN_NORMALS], S.coordinate_basis(settings))),
+            ("uv1", lambda: op.apply_uv(context, obj(), seg[S.SAN_UV1], S.UV1_NAME)),
+            ("tangents", lambda: op.apply_tangents(obj(), seg[S.SAN_TANGENTS], S.UV1_NAME)), # requires UV1
+            ("uv3", lambda: op.apply_uv(context, obj(), seg[S.SAN_UV3], S.UV3_NAME)),
+            ("uv2", lambda: op.apply_uv2(context, obj(), seg)), # boneweights when there are bindposes, cf apply_skinning
+        ]
+        if settings.use_textures:
+            steps.append(("textures", lambda: textures.apply_textures(context, obj(), smd.name, smd.path, S.UV1_NAME)))
+        steps.append(("colors", lambda: op.apply_colors(context, obj(), seg[S.SAN_COLORS])))
+        steps.append(("bindposes", lambda: op.apply_bindposes(context, obj(), seg[S.SAN_BINDPOSES])))
+        steps.append(("boneweights", lambda: op.apply_skinning(context, obj(), seg)))
+        steps.append(("metadata", lambda: S.store_metadata(context, obj(), smd))) # last, the hash is the one of the complete object
+        return steps
+
     def execute(self, context):
         settings = context.scene.san_settings
-        if not S.smd:
+        if not (settings.valid_file and S.header):
             console_notice("Error: No data available to create the object")
             return {"CANCELLED"}
+        # the import panel only probed the file, it's decoded now if it isn't in the registry
+        data = S.load_model(settings.path, settings.archive_entry)
+        if not data:
+            self.report({'ERROR'}, f"Error with the specified file (see System Console for more detail)")
+            return {"CANCELLED"}
+        S.set_current_model(context, data)
 
-        for i, seg in enumerate(S.smd.segments):
+        for i, seg in enumerate(data.segments):
             console_debug(f"{i}: {S.seg_names[i]}: len: {len(seg)}")
             # console_debug_data(seg)
         # return {"FINISHED"}
 
-        obj = S.smd.create_obj(context)
-        self.apply_normals(obj, S.smd.segments[S.SAN_NORMALS], settings.swap_yz_axis)
-        self.apply_uv(context, obj, S.smd.segments[S.SAN_UV1], S.UV1_NAME)
-        self.apply_tangents(obj, S.smd.segments[S.SAN_TANGENTS], S.UV1_NAME) # requires UV1
-        # self.apply_uv(context, obj, S.smd.segments[S.SAN_UV2], S.UV2_NAME) # these are in fact boneweights
-        self.apply_uv(context, obj, S.smd.segments[S.SAN_UV3], S.UV3_NAME)
-        if settings.use_vertex_colors:
-            self.apply_colors(context, obj, S.smd.segments[S.SAN_COLORS])
-        self.apply_bindposes(context, obj, S.smd.segments[S.SAN_BINDPOSES])
-        if (not len(S.smd.segments[S.SAN_BINDPOSES]) and len(S.smd.segments[S.SAN_UV2])):
-            console_debug("Model has no bindposes. Ignoring segments SAN_UV2 (boneweights).")
-        else:
-            self.apply_boneweights(context, obj, uv_to_boneweights(S.smd.segments[S.SAN_UV2]))
+        for name, step in self.import_steps(context, data, S.proxy_resolution(context, S.header)):
+            step()
         console_notice("Object created")
         return {"FINISHED"}
 
+class SANMODEL_OT_full_resolution(Operator):
+    """replace the selected proxies by their full resolution model, with the same transform, parent and collections"""
+    bl_idname = "sanmodel.full_resolution"
+    bl_label = "Load full resolution"
+
+    @classmethod
+    def poll(cls, context):
+        return any(obj.get("sanmodel_proxy") for obj in context.selected_objects)
+
+    @staticmethod
+    def replace(context, proxy, obj):
+        name = proxy.name
+        obj.parent = proxy.parent
+        obj.matrix_world = proxy.matrix_world.copy()
+        for child in proxy.children:
+            child.parent = obj
+        for collection in proxy.users_collection:
+            if obj.name not in collection.objects:
+                collection.objects.link(obj)
+        if context.scene.collection not in proxy.users_collection:
+            context.scene.collection.objects.unlink(obj)
+        mesh = proxy.data
+        bpy.data.objects.remove(proxy)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+        obj.name = name
+
+    def execute(self, context):
+        proxies = [obj for obj in context.selected_objects if obj.get("sanmodel_proxy")]
+        replaced = 0
+        for proxy in proxies:
+            # the proxies of a same file share its model in the registry
+            source = (proxy["sanmodel_path"], proxy["sanmodel_entry"])
+            data = S.load_model(*source)
+            if not data:
+                console_notice(f"{proxy.name}: can't read {source[0]} {source[1]}")
+                continue
+            created = []
+            for name, step in MESH_OT_sanmodel_import.import_steps(context, data, created=created):
+                step()
+            self.replace(context, proxy, created[0])
+            replaced += 1
+        if replaced < len(proxies):
+            self.report({'WARNING'}, f"{len(proxies) - replaced} proxies not replaced (see System Console for more detail)")
+        console_notice(f"full resolution: {replaced} proxies replaced")
+        return {"FINISHED"}
+
 blender_classes = [ 
     MESH_OT_sanmodel_import,
+    SANMODEL_OT_full_resolution,
 ]
 
 def register():
     for bl_class in blender_classes:
         bpy.utils.register_class(bl_class)
+    bpy.app.handlers.load_post.append(textures.load_post)
     console_notice("sanmodel_importer.py registered")
 
 def unregister():
     for bl_class in blender_classes:
         bpy.utils.unregister_class(bl_class)
+    if textures.load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(textures.load_post)
+    textures.clear_cache()
     console_notice("sanmodel_importer.py unregistered")
 
 if __name__ == "__main__":
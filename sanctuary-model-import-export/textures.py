@@ -0,0 +1,148 @@
+import os
+import re
+import bpy
+from .utils import (
+    console_notice,
+    console_debug,
+)
+
+# Textures are found by naming convention, from the model name (ex: "fir-01" -> "fir"):
+#   <base>.dds          base color
+#   <base>_normal.dds   normal map
+#   <base>_mask.dds     alpha mask
+TEXTURE_EXTENSIONS = [".dds", ".png", ".tga"]
+TEXTURE_SUFFIXES = {
+    "base": "",
+    "normal": "_normal",
+    "mask": "_mask",
+}
+
+# images loaded by this addon, by absolute path. The same datablock is reused by every imported object.
+image_cache = {}
+# files of the texture folders (folder: (mtime, {lowercase name: path})), to avoid hitting the disk for every candidate.
+# A folder is listed again when its mtime changes (a file was added, removed or renamed).
+folder_cache = {}
+
+def texture_folders(settings, model_path):
+    # the configured folder, or a "Textures" folder next to the models folder, and the model folder itself
+    model_dir = os.path.dirname(model_path)
+    if settings.textures_folder:
+        return [bpy.path.abspath(settings.textures_folder)]
+    return [os.path.join(os.path.dirname(model_dir), "Textures"), model_dir]
+
+def list_folder(folder):
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return {}
+    cached = folder_cache.get(folder)
+    if cached is None or cached[0] != mtime:
+        try:
+            cached = (mtime, {f.lower(): os.path.join(folder, f) for f in os.listdir(folder)})
+        except OSError:
+            cached = (mtime, {})
+        folder_cache[folder] = cached
+    return cached[1]
+
+def base_names(model_name):
+    # "fir-01" -> ["fir-01", "fir"], "oak2" -> ["oak2", "oak"]
+    names = [model_name.lower()]
+    stripped = re.sub(r"[\s_\-.]*\d+$", "", names[0])
+    if stripped and stripped != names[0]:
+        names.append(stripped)
+    return names
+
+def find_textures(folders, model_name):
+    """
+    Returns {"base": path, "normal": path, "mask": path}, with only the found textures.
+    The first base name with a base color texture is used.
+    """
+    for folder in folders:
+        files = list_folder(folder)
+        for name in base_names(model_name):
+            found = {}
+            for kind, suffix in TEXTURE_SUFFIXES.items():
+                for ext in TEXTURE_EXTENSIONS:
+                    path = files.get(name + suffix + ext)
+                    if path:
+                        found[kind] = path
+                        break
+            if "base" in found:
+                return found
+    return {}
+
+def load_image(path, non_color=False):
+    path = os.path.abspath(path)
+    image = image_cache.get(path)
+    try:
+        if image and image.name in bpy.data.images:
+            return image
+    except ReferenceError: # removed by the user, or a new file was opened
+        pass
+    image = bpy.data.images.load(path, check_existing=True)
+    if non_color:
+        image.colorspace_settings.name = "Non-Color"
+    image_cache[path] = image
+    console_debug(f"loaded image {path}")
+    return image
+
+def get_material(textures, use_alpha, uv_name):
+    # one material per texture set, shared by all the objects using it
+    key = "|".join(textures.get(kind, "") for kind in TEXTURE_SUFFIXES) + f"|{use_alpha}"
+    for mat in bpy.data.materials:
+        if mat.get("sanmodel_textures") == key:
+            return mat
+
+    name = os.path.splitext(os.path.basename(textures["base"]))[0]
+    mat = bpy.data.materials.new(name + "Mat")
+    mat["sanmodel_textures"] = key
+    mat.use_nodes = True
+    node_tree = mat.node_tree
+    bsdf = node_tree.nodes.get("Principled BSDF")
+    assert(bsdf) # make sure it exists to continue
+
+    base = node_tree.nodes.new(type="ShaderNodeTexImage")
+    base.image = load_image(textures["base"])
+    base.location = (-600, 300)
+    node_tree.links.new(base.outputs["Color"], bsdf.inputs["Base Color"])
+
+    if "normal" in textures:
+        normal = node_tree.nodes.new(type="ShaderNodeTexImage")
+        normal.image = load_image(textures["normal"], non_color=True)
+        normal.location = (-600, -300)
+        normal_map = node_tree.nodes.new(type="ShaderNodeNormalMap")
+        normal_map.uv_map = uv_name
+        normal_map.location = (-250, -300)
+        node_tree.links.new(normal.outputs["Color"], normal_map.inputs["Color"])
+        node_tree.links.new(normal_map.outputs["Normal"], bsdf.inputs["Normal"])
+
+    if use_alpha or "mask" in textures:
+        mat.blend_method = "CLIP"
+        mat.shadow_method = "CLIP"
+        if "mask" in textures:
+            mask = node_tree.nodes.new(type="ShaderNodeTexImage")
+            mask.image = load_image(textures["mask"], non_color=True)
+            mask.location = (-600, 0)
+            node_tree.links.new(mask.outputs["Color"], bsdf.inputs["Alpha"])
+        else:
+            node_tree.links.new(base.outputs["Alpha"], bsdf.inputs["Alpha"])
+    return mat
+
+def apply_textures(context, obj, model_name, model_path, uv_name):
+    settings = context.scene.san_settings
+    textures = find_textures(texture_folders(settings, model_path), model_name)
+    if not textures:
+        console_notice(f"no texture found for {model_name}")
+        return False
+    console_notice(f"textures: {', '.join(os.path.basename(p) for p in textures.values())}")
+    obj.data.materials.append(get_material(textures, settings.use_alpha, uv_name))
+    return True
+
+def clear_cache():
+    image_cache.clear()
+    folder_cache.clear()
+
+@bpy.app.handlers.persistent
+def load_post(*args):
+    # the images of the previous file are gone
+    clear_cache()
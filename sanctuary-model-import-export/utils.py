@@ -49,12 +49,6 @@ def console_debug_data(*args):
         else:
             print(prefix_debug, "[...]")
 
-def vecSanmodelToBlender(vec):
-    return (vec[0], vec[2], vec[1])
-
-def vecBlenderToSanmodel(vec):
-    return (vec[0], vec[2], vec[1])
-
 def getDeepSelectionMeshes(selected_objects):
     selected = []
     for obj in selected_objects:
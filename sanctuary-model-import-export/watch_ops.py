@@ -0,0 +1,109 @@
+import os
+import bpy
+from bpy.types import (
+    Operator,
+)
+from .utils import (
+    console_notice,
+)
+from . import sanmodel as S
+from .sanmodel_importer import MESH_OT_sanmodel_import
+
+# Watch of the imported files: a timer stats the source of every imported object (once per file, the stat index),
+# and compares it with the signature stored on the object when it was created or last updated.
+# The objects of the changed files are updated in place (cf MESH_OT_sanmodel_import.update_object),
+# each changed file is parsed once (cf S.load_model), the unchanged ones are never read.
+
+WATCH_IDLE = 1.0 # seconds between the checks of the setting when the watch is disabled
+
+stat_index = {} # path: signature, of the last poll
+failed = {} # path: signature of a file that couldn't be read, not read again until it changes
+
+def watch_folder(settings):
+    # only the files of this folder are watched, every imported file if it's empty
+    return os.path.normcase(os.path.abspath(bpy.path.abspath(settings.watch_folder))) if settings.watch_folder else ""
+
+def watched_objects(scene, folder=""):
+    # the mesh objects imported from a file (of folder), in object mode (an update would be lost in edit mode)
+    objects = []
+    for obj in scene.objects:
+        path = obj.get("sanmodel_path")
+        if obj.type != "MESH" or not path or obj.mode != "OBJECT":
+            continue
+        if folder and not os.path.normcase(os.path.abspath(path)).startswith(folder + os.sep):
+            continue
+        objects.append(obj)
+    return objects
+
+def sync(context):
+    """
+    Updates the objects whose file changed since they were created or updated, returns (updated objects, failed files).
+    """
+    settings = context.scene.san_settings
+    stat_index.clear()
+    updated = 0
+    errors = set()
+    for obj in watched_objects(context.scene, watch_folder(settings)):
+        path = obj["sanmodel_path"]
+        if path not in stat_index:
+            stat_index[path] = S.source_signature(path)
+        signature = stat_index[path]
+        if not signature or signature == obj.get("sanmodel_signature") or failed.get(path) == signature:
+            continue
+        # the objects of a same file share its model in the registry, it's read again because its signature changed
+        smd = S.load_model(path, obj.get("sanmodel_entry", ""))
+        if smd is None:
+            # probably still being written: read again when its signature changes
+            failed[path] = signature
+            errors.add(path)
+            continue
+        failed.pop(path, None)
+        MESH_OT_sanmodel_import.update_object(context, obj, smd)
+        obj["sanmodel_signature"] = signature
+        updated += 1
+    if updated or errors:
+        console_notice(f"watch: {updated} objects updated" + (f", can't read {', '.join(sorted(errors))}" if errors else ""))
+    return updated, len(errors)
+
+def watch_timer():
+    # persistent timer, registered with the addon: it only polls the files when the watch is enabled
+    context = bpy.context
+    if not context.scene:
+        return WATCH_IDLE
+    settings = context.scene.san_settings
+    if not settings.watch_changes:
+        return WATCH_IDLE
+    sync(context)
+    return settings.watch_interval
+
+class SANMODEL_OT_watch_sync(Operator):
+    """update the imported objects whose file changed, in place"""
+    bl_idname = "sanmodel.watch_sync"
+    bl_label = "Sync changed files"
+
+    def execute(self, context):
+        updated, errors = sync(context)
+        self.report({"WARNING"} if errors else {"INFO"}, f"{updated} objects updated" + (f", {errors} files can't be read" if errors else ""))
+        return {"FINISHED"}
+
+blender_classes = [
+    SANMODEL_OT_watch_sync,
+]
+
+def register():
+    for bl_class in blender_classes:
+        bpy.utils.register_class(bl_class)
+    bpy.app.timers.register(watch_timer, first_interval=WATCH_IDLE, persistent=True)
+    console_notice("watch_ops.py registered")
+
+def unregister():
+    if bpy.app.timers.is_registered(watch_timer):
+        bpy.app.timers.unregister(watch_timer)
+    for bl_class in blender_classes:
+        bpy.utils.unregister_class(bl_class)
+    stat_index.clear()
+    failed.clear()
+    console_notice("watch_ops.py unregistered")
+
+if __name__ == "__main__":
+    register()
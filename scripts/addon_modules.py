@@ -0,0 +1,16 @@
+import importlib
+import os
+import sys
+import types
+
+# The addon __init__.py needs bpy. Outside of Blender, the bpy-free modules of the addon
+# (sanmodel_format, mesh_ops, sanmodel_diff...) are imported through an empty package instead.
+ADDON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sanctuary-model-import-export")
+PACKAGE = "sanmodel_addon"
+
+def import_addon_module(name):
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
@@ -0,0 +1,82 @@
+"""
+Compare the size and the load time of the compressed sanmodel containers with the plain files, without Blender:
+    python scripts/compression_benchmark.py [folder] [--repeat 5] [--level 6] [--json]
+Each file of the folder (Models by default) is written with every codec, with and without filters, in a temporary folder.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from addon_modules import import_addon_module
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Models")
+VARIANTS = [
+    ("plain", None, False),
+    ("zlib", "zlib", True),
+    ("zlib (no filter)", "zlib", False),
+    ("lzma", "lzma", True),
+    ("lzma (no filter)", "lzma", False),
+]
+
+def load_time(F, path, repeat):
+    # best of repeat loads, the first one fills the file cache
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        F.load_sanmodel(path)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the compressed sanmodel files")
+    parser.add_argument("folder", nargs="?", default=MODELS_DIR)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--level", type=int, default=None, help="compression level (zlib 0-9, lzma preset 0-9)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    F = import_addon_module("sanmodel_format")
+    archive = import_addon_module("archive")
+    results = {label: {"size": 0, "write_ms": 0.0, "load_ms": 0.0} for label, _, _ in VARIANTS}
+    files = archive.folder_files(args.folder)
+    if not files:
+        print(f"no sanmodel file in {args.folder}")
+        return 2
+    with tempfile.TemporaryDirectory() as folder:
+        for name, path in files:
+            model = F.load_sanmodel(path)
+            if model is None:
+                print(f"{name}: invalid, skipped")
+                continue
+            model = (model[0], [s.ravel() for s in model[1]])
+            for label, codec, filters in VARIANTS:
+                target = os.path.join(folder, label.replace(" ", "_") + ".sanmodel")
+                start = time.perf_counter()
+                with open(target, "wb") as f:
+                    if codec:
+                        F.compress_sanmodel(f, *model, codec, args.level, filters)
+                    else:
+                        f.write(F.pack_sanmodel(*model))
+                result = results[label]
+                result["write_ms"] += (time.perf_counter() - start) * 1000
+                result["size"] += os.path.getsize(target)
+                result["load_ms"] += load_time(F, target, args.repeat)
+
+    plain = results["plain"]
+    for result in results.values():
+        result["ratio"] = result["size"] / plain["size"]
+        result["load_ratio"] = result["load_ms"] / plain["load_ms"]
+    if args.json:
+        print(json.dumps({"files": len(files), "results": results}, indent=4))
+        return 0
+    print(f"{len(files)} files of {args.folder}")
+    print(f"{'':<18}{'size':>12}{'ratio':>8}{'write':>12}{'load':>12}{'load ratio':>12}")
+    for label, result in results.items():
+        print(f"{label:<18}{result['size']:>12}{result['ratio']:>8.3f}{result['write_ms']:>9.1f} ms{result['load_ms']:>9.1f} ms{result['load_ratio']:>12.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Round-trip regression suite, run by Blender in background:
+    blender --background --factory-startup --python scripts/roundtrip.py -- [--models Models] [--tolerance 1e-4] [--report report.json]
+
+Every .sanmodel of the models folder goes through the addon import (process_data, create_obj, apply_*)
+and export (prepare_mesh, extract_*), then the exported file is parsed again and compared with the original,
+after welding the vertices split by the export.
+Import/export durations and file sizes are recorded for each file.
+Exits with 1 when a model is different.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import bpy
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ADDON = "sanctuary-model-import-export"
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="sanmodel import/export round-trip")
+    parser.add_argument("--models", default=os.path.join(REPO_DIR, "Models"))
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    parser.add_argument("--report", default="", help="write the results as json in this file")
+    parser.add_argument("--output", default="", help="folder of the exported files (temporary folder by default)")
+    return parser.parse_args(argv)
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+    for armature in list(bpy.data.armatures):
+        bpy.data.armatures.remove(armature)
+
+def roundtrip(addon, path, output, tolerance, known_issues):
+    S = addon.sanmodel
+    F = addon.sanmodel_format
+    context = bpy.context
+    result = {"file": os.path.basename(path), "size": os.path.getsize(path)}
+
+    start = time.perf_counter()
+    header = S.read_header(path)
+    if not header:
+        result["error"] = "invalid file"
+        return result
+    context.scene.san_settings.path = path
+    S.show_header(context, header)
+    if bpy.ops.mesh.sanmodel_import() != {"FINISHED"}: # decodes the file, like "Create new object"
+        result["error"] = "invalid file"
+        return result
+    result["import_ms"] = (time.perf_counter() - start) * 1000
+    obj = next(o for o in context.scene.objects if o.type == "MESH")
+
+    export_path = os.path.join(output, result["file"])
+    start = time.perf_counter()
+    addon.sanmodel_exporter.MESH_OT_sanmodel_export.export_object(context, obj, export_path)
+    result["export_ms"] = (time.perf_counter() - start) * 1000
+    result["export_size"] = os.path.getsize(export_path)
+
+    original = F.load_sanmodel(path)
+    exported = F.load_sanmodel(export_path)
+    if exported is None:
+        result["error"] = "invalid export"
+        return result
+    report = addon.sanmodel_diff.diff_models(original[1], exported[1], tolerance, weld=True, ignore=known_issues)
+    result["ok"] = report["ok"]
+    result["diff"] = report
+    return result
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, REPO_DIR)
+    addon = importlib.import_module(ADDON)
+    addon.register()
+    F = addon.sanmodel_format
+
+    # reported, but not failing the suite (cf addon progress in __init__.py)
+    known_issues = {
+        F.SAN_BINDPOSES: "bindposes round-trip is not supported yet",
+    }
+
+    settings = bpy.context.scene.san_settings
+    settings.use_vertex_colors = True
+    settings.shading_nodes = True
+    settings.reuse_unmodified = False # the imported objects are unmodified, the suite checks the full export path
+
+    output = args.output or tempfile.mkdtemp(prefix="sanmodel_roundtrip_")
+    os.makedirs(output, exist_ok=True)
+    files = sorted(f for f in os.listdir(args.models) if f.endswith(".sanmodel"))
+    results = []
+    for f in files:
+        clear_scene()
+        result = roundtrip(addon, os.path.join(args.models, f), output, args.tolerance, known_issues)
+        results.append(result)
+        status = "OK" if result.get("ok") else result.get("error", "DIFFERENT")
+        print(f"{status:10} {f:30} import {result.get('import_ms', 0):8.1f} ms  export {result.get('export_ms', 0):8.1f} ms  "
+              f"size {result['size']:>9} -> {result.get('export_size', 0):>9}")
+        if "diff" in result and not result["ok"]:
+            print("\n".join("    " + line for line in addon.sanmodel_diff.format_report(result["diff"])))
+
+    for i, reason in known_issues.items():
+        print(f"ignored: {F.seg_names[i]}: {reason}")
+    if args.report:
+        with open(args.report, "w") as fs:
+            json.dump(results, fs, indent=4)
+    failed = [r["file"] for r in results if not r.get("ok")]
+    print(f"{len(results) - len(failed)}/{len(results)} models OK")
+    addon.unregister()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
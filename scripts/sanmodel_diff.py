@@ -0,0 +1,35 @@
+"""
+Compare 2 sanmodel files, without Blender:
+    python scripts/sanmodel_diff.py reference.sanmodel other.sanmodel [--tolerance 1e-4] [--weld] [--json]
+Exits with 1 when the models are different, so it can be used as a CI check.
+"""
+import argparse
+import json
+import sys
+import time
+from addon_modules import import_addon_module
+
+def main():
+    parser = argparse.ArgumentParser(description="Geometry diff of 2 sanmodel files")
+    parser.add_argument("reference")
+    parser.add_argument("other")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    parser.add_argument("--weld", action="store_true", help="merge identical vertices before comparing (split exports)")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    sanmodel_diff = import_addon_module("sanmodel_diff")
+    start = time.perf_counter()
+    report = sanmodel_diff.diff_files(args.reference, args.other, args.tolerance, args.weld)
+    if report is None:
+        return 2
+    report["duration"] = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print("\n".join(sanmodel_diff.format_report(report)))
+        print(f"{report['duration']*1000:.1f} ms")
+    return 0 if report["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Pack sanmodel files in one archive, list or extract it, without Blender:
+    python scripts/sanpack.py pack Models models.sanpack [--compress zlib|lzma]
+    python scripts/sanpack.py list models.sanpack
+    python scripts/sanpack.py extract models.sanpack folder [names...]
+"""
+import argparse
+import sys
+import time
+from addon_modules import import_addon_module
+
+def main():
+    parser = argparse.ArgumentParser(description="sanmodel archives (.sanpack)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="pack the sanmodel files of a folder (sub folders included)")
+    pack.add_argument("folder")
+    pack.add_argument("archive")
+    pack.add_argument("--compress", choices=["zlib", "lzma"], help="compress the entries (filtered segments)")
+    listing = commands.add_parser("list", help="list the models of an archive")
+    listing.add_argument("archive")
+    extract = commands.add_parser("extract", help="extract the models (all by default) as individual files")
+    extract.add_argument("archive")
+    extract.add_argument("folder")
+    extract.add_argument("names", nargs="*")
+    args = parser.parse_args()
+
+    archive = import_addon_module("archive")
+    start = time.perf_counter()
+    if args.command == "pack":
+        toc = archive.pack_folder(args.folder, args.archive, args.compress)
+        print(f"packed {len(toc)} files in {args.archive}")
+    elif args.command == "list":
+        toc = archive.read_toc(args.archive)
+        if toc is None:
+            return 2
+        for name, (offset, length) in toc.items():
+            print(f"{offset:>12} {length:>12} {name}")
+        print(f"{len(toc)} files")
+    else:
+        with archive.SanmodelArchive(args.archive) as pack:
+            missing = [name for name in args.names if name not in pack.toc]
+            if missing:
+                print(f"not in the archive: {', '.join(missing)}")
+                return 2
+            paths = pack.extract(args.folder, args.names or None)
+        print(f"extracted {len(paths)} files in {args.folder}")
+    print(f"{(time.perf_counter() - start)*1000:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())